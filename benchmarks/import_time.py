@@ -0,0 +1,81 @@
+"""
+This module measures the time to import each entry point of the package in a
+fresh interpreter, the startup cost paid by every CLI call and by every worker
+process started with spawn.
+
+For each entry point it reports the best import time of a few runs and the
+heavy dependencies loaded by the import (music21, matplotlib...), which should
+only be imported by the code that uses them.
+
+Run from the root of the repository:
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --modules src.task_c4,src.cli --max-seconds 0.5
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+ENTRY_POINTS = (
+    "src.cli",
+    "src.task_c1",
+    "src.task_c3",
+    "src.task_c4",
+    "src.timing_for_one_piece",
+    "src.evaluation",
+    "src.parameter_sweep",
+    "src.batch_render",
+    "src.timing_plotter",
+)
+HEAVY_MODULES = ("music21", "matplotlib", "seaborn", "pandas", "pyarrow")
+
+_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "heavy": sorted(name for name in {heavy!r} if name in sys.modules)}}))
+"""
+
+
+def time_import(module: str, repeats: int = 3) -> dict:
+    """
+    Time the import of a module in new interpreters
+    :param module: name of the module
+    :param repeats: number of interpreters started
+    :return: dict with the best time in seconds and the heavy modules loaded by the import
+    """
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", _SCRIPT.format(module=module, heavy=HEAVY_MODULES)],
+                                capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output))
+    return {"seconds": min(run["seconds"] for run in runs), "heavy": runs[0]["heavy"]}
+
+
+def main(arguments: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure the import time of the entry points")
+    parser.add_argument("--modules", default=None, help="comma separated modules, every entry point if not set")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", default=None, help="write the results as JSON")
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="exit with 1 when an import takes longer than this")
+    args = parser.parse_args(arguments)
+
+    modules = args.modules.split(",") if args.modules else ENTRY_POINTS
+    results = {}
+    for module in modules:
+        results[module] = time_import(module, args.repeats)
+        print(f"{module:28} {results[module]['seconds'] * 1000:8.1f} ms  {', '.join(results[module]['heavy'])}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.max_seconds is not None and any(result["seconds"] > args.max_seconds for result in results.values()):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+"""
+This module times the stages of the pipeline on a synthetic corpus (see
+synthetic_corpus) of pieces of several sizes.
+
+For each stage and each size it reports the best time of a few runs after a
+warm-up run, the peak memory allocated by Python (measured with tracemalloc on
+a separate run), and the scaling exponent of the time with the number of
+measures. Every run uses a new music21 scratch directory, so the MIDI files are
+parsed and not loaded from the pickles music21 writes there. The results can be
+saved as a baseline, and a later run compared against it fails when a stage
+became slower than the tolerance.
+
+Run from the root of the repository:
+
+    python -m benchmarks.run_benchmarks --sizes 16,64,256 --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --sizes 16,64,256 --compare benchmarks/baseline.json
+
+Baselines depend on the machine, they are not committed.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.synthetic_corpus import generate_corpus
+from src.beat_annotations import parse_beat_annotations
+from src.feature_cache import configure_cache
+from src.midi_features import load_midi_features
+from src.task_c1 import get_phrase_boundaries, get_scaled_differences_in_volumes, get_times_threshold
+from src.task_c3 import extract_intervals_and_durations, find_pattern_starts, get_c3_result, run_on_whole_dataset
+from src.task_c4 import get_c1_result, run_c1_whole_dataset
+from src.timing_for_one_piece import get_average_timing_one_piece
+
+# Absolute difference in seconds under which a slowdown is considered noise
+NOISE_SECONDS = 0.005
+
+
+def _read_lines(path: str) -> list:
+    with open(path, "r") as f:
+        return f.readlines()
+
+
+def _velocity_threshold(features):
+    return get_times_threshold(features.times, get_scaled_differences_in_volumes(features.volumes), 0.15)
+
+
+def _quiet(function):
+    # The whole dataset runners print every piece
+    def run(argument):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return function(argument)
+    return run
+
+
+# name -> (setup: piece folder -> argument of the stage, stage function)
+STAGES = {
+    "parse_annotations": (lambda folder: _read_lines(folder + "/Performer00_annotations.txt"),
+                          parse_beat_annotations),
+    "average_timing": (lambda folder: folder, get_average_timing_one_piece),
+    "phrase_boundaries": (lambda folder: folder, get_phrase_boundaries),
+    "midi_features": (lambda folder: folder + "/Performer00.mid", load_midi_features),
+    "velocity_threshold": (lambda folder: load_midi_features(folder + "/Performer00.mid"), _velocity_threshold),
+    "repeat_search": (lambda folder: extract_intervals_and_durations(folder + "/midi_score.mid"),
+                      find_pattern_starts),
+    "c1_piece": (lambda folder: folder, get_c1_result),
+    "c3_piece": (lambda folder: folder + "/midi_score.mid", get_c3_result),
+    "c1_dataset": (lambda folder: os.path.dirname(folder), _quiet(run_c1_whole_dataset)),
+    "c3_dataset": (lambda folder: os.path.dirname(folder), _quiet(run_on_whole_dataset)),
+}
+
+
+@contextlib.contextmanager
+def new_music21_scratch():
+    """
+    Point the scratch directory of music21 (in memory, the user settings are not written) at a new temporary
+    directory: music21 pickles each parsed file there and loads the pickle instead of parsing the file again
+    """
+    try:
+        from music21 import environment
+    except ImportError:
+        yield
+        return
+    settings = environment.Environment()
+    previous = settings["directoryScratch"]
+    with tempfile.TemporaryDirectory() as scratch:
+        settings["directoryScratch"] = scratch
+        try:
+            yield
+        finally:
+            settings["directoryScratch"] = previous
+
+
+def time_stage(function, argument, repeats: int, warmups: int = 1) -> dict:
+    """
+    Time a stage
+    :param function: stage function
+    :param argument: argument of the stage
+    :param repeats: number of timed runs
+    :param warmups: number of runs before the timed ones (imports, first allocations)
+    :return: dict with the best time in seconds and the peak memory in bytes
+    """
+    for _ in range(warmups):
+        with new_music21_scratch():
+            function(argument)
+    timings = []
+    for _ in range(repeats):
+        with new_music21_scratch():
+            start = time.perf_counter()
+            function(argument)
+            timings.append(time.perf_counter() - start)
+    with new_music21_scratch():
+        tracemalloc.start()
+        try:
+            function(argument)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {"seconds": min(timings), "peak_bytes": peak}
+
+
+def get_scaling_exponent(sizes: list, seconds: list) -> float or None:
+    """
+    Get the exponent k of a time growing like size ** k (least squares fit in log-log)
+    :param sizes: sizes of the pieces
+    :param seconds: time for each size
+    :return: the exponent or None if there are less than two sizes
+    """
+    points = [(math.log(size), math.log(max(second, 1e-9))) for size, second in zip(sizes, seconds)]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if variance == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+
+def run_benchmarks(corpus: str, sizes: list, stages: list = None, repeats: int = 3, nb_performances: int = 3,
+                   seed: int = 0, warmups: int = 1) -> dict:
+    """
+    Generate the corpus and time every stage on one piece of each size
+    :param corpus: folder of the synthetic corpus
+    :param sizes: numbers of measures of the pieces
+    :param stages: names of the stages to run, all of them if None
+    :param repeats: number of timed runs of each stage
+    :param nb_performances: number of performances of each piece
+    :param seed: seed of the corpus
+    :param warmups: number of untimed runs of each stage before the timed ones
+    :return: dict stage -> {"sizes": {size: {"seconds", "peak_bytes"}}, "exponent": ...}
+    """
+    # The cache would make every run after the first one measure a cache hit
+    configure_cache(enabled=False)
+    pieces = generate_corpus(corpus, sizes, nb_performances=nb_performances, seed=seed)
+    results = {}
+    for name in stages or STAGES:
+        setup, function = STAGES[name]
+        by_size = {}
+        for size in sizes:
+            by_size[str(size)] = time_stage(function, setup(pieces[size][0]), repeats, warmups)
+            print(f"{name:20} {size:6d} measures  {by_size[str(size)]['seconds'] * 1000:10.2f} ms  "
+                  f"{by_size[str(size)]['peak_bytes'] / 1024 ** 2:8.2f} MiB", file=sys.stderr)
+        exponent = get_scaling_exponent(sizes, [by_size[str(size)]["seconds"] for size in sizes])
+        results[name] = {"sizes": by_size, "exponent": exponent}
+    return results
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float = 0.25) -> list:
+    """
+    Find the stages that became slower than the baseline
+    :param results: output of run_benchmarks
+    :param baseline: output of run_benchmarks saved earlier
+    :param tolerance: allowed relative slowdown
+    :return: list of (stage, size, baseline seconds, seconds)
+    """
+    regressions = []
+    for name, result in results.items():
+        for size, timing in result["sizes"].items():
+            reference = baseline.get(name, {}).get("sizes", {}).get(size)
+            if reference is None:
+                continue
+            if timing["seconds"] > reference["seconds"] * (1 + tolerance) and \
+                    timing["seconds"] - reference["seconds"] > NOISE_SECONDS:
+                regressions.append((name, size, reference["seconds"], timing["seconds"]))
+    return regressions
+
+
+def main(arguments: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on a synthetic corpus")
+    parser.add_argument("--sizes", default="16,64,256", help="comma separated numbers of measures")
+    parser.add_argument("--stages", default=None, help=f"comma separated stages among {', '.join(STAGES)}")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--warmups", type=int, default=1, help="untimed runs of each stage before the timed ones")
+    parser.add_argument("--performances", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus", default=None, help="folder of the corpus, a temporary folder if not set")
+    parser.add_argument("--output", default=None, help="write the results as JSON")
+    parser.add_argument("--save-baseline", default=None, help="write the results as a baseline")
+    parser.add_argument("--compare", default=None, help="baseline to compare to, exits with 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown")
+    args = parser.parse_args(arguments)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    stages = args.stages.split(",") if args.stages else None
+    with contextlib.ExitStack() as stack:
+        corpus = args.corpus or stack.enter_context(tempfile.TemporaryDirectory())
+        results = run_benchmarks(corpus, sizes, stages, args.repeats, args.performances, args.seed,
+                                 args.warmups)
+
+    for name, result in results.items():
+        if result["exponent"] is not None:
+            print(f"{name:20} scales as size^{result['exponent']:.2f}")
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for name, size, reference, seconds in regressions:
+            print(f"REGRESSION {name} at {size} measures: {reference * 1000:.2f} ms -> {seconds * 1000:.2f} ms")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+"""
+This module generates a synthetic corpus laid out like the ASAP dataset, to
+benchmark the pipeline at controllable sizes.
+
+Each piece folder holds a score MIDI (``midi_score.mid``), its score
+annotations, and several performances. Each performance has a MIDI file and
+its own annotations. The melody is built from one-measure motifs, and blocks
+of measures are copied from earlier in the piece so that the repeat search has
+repeats to find. The performances slow down and play louder every eight
+measures, so the phrase detection of task C1 finds boundaries.
+"""
+
+import os
+import random
+import struct
+
+TICKS_PER_QUARTER = 480
+SCORE_BPM = 120
+BEATS_PER_MEASURE = 4
+PHRASE_LENGTH = 8
+RHYTHMS = [
+    [1, 1, 1, 1],
+    [0.5, 0.5, 1, 1, 1],
+    [1, 0.5, 0.5, 2],
+    [2, 1, 1],
+    [0.5, 0.5, 0.5, 0.5, 1, 1],
+    [1.5, 0.5, 1, 1],
+]
+
+
+def _variable_length(value: int) -> bytes:
+    data = [value & 0x7F]
+    value >>= 7
+    while value:
+        data.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(data))
+
+
+def _track(events: list) -> bytes:
+    # events: list of (tick, order, bytes), note-offs (order 0) before note-ons (order 1) at the same tick
+    data = b""
+    tick = 0
+    for event_tick, _, event in sorted(events, key=lambda e: (e[0], e[1])):
+        data += _variable_length(event_tick - tick) + event
+        tick = event_tick
+    data += _variable_length(0) + b"\xff\x2f\x00"
+    return b"MTrk" + struct.pack(">I", len(data)) + data
+
+
+def write_midi_file(path: str, parts: list, bpm: float = SCORE_BPM, beats_per_measure: int = BEATS_PER_MEASURE):
+    """
+    Write a format 1 Standard MIDI File
+    :param path: path to the file
+    :param parts: list of parts, each a list of notes (start in quarters, duration in quarters, pitch, velocity)
+    :param bpm: tempo of the file
+    :param beats_per_measure: numerator of the time signature (quarter beats)
+    """
+    microseconds_per_quarter = round(60_000_000 / bpm)
+    conductor = [
+        (0, 0, b"\xff\x51\x03" + microseconds_per_quarter.to_bytes(3, "big")),
+        (0, 0, b"\xff\x58\x04" + bytes([beats_per_measure, 2, 24, 8])),
+    ]
+    tracks = [_track(conductor)]
+    for channel, notes in enumerate(parts):
+        events = []
+        for start, duration, pitch, velocity in notes:
+            on = round(start * TICKS_PER_QUARTER)
+            off = max(on + 1, round((start + duration) * TICKS_PER_QUARTER))
+            events.append((on, 1, bytes([0x90 | channel, pitch, velocity])))
+            events.append((off, 0, bytes([0x80 | channel, pitch, 0])))
+        tracks.append(_track(events))
+    with open(path, "wb") as f:
+        f.write(b"MThd" + struct.pack(">IHHH", 6, 1, len(tracks), TICKS_PER_QUARTER) + b"".join(tracks))
+
+
+def generate_score(nb_measures: int, repeat_probability: float, rng: random.Random) -> list:
+    """
+    Generate the notes of a two part score with repeated blocks of measures
+    :param nb_measures: number of measures
+    :param repeat_probability: probability to copy an earlier block of four measures
+    :param rng: random generator
+    :return: list of two parts, each a list of (start, duration, pitch, velocity)
+    """
+    measures = []
+    pitch = 67
+    while len(measures) < nb_measures:
+        if len(measures) >= 8 and rng.random() < repeat_probability:
+            start = rng.randrange(0, len(measures) - 4)
+            measures.extend(measures[start:start + 4])
+            continue
+        motif = []
+        for duration in rng.choice(RHYTHMS):
+            pitch = min(84, max(55, pitch + rng.choice([-4, -2, -1, 1, 2, 3, 5])))
+            motif.append((duration, pitch))
+        measures.append(motif)
+    measures = measures[:nb_measures]
+
+    melody = []
+    bass = []
+    for number, motif in enumerate(measures):
+        offset = number * BEATS_PER_MEASURE
+        for duration, note_pitch in motif:
+            melody.append((offset, duration, note_pitch, 80))
+            offset += duration
+        root = 48 + (motif[0][1] % 12)
+        bass.append((number * BEATS_PER_MEASURE, 2, root, 70))
+        bass.append((number * BEATS_PER_MEASURE + 2, 2, root + 7, 70))
+    return [melody, bass]
+
+
+def get_performed_beats(nb_beats: int, rng: random.Random) -> list:
+    """
+    Generate the performed onset of each beat: a slightly varying tempo
+    with a ritardando at the end of every phrase
+    :param nb_beats: number of beats
+    :param rng: random generator
+    :return: list of onsets in seconds (one more than nb_beats, for the end of the last beat)
+    """
+    beat_seconds = 60 / SCORE_BPM
+    onsets = [0.0]
+    phrase_beats = PHRASE_LENGTH * BEATS_PER_MEASURE
+    for beat in range(nb_beats):
+        position = beat % phrase_beats
+        stretch = rng.uniform(0.95, 1.05)
+        if position >= phrase_beats - BEATS_PER_MEASURE:
+            stretch *= 1.3 + 0.1 * (position - phrase_beats + BEATS_PER_MEASURE)
+        onsets.append(onsets[-1] + beat_seconds * stretch)
+    return onsets
+
+
+def perform(parts: list, performed_beats: list, rng: random.Random) -> list:
+    """
+    Play a score with the timing of performed_beats and expressive velocities
+    :param parts: parts of the score
+    :param performed_beats: onset in seconds of each beat
+    :param rng: random generator
+    :return: parts of the performance, in quarters at the score tempo
+    """
+    quarters_per_second = SCORE_BPM / 60
+
+    def to_performed(quarter):
+        beat = min(int(quarter), len(performed_beats) - 2)
+        fraction = quarter - beat
+        seconds = performed_beats[beat] + fraction * (performed_beats[beat + 1] - performed_beats[beat])
+        return seconds * quarters_per_second
+
+    phrase_quarters = PHRASE_LENGTH * BEATS_PER_MEASURE
+    performed_parts = []
+    for notes in parts:
+        performed_notes = []
+        for start, duration, pitch, velocity in notes:
+            performed_start = max(0.0, to_performed(start) + rng.uniform(-0.02, 0.02))
+            performed_end = to_performed(start + duration) * rng.uniform(0.9, 1.0)
+            accent = 35 if start % phrase_quarters == 0 else 0
+            performed_velocity = min(127, max(1, velocity + accent + rng.randint(-8, 8)))
+            performed_notes.append((performed_start, max(0.05, performed_end - performed_start), pitch,
+                                    performed_velocity))
+        performed_parts.append(performed_notes)
+    return performed_parts
+
+
+def write_annotations(path: str, onsets: list, nb_beats: int):
+    """
+    Write an annotation file in the ASAP format (onset, onset, beat type with meter and key on the first beat)
+    :param path: path to the file
+    :param onsets: onset in seconds of each beat
+    :param nb_beats: number of beats
+    """
+    with open(path, "w") as f:
+        for beat in range(nb_beats):
+            if beat == 0:
+                label = f"db,{BEATS_PER_MEASURE}/4,0"
+            elif beat % BEATS_PER_MEASURE == 0:
+                label = "db"
+            else:
+                label = "b"
+            f.write(f"{onsets[beat]:.6f}\t{onsets[beat]:.6f}\t{label}\n")
+
+
+def generate_piece(folder: str, nb_measures: int, nb_performances: int = 3, repeat_probability: float = 0.3,
+                   seed: int = 0):
+    """
+    Generate one piece folder
+    :param folder: path to the piece folder
+    :param nb_measures: number of measures
+    :param nb_performances: number of performances
+    :param repeat_probability: probability to copy an earlier block of four measures
+    :param seed: seed of the random generator
+    """
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    parts = generate_score(nb_measures, repeat_probability, rng)
+    nb_beats = nb_measures * BEATS_PER_MEASURE
+    write_midi_file(os.path.join(folder, "midi_score.mid"), parts)
+    write_annotations(os.path.join(folder, "midi_score_annotations.txt"),
+                      [beat * 60 / SCORE_BPM for beat in range(nb_beats)], nb_beats)
+    for performance in range(nb_performances):
+        performed_beats = get_performed_beats(nb_beats, rng)
+        write_midi_file(os.path.join(folder, f"Performer{performance:02d}.mid"), perform(parts, performed_beats, rng))
+        write_annotations(os.path.join(folder, f"Performer{performance:02d}_annotations.txt"), performed_beats,
+                          nb_beats)
+
+
+def generate_corpus(root: str, sizes: list, pieces_per_size: int = 1, nb_performances: int = 3,
+                    repeat_probability: float = 0.3, seed: int = 0) -> dict:
+    """
+    Generate a corpus with pieces of several sizes, one composer folder per size
+    :param root: path to the corpus
+    :param sizes: numbers of measures of the pieces
+    :param pieces_per_size: number of pieces of each size
+    :param nb_performances: number of performances of each piece
+    :param repeat_probability: probability to copy an earlier block of four measures
+    :param seed: seed of the random generator
+    :return: dict number of measures -> list of piece folders
+    """
+    pieces = {}
+    for size in sizes:
+        pieces[size] = []
+        for index in range(pieces_per_size):
+            folder = os.path.join(root, f"Size{size}", f"piece{index}").replace("\\", "/")
+            generate_piece(folder, size, nb_performances, repeat_probability, seed=seed + size * 1000 + index)
+            pieces[size].append(folder)
+    return pieces
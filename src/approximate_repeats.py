@@ -0,0 +1,262 @@
+"""
+This module contains an approximate search for the repeating patterns used by
+task C3, for the repeats that are not exact copies: a repeat with an ornament
+or a changed note. It is run on sequences that do not change when a passage
+is transposed (the intervals between roots) or played with scaled durations
+(the rhythm classes, the ratio of each duration to the previous one quantized
+in RHYTHM_STEPS steps per doubling).
+
+Two windows of ``window`` tokens are a repeat when their edit distance is at
+most ``max_distance`` (an edit is an onset changed, added or removed). The
+first window is cut into max_distance + 1 blocks: at least one block has no
+edit, so it is found exactly in the second window, shifted by at most
+max_distance. The blocks are hashed with a polynomial hash of the token
+codes and the equal hashes give the candidate pairs of windows, only these
+are compared. The blocks found more than ``max_bucket`` times (a repeated
+note, a scale) are not used, so that the number of candidates grows linearly
+with the number of onsets. The matching windows are chained along their
+diagonal into the longest repeats. An added or removed onset moves the rest
+of a repeat to a neighbouring diagonal, and a window with an edit can also
+match shifted by one onset: the chains of diagonals at most max_distance
+apart whose first occurrences overlap are merged into one repeat.
+"""
+
+import math
+from fractions import Fraction
+
+import numpy as np
+
+from src import instrumentation
+from src.repeat_search import encode_sequence, get_scaled_prefix_durations
+
+DEFAULT_WINDOW = 8
+DEFAULT_MAX_DISTANCE = 1
+DEFAULT_MAX_BUCKET = 32
+RHYTHM_STEPS = 4
+HASH_BASE = 1000003
+HASH_MODULUS = 2 ** 31 - 1
+
+
+def get_rhythm_classes(durations: list, steps: int = RHYTHM_STEPS) -> list:
+    """
+    Quantize the ratio of each duration to the previous one
+    :param durations: list of durations in quarter lengths
+    :param steps: number of classes per doubling of the duration
+    :return: list of int (round(steps * log2(ratio))), None for the first onset and around a zero duration
+    """
+    classes = [None] * min(len(durations), 1)
+    for previous, duration in zip(durations, durations[1:]):
+        classes.append(round(steps * math.log2(duration / previous)) if previous > 0 and duration > 0 else None)
+    return classes
+
+
+def hash_blocks(codes: np.ndarray, length: int) -> np.ndarray:
+    """
+    Hash every block of consecutive codes
+    :param codes: int array
+    :param length: number of codes of a block
+    :return: int64 array, the hash of codes[start:start + length] for each start
+    """
+    nb_blocks = len(codes) - length + 1
+    hashes = np.zeros(max(nb_blocks, 0), dtype=np.int64)
+    for step in range(length):
+        # Codes are below the number of tokens, the product fits in 64 bits
+        hashes = (hashes * HASH_BASE + codes[step:step + nb_blocks] + 1) % HASH_MODULUS
+    return hashes
+
+
+def get_seed_pairs(hashes: np.ndarray, max_bucket: int = DEFAULT_MAX_BUCKET):
+    """
+    Enumerate the pairs of blocks with the same hash
+    :param hashes: output of hash_blocks
+    :param max_bucket: the hashes found more often than this are skipped
+    :return: generator of (first block, later block)
+    """
+    order = np.argsort(hashes, kind="stable")
+    sorted_hashes = hashes[order]
+    bounds = np.flatnonzero(np.diff(sorted_hashes)) + 1
+    for bucket in np.split(order, bounds):
+        if len(bucket) < 2 or len(bucket) > max_bucket:
+            continue
+        starts = bucket.tolist()
+        for index, first in enumerate(starts):
+            for second in starts[index + 1:]:
+                yield first, second
+
+
+def fit_window(window: list, text: list, max_distance: int) -> tuple or None:
+    """
+    Find the part of text closest to window (edit distance, any start and end in text)
+    :param window: list of tokens
+    :param text: list of tokens
+    :param max_distance: the search stops as soon as every alignment has more edits
+    :return: (distance, start in text) or None if the distance is more than max_distance
+    """
+    # distances[c] and starts[c]: best alignment of the window so far ending before text[c]
+    distances = [0] * (len(text) + 1)
+    starts = list(range(len(text) + 1))
+    for row, token in enumerate(window, 1):
+        new_distances = [row] + [0] * len(text)
+        new_starts = [0] * (len(text) + 1)
+        for column in range(1, len(text) + 1):
+            best = distances[column - 1] + (token != text[column - 1])
+            start = starts[column - 1]
+            if distances[column] + 1 < best:
+                best, start = distances[column] + 1, starts[column]
+            if new_distances[column - 1] + 1 < best:
+                best, start = new_distances[column - 1] + 1, new_starts[column - 1]
+            new_distances[column], new_starts[column] = best, start
+        if min(new_distances) > max_distance:
+            return None
+        distances, starts = new_distances, new_starts
+    distance = min(distances)
+    return distance, starts[distances.index(distance)]
+
+
+def find_matching_windows(tokens: list, window: int = DEFAULT_WINDOW, max_distance: int = DEFAULT_MAX_DISTANCE,
+                          max_bucket: int = DEFAULT_MAX_BUCKET) -> set:
+    """
+    Find the pairs of windows at most max_distance edits apart, the second one after the end of the first one
+    :param tokens: list of hashable tokens
+    :param window: number of tokens of a window
+    :param max_distance: maximal edit distance
+    :param max_bucket: the blocks found more often than this are not used as seeds
+    :return: set of (start of the first window, start of the second window)
+    """
+    if window < 1 or not 0 <= max_distance < window:
+        raise ValueError("The window needs at least one token more than the maximal distance")
+    size = len(tokens)
+    if size < 2 * window:
+        return set()
+    block_length = window // (max_distance + 1)
+    codes = encode_sequence(tokens)
+    candidates = set()
+    for first, second in get_seed_pairs(hash_blocks(codes, block_length), max_bucket):
+        # The block is the block number `block` of a window starting at first - block * block_length
+        for block in range(max_distance + 1):
+            start = first - block * block_length
+            if 0 <= start <= size - window:
+                candidates.add((start, second - block * block_length))
+    instrumentation.count("windows_compared", len(candidates))
+
+    matches = set()
+    for start, other in candidates:
+        low = max(other - max_distance, start + window)
+        high = min(other + window + max_distance, size)
+        if high - low < window - max_distance:
+            continue
+        first_window = tokens[start:start + window]
+        if low <= other <= size - window and \
+                sum(a != b for a, b in zip(first_window, tokens[other:other + window])) <= max_distance:
+            # Only substitutions, the most common case
+            matches.add((start, other))
+            continue
+        fitted = fit_window(first_window, tokens[low:high], max_distance)
+        if fitted is not None:
+            matches.add((start, low + fitted[1]))
+    return matches
+
+
+def chain_windows(matches: set, window: int, max_shift: int = DEFAULT_MAX_DISTANCE) -> list:
+    """
+    Chain the matching windows of consecutive starts on the same diagonal, then merge the chains of diagonals
+    at most max_shift apart whose first occurrences overlap
+    :param matches: output of find_matching_windows
+    :param window: number of tokens of a window
+    :param max_shift: largest difference between the diagonals of merged chains, the maximal distance of the windows
+    :return: list of (first start, repeat start, length in tokens), the first occurrence ends before the repeat
+    """
+    chains = []
+    chain = None
+    for start, other in sorted(matches, key=lambda match: (match[1] - match[0], match[0])):
+        if chain is not None and other - start == chain[1] - chain[0] and start == chain[0] + chain[2] - window + 1:
+            chain[2] += 1
+            continue
+        if chain is not None:
+            chains.append(chain)
+        chain = [start, other, window]
+    if chain is not None:
+        chains.append(chain)
+
+    # [first start, repeat start, end of the first occurrence, lowest diagonal, highest diagonal]
+    repeats = []
+    active = []
+    for start, other, length in sorted(chains):
+        diagonal = other - start
+        active = [repeat for repeat in active if repeat[2] > start]
+        for repeat in active:
+            if repeat[3] - max_shift <= diagonal <= repeat[4] + max_shift:
+                repeat[2] = max(repeat[2], start + length)
+                repeat[3] = min(repeat[3], diagonal)
+                repeat[4] = max(repeat[4], diagonal)
+                break
+        else:
+            repeat = [start, other, start + length, diagonal, diagonal]
+            repeats.append(repeat)
+            active.append(repeat)
+    # A repeat overlapping its first occurrence is cut where the repeat starts
+    return [(start, other, min(end - start, other - start)) for start, other, end, _, _ in repeats]
+
+
+class _PrefixMax:
+    """
+    Largest end of the ranges added so far starting at or before a given index (Fenwick tree)
+    """
+
+    def __init__(self, size: int):
+        self.tree = [-1] * (size + 1)
+
+    def update(self, start: int, end: int):
+        index = start + 1
+        while index < len(self.tree):
+            self.tree[index] = max(self.tree[index], end)
+            index += index & -index
+
+    def query(self, start: int) -> int:
+        index = start + 1
+        end = -1
+        while index > 0:
+            end = max(end, self.tree[index])
+            index -= index & -index
+        return end
+
+
+def find_approximate_repeats(sequence: list, positions: list, durations: list, min_duration: float = 6.0,
+                             window: int = DEFAULT_WINDOW, max_distance: int = DEFAULT_MAX_DISTANCE,
+                             max_bucket: int = DEFAULT_MAX_BUCKET) -> list:
+    """
+    Find the approximate repeats of a sequence
+    :param sequence: list of the values (hashable)
+    :param positions: position (measure, offset) of each value
+    :param durations: duration of each value in quarter lengths
+    :param min_duration: minimal duration of the first occurrence of a pattern
+    :param window: number of values of the compared windows, the shortest pattern found
+    :param max_distance: maximal number of values changed, added or removed in a window of a repeat
+    :param max_bucket: the blocks found more often than this are not used as seeds
+    :return: list of (pattern, positions) sorted by decreasing pattern length, the pattern is the values of the
+             first occurrence and the positions start with the first occurrence followed by the start of every repeat
+    """
+    tokens = list(sequence)
+    repeats = chain_windows(find_matching_windows(tokens, window, max_distance, max_bucket), window, max_distance)
+    prefix_durations, scale = get_scaled_prefix_durations(durations)
+    scaled_min_duration = math.ceil(Fraction(min_duration) * scale)
+    repeats = [(start, other, length) for start, other, length in repeats
+               if prefix_durations[start + length] - prefix_durations[start] >= scaled_min_duration]
+
+    # A repeat is dropped when each of its occurrences is inside an occurrence of a longer kept repeat
+    repeats.sort(key=lambda repeat: (-repeat[2], repeat[0], repeat[1]))
+    kept = []
+    covered = _PrefixMax(len(tokens))
+    for start, other, length in repeats:
+        if covered.query(start) >= start + length and covered.query(other) >= other + length:
+            continue
+        kept.append((start, other, length))
+        covered.update(start, start + length)
+        covered.update(other, other + length)
+    instrumentation.count("patterns_examined", len(repeats))
+
+    patterns = {}
+    for start, other, length in kept:
+        patterns.setdefault((start, length), []).append(other)
+    return [(tuple(tokens[start:start + length]), [positions[start]] + [positions[other] for other in sorted(others)])
+            for (start, length), others in sorted(patterns.items(), key=lambda item: (-item[0][1], item[0][0]))]
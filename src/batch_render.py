@@ -0,0 +1,140 @@
+"""
+This module renders the figures of many pieces to files, without a display.
+
+The figures are drawn by the same functions as the interactive plots
+(timing_plotter.draw_timing, task_c1.draw_volume, task_c3.draw_results) on
+matplotlib Figures attached to an Agg canvas, so the pyplot backend and its
+global state are not used. Each process keeps one figure per kind of plot and
+clears its axes between pieces instead of creating a new figure. The long
+tempo and velocity curves are decimated with min/max binning before they are
+drawn. The pieces run on a process pool like the whole dataset runners.
+"""
+
+import os
+
+from src.dataset_manifest import load_manifest
+from src.parallel import run_in_parallel
+
+KINDS = ("timing", "volume")
+FORMATS = ("png", "svg")
+# Points of a curve, about twice the width in pixels of the figures
+DEFAULT_MAX_POINTS = 2000
+FIGURE_SIZES = {"timing": (6.4, 4.8), "volume": (10, 6), "results": (6.4, 4.8)}
+DPI = 100
+
+# kind -> (figure, axes), one per process
+_figures = {}
+
+
+def get_figure(kind: str) -> tuple:
+    """
+    Get the figure of a kind of plot with cleared axes, created on first use in this process
+    :param kind: "timing", "volume" or "results"
+    :return: (matplotlib Figure, Axes)
+    """
+    if kind not in _figures:
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        figure = Figure(figsize=FIGURE_SIZES[kind], dpi=DPI)
+        FigureCanvasAgg(figure)
+        _figures[kind] = (figure, figure.add_subplot())
+    figure, ax = _figures[kind]
+    ax.clear()
+    return figure, ax
+
+
+def render_timing(folder_path: str, output_path: str, max_points: int = DEFAULT_MAX_POINTS):
+    """
+    Render the tempo curve of a piece with its phrase boundaries
+    :param folder_path: path to the piece folder
+    :param output_path: path to the image, its extension gives the format
+    :param max_points: decimate the curve to this number of points, None to keep them all
+    """
+    from src.task_c1 import get_phrase_boundaries, get_tempo_map_db
+    from src.timing_for_one_piece import get_average_timing_one_piece
+    from src.timing_plotter import draw_timing
+    average = get_average_timing_one_piece(folder_path)
+    tempo_map, _ = get_tempo_map_db(average)
+    boundaries, _ = get_phrase_boundaries(folder_path, average)
+    figure, ax = get_figure("timing")
+    draw_timing(ax, tempo_map, boundaries, max_points)
+    figure.savefig(output_path)
+
+
+def render_volume(folder_path: str, output_path: str, max_points: int = DEFAULT_MAX_POINTS):
+    """
+    Render the velocity differences of the first performance of a piece with the velocity split points
+    :param folder_path: path to the piece folder
+    :param output_path: path to the image, its extension gives the format
+    :param max_points: decimate the curve to this number of points, None to keep them all
+    """
+    from src.task_c1 import draw_volume, get_c1_features, get_velocity_split_points, offset_to_seconds
+    c1_features = get_c1_features(folder_path)
+    if c1_features is None:
+        raise ValueError("No performance MIDI file")
+    times = [offset_to_seconds(x, c1_features["tempo"]) for x in c1_features["times"]]
+    figure, ax = get_figure("volume")
+    draw_volume(ax, c1_features["volume_differences"], times, get_velocity_split_points(c1_features), max_points)
+    figure.savefig(output_path)
+
+
+RENDERERS = {"timing": render_timing, "volume": render_volume}
+
+
+def render_piece(item: tuple) -> list:
+    """
+    Render the figures of one piece
+    :param item: (path to the piece folder, output folder of the piece, kinds, format, max_points)
+    :return: list of the paths of the images
+    """
+    folder_path, output_folder, kinds, image_format, max_points = item
+    os.makedirs(output_folder, exist_ok=True)
+    paths = []
+    for kind in kinds:
+        output_path = os.path.join(output_folder, f"{kind}.{image_format}")
+        RENDERERS[kind](folder_path, output_path, max_points)
+        paths.append(output_path)
+    return paths
+
+
+def render_dataset(folder_path: str = "asap-dataset/", output_folder: str = "figures", kinds=KINDS,
+                   image_format: str = "png", max_points: int = DEFAULT_MAX_POINTS, workers: int = None,
+                   chunk_size: int = 4, timeout: float = None) -> dict:
+    """
+    Render the figures of every piece of the dataset, in output_folder/<piece>/<kind>.<format>
+    :param folder_path: path to the dataset
+    :param output_folder: folder of the images
+    :param kinds: kinds of figures among KINDS
+    :param image_format: "png" or "svg"
+    :param max_points: decimate the curves to this number of points, None to keep them all
+    :param workers: number of processes, None for one per CPU
+    :param chunk_size: number of pieces sent to a process at once
+    :param timeout: timeout in seconds for each piece, None for no timeout
+    :return: dict piece -> list of the paths of its images, or a dict {"error": type, "message": message}
+    """
+    unknown = set(kinds) - set(KINDS)
+    if unknown:
+        raise ValueError(f"Unknown kinds {sorted(unknown)}, expected some of {KINDS}")
+    if image_format not in FORMATS:
+        raise ValueError(f"Unknown format {image_format!r}, expected one of {FORMATS}")
+    root = os.path.normpath(folder_path)
+    paths = load_manifest(folder_path).piece_folders(with_score_annotations=True)
+    keys = [os.path.relpath(path, root) for path in paths]
+    items = [(path, os.path.join(output_folder, key), tuple(kinds), image_format, max_points)
+             for path, key in zip(paths, keys)]
+    results = {}
+    for key, (_, result, error) in zip(keys, run_in_parallel(render_piece, items, workers, chunk_size, timeout)):
+        results[key] = result if error is None else error
+    return results
+
+
+def render_results(results: dict, output_path: str):
+    """
+    Render the chart of task_c3.plot_results to a file
+    :param results: output of task_c3.run_on_whole_dataset
+    :param output_path: path to the image, its extension gives the format
+    """
+    from src.task_c3 import draw_results
+    figure, ax = get_figure("results")
+    draw_results(ax, results)
+    figure.savefig(output_path)
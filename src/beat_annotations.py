@@ -0,0 +1,224 @@
+"""
+This module contains a columnar loader for the ASAP beat annotation files
+(``*_annotations.txt``).
+
+Each file is parsed once into typed arrays: float64 onsets, an int8 beat type
+code and interned meter/key tables stored with the beat index at which they
+change. ``to_performed_dict`` and ``to_symbolic_dict`` give back the per-beat
+dicts used by the functions of ``timing_for_one_piece``.
+"""
+
+import numpy as np
+
+from src import instrumentation
+from src.feature_cache import get_default_cache
+from src.prefetch import read_text
+
+# Beat type labels of the ASAP annotations, the code of a label is its index
+BEAT_TYPES = ("db", "b", "bR")
+DOWNBEAT = 0
+CACHE_KIND = "beats"
+
+
+class BeatAnnotations:
+    """
+    Beat annotations of one file stored as parallel arrays.
+
+    :ivar onsets: float64 array with the onset of each beat
+    :ivar beat_types: int8 array with the code of each beat type (index in BEAT_TYPES)
+    :ivar meters: tuple of the distinct meters of the file
+    :ivar meter_changes: int array with the beats where the meter changes
+    :ivar meter_codes: int array with the meter (index in meters) set at each change
+    :ivar keys: tuple of the distinct keys of the file
+    :ivar key_changes: int array with the beats where the key changes
+    :ivar key_codes: int array with the key (index in keys) set at each change
+    """
+
+    __slots__ = ("onsets", "beat_types", "meters", "meter_changes", "meter_codes",
+                 "keys", "key_changes", "key_codes")
+
+    def __init__(self, onsets: np.ndarray, beat_types: np.ndarray,
+                 meters: tuple, meter_changes: np.ndarray, meter_codes: np.ndarray,
+                 keys: tuple, key_changes: np.ndarray, key_codes: np.ndarray):
+        self.onsets = onsets
+        self.beat_types = beat_types
+        self.meters = meters
+        self.meter_changes = meter_changes
+        self.meter_codes = meter_codes
+        self.keys = keys
+        self.key_changes = key_changes
+        self.key_codes = key_codes
+
+    def __len__(self) -> int:
+        return len(self.onsets)
+
+    def downbeat_indexes(self) -> np.ndarray:
+        """
+        Get the indexes of the downbeats
+        :return: int array
+        """
+        return np.flatnonzero(self.beat_types == DOWNBEAT)
+
+    def meter_at(self, beat: int) -> str or None:
+        """
+        Get the meter in use at a beat
+        :param beat: index of the beat
+        :return: the meter or None if no meter was annotated before this beat
+        """
+        return _value_at(beat, self.meters, self.meter_changes, self.meter_codes)
+
+    def key_at(self, beat: int) -> str or None:
+        """
+        Get the key in use at a beat
+        :param beat: index of the beat
+        :return: the key or None if no key was annotated before this beat
+        """
+        return _value_at(beat, self.keys, self.key_changes, self.key_codes)
+
+    def meter_per_beat(self) -> list:
+        """
+        Expand the meter changes to one meter per beat
+        :return: list of str or None
+        """
+        return _expand(len(self), self.meters, self.meter_changes, self.meter_codes)
+
+    def key_per_beat(self) -> list:
+        """
+        Expand the key changes to one key per beat
+        :return: list of str or None
+        """
+        return _expand(len(self), self.keys, self.key_changes, self.key_codes)
+
+    def to_performed_dict(self) -> dict:
+        """
+        Compatibility view with the format of get_performed_attributes.
+        The onsets are floats instead of the raw strings of the file.
+        :return: dict of the performed attributes for each beat
+        """
+        meters = self.meter_per_beat()
+        keys = self.key_per_beat()
+        onsets = self.onsets.tolist()
+        beat_types = self.beat_types.tolist()
+        return {
+            i: {
+                "key": keys[i],
+                "meter": meters[i],
+                "onset": onsets[i],
+                "beat_type": BEAT_TYPES[beat_types[i]]
+            }
+            for i in range(len(onsets))
+        }
+
+    def to_arrays(self) -> dict:
+        """
+        Convert to a dict of arrays that can be saved with numpy.savez
+        :return: dict of arrays
+        """
+        arrays = {name: getattr(self, name) for name in self.__slots__}
+        arrays["meters"] = np.array(self.meters, dtype=str)
+        arrays["keys"] = np.array(self.keys, dtype=str)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays) -> "BeatAnnotations":
+        """
+        Build from the output of to_arrays
+        :param arrays: dict of arrays (or NpzFile)
+        :return: BeatAnnotations
+        """
+        values = {name: arrays[name] for name in cls.__slots__}
+        values["meters"] = tuple(values["meters"].tolist())
+        values["keys"] = tuple(values["keys"].tolist())
+        return cls(**values)
+
+    def to_symbolic_dict(self) -> dict:
+        """
+        Compatibility view with the format of get_symbolic_attributes.
+        :return: dict of the symbolic attributes for each beat
+        """
+        return {i: {"onset": onset} for i, onset in enumerate(self.onsets.tolist())}
+
+
+def _value_at(beat: int, table: tuple, changes: np.ndarray, codes: np.ndarray) -> str or None:
+    position = np.searchsorted(changes, beat, side="right") - 1
+    if position < 0:
+        return None
+    return table[codes[position]]
+
+
+def _expand(length: int, table: tuple, changes: np.ndarray, codes: np.ndarray) -> list:
+    result = [None] * length
+    bounds = changes.tolist() + [length]
+    for j, code in enumerate(codes.tolist()):
+        value = table[code]
+        for i in range(bounds[j], bounds[j + 1]):
+            result[i] = value
+    return result
+
+
+def parse_beat_annotations(lines) -> BeatAnnotations:
+    """
+    Parse the lines of an annotation file
+    :param lines: iterable of the lines of the file
+    :return: BeatAnnotations
+    """
+    beat_type_codes = {label: code for code, label in enumerate(BEAT_TYPES)}
+    onsets = []
+    beat_types = []
+    meters = {}
+    meter_changes = []
+    meter_codes = []
+    keys = {}
+    key_changes = []
+    key_codes = []
+    current_meter = None
+    current_key = None
+    for line in lines:
+        line_data = line.split()
+        if not line_data:
+            continue
+        beat = len(onsets)
+        onsets.append(float(line_data[0]))
+        beat_key_meter = line_data[2].split(',')
+        try:
+            beat_types.append(beat_type_codes[beat_key_meter[0]])
+        except KeyError:
+            raise ValueError(f"Unknown beat type {beat_key_meter[0]!r} at beat {beat}") from None
+        if len(beat_key_meter) >= 2 and beat_key_meter[1] != current_meter:
+            current_meter = beat_key_meter[1]
+            meter_changes.append(beat)
+            meter_codes.append(meters.setdefault(current_meter, len(meters)))
+        if len(beat_key_meter) == 3 and beat_key_meter[2] != current_key:
+            current_key = beat_key_meter[2]
+            key_changes.append(beat)
+            key_codes.append(keys.setdefault(current_key, len(keys)))
+    return BeatAnnotations(
+        onsets=np.array(onsets, dtype=np.float64),
+        beat_types=np.array(beat_types, dtype=np.int8),
+        meters=tuple(meters),
+        meter_changes=np.array(meter_changes, dtype=np.int64),
+        meter_codes=np.array(meter_codes, dtype=np.int64),
+        keys=tuple(keys),
+        key_changes=np.array(key_changes, dtype=np.int64),
+        key_codes=np.array(key_codes, dtype=np.int64),
+    )
+
+
+def load_beat_annotations(path: str) -> BeatAnnotations:
+    """
+    Load an annotation file, through the feature cache when it is enabled
+    :param path: path to the annotation file
+    :return: BeatAnnotations
+    """
+    cache = get_default_cache()
+    if cache is not None:
+        arrays = cache.get(path, CACHE_KIND)
+        if arrays is not None:
+            return BeatAnnotations.from_arrays(arrays)
+    with instrumentation.stage("annotation_read"):
+        annotations = parse_beat_annotations(read_text(path).splitlines(True))
+    instrumentation.count("annotation_files_parsed")
+    instrumentation.count("beats_read", len(annotations))
+    if cache is not None:
+        cache.put(path, CACHE_KIND, annotations.to_arrays())
+    return annotations
@@ -0,0 +1,154 @@
+"""
+This module contains the fusion of the velocity split points with the tempo
+boundaries of task C1, computed on sorted arrays.
+
+The functions return the same results as the loops they replace in
+get_number_of_phrases_detected. Instead of comparing each point with every
+accepted point, they search windows of sorted values with bisect and
+numpy.searchsorted, in O((n + m) log n) instead of O(n * m).
+"""
+
+from bisect import bisect_left, insort
+
+import numpy as np
+
+
+def is_sorted(values) -> bool:
+    """
+    Check that values are sorted in increasing order (and have no NaN)
+    :param values: list or array of floats
+    :return: bool
+    """
+    values = np.asarray(values, dtype=np.float64)
+    return bool(np.all(values[1:] >= values[:-1]))
+
+
+def filter_closest(times: list, min_distance: float) -> list:
+    """
+    Keep the times more than min_distance after the previously kept time.
+    The times are processed in their order: the times of several parts are
+    not sorted as a whole, a time earlier than the last kept one is dropped.
+    :param times: list of times
+    :param min_distance: minimal distance to the last kept time
+    :return: list of the kept times
+    """
+    if not times:
+        return []
+    filtered = [times[0]]
+    last = times[0]
+    for time in times[1:]:
+        if time - last > min_distance:
+            filtered.append(time)
+            last = time
+    return filtered
+
+
+def space_points(points: list, min_spacing: float) -> list:
+    """
+    Keep the points that are at least min_spacing away from every point kept before them
+    :param points: list of points
+    :param min_spacing: minimal distance between two kept points
+    :return: list of the kept points in the order they were kept
+    """
+    kept = []
+    kept_sorted = []
+    for point in points:
+        # Only the kept points just before and just after can be closer than min_spacing
+        index = bisect_left(kept_sorted, point)
+        if index > 0 and abs(kept_sorted[index - 1] - point) < min_spacing:
+            continue
+        if index < len(kept_sorted) and abs(kept_sorted[index] - point) < min_spacing:
+            continue
+        kept.append(point)
+        insort(kept_sorted, point)
+    return kept
+
+
+class _NextFree:
+    """
+    Smallest index not taken yet at or after a given index (union-find with path compression)
+    """
+
+    def __init__(self, size: int):
+        self.parent = list(range(size + 1))
+
+    def find(self, index: int) -> int:
+        root = index
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[index] != root:
+            self.parent[index], index = root, self.parent[index]
+        return root
+
+    def take(self, index: int):
+        self.parent[index] = index + 1
+
+
+def fuse_boundaries(split_points: list, boundaries_times: list, tolerance: float) -> list:
+    """
+    Fuse the velocity split points with the tempo boundaries. For each split point, in order,
+    the first tempo boundary not taken yet that is closer than tolerance to the split point,
+    or more than tolerance outside the range of the split points, is taken.
+    :param split_points: times in seconds of the velocity split points
+    :param boundaries_times: times in seconds of the tempo boundaries
+    :param tolerance: tolerance in seconds
+    :return: list of the tempo boundaries taken, in the order they were taken
+    """
+    if not split_points:
+        return []
+    if not is_sorted(boundaries_times):
+        return _fuse_boundaries_in_order(split_points, boundaries_times, tolerance)
+
+    # A boundary is taken by value, equal times are taken together
+    unique_values, first_indexes = np.unique(np.asarray(boundaries_times, dtype=np.float64), return_index=True)
+    originals = [boundaries_times[index] for index in first_indexes.tolist()]
+    values = unique_values.tolist()
+    size = len(values)
+    min_velocity = min(split_points) - tolerance
+    max_velocity = max(split_points) + tolerance
+    # In a sorted list the boundaries below min_velocity come first, then the window around
+    # the point (min_velocity <= point - tolerance), then the boundaries above max_velocity
+    below_end = int(np.searchsorted(unique_values, min_velocity, side="left"))
+    above_start = int(np.searchsorted(unique_values, max_velocity, side="right"))
+    window_starts = np.searchsorted(unique_values, np.asarray(split_points, dtype=np.float64) - tolerance, side="left")
+
+    next_free = _NextFree(size)
+    result = []
+    for point, window_start in zip(split_points, window_starts.tolist()):
+        index = next_free.find(0)
+        if index >= below_end:
+            # Adjust the window to the exact test of the loop (rounding of point - tolerance)
+            start = window_start
+            while start > 0 and abs(values[start - 1] - point) < tolerance:
+                start -= 1
+            while start < size and values[start] < point and not abs(values[start] - point) < tolerance:
+                start += 1
+            index = next_free.find(start)
+            if index >= size or not abs(values[index] - point) < tolerance:
+                index = next_free.find(above_start)
+            else:
+                # Only differs when rounding puts the window over max_velocity
+                index = min(index, next_free.find(above_start))
+        if index < size:
+            next_free.take(index)
+            result.append(originals[index])
+    return result
+
+
+def _fuse_boundaries_in_order(split_points: list, boundaries_times: list, tolerance: float) -> list:
+    # Direct version of fuse_boundaries, used when the boundaries are not sorted
+    result_boundaries = []
+    min_velocity = min(split_points) - tolerance
+    max_velocity = max(split_points) + tolerance
+    for point in split_points:
+        for boundaries_time in boundaries_times:
+            if abs(boundaries_time - point) < tolerance and boundaries_time not in result_boundaries:
+                result_boundaries.append(boundaries_time)
+                break
+            elif boundaries_time < min_velocity and boundaries_time not in result_boundaries:
+                result_boundaries.append(boundaries_time)
+                break
+            elif boundaries_time > max_velocity and boundaries_time not in result_boundaries:
+                result_boundaries.append(boundaries_time)
+                break
+    return result_boundaries
@@ -0,0 +1,526 @@
+"""
+This module contains the command line interface of the pipeline.
+
+    python -m src timing --dataset-root asap-dataset --composer Bach --format csv > timing.csv
+    python -m src phrases-c1 --dataset-root asap-dataset --workers 8 --output c1.jsonl
+    python -m src patterns-c3 --dataset-root asap-dataset --composer Bach,Chopin
+    python -m src evaluate --method c3 --tolerances 0,1,2 --format parquet --output evaluation.parquet
+    python -m src render --output-dir figures --image-format svg --workers 8
+    python -m src index-motifs --index motifs.sqlite --workers 8
+    python -m src find-motif --index motifs.sqlite --key interval --pattern 2,2,-4 --composer Bach
+    python -m src phrases-c1 --dataset-root asap-dataset --store c1-store.jsonl --resume --midi-backend native
+    python -m src bench --sizes 16,64
+
+Every subcommand writes one row per result as soon as the piece is done, to
+the standard output or to --output, as JSON Lines (default), CSV or Parquet
+(needs pyarrow). The columns of each subcommand are fixed (COLUMNS), the
+pieces that failed are written as rows with the "error" and "message"
+columns. Nothing else is written to the standard output, the progress goes to
+the standard error.
+
+The subcommands running a task on every piece can save the rows of each piece
+in a result store (--store) as soon as it is done, and skip the pieces already
+in the store (--resume).
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+
+from src.dataset_manifest import get_piece, load_manifest
+from src.feature_cache import CACHE_DIR_ENV, NO_CACHE_ENV, configure_cache
+from src.midi_features import BACKENDS, configure_backend
+from src.parallel import run_in_parallel
+from src.result_store import run_with_store
+from src.running_aggregate import RunningAggregate
+
+FORMATS = ("jsonl", "csv", "parquet")
+# Number of rows written at once to a Parquet file (one row group)
+PARQUET_BATCH_SIZE = 1024
+# Columns of the rows of each subcommand, followed by ERROR_COLUMNS
+COLUMNS = {
+    "timing": ("piece", "beat", "symbolic_onset", "onset", "beat_type", "meter", "key"),
+    "phrases-c1": ("piece", "nb_phrases", "nb_measures", "approx_ratio"),
+    "patterns-c3": ("piece", "boundaries", "nb_boundaries", "nb_measures", "approx_ratio"),
+    "evaluate": ("piece", "method", "tolerance", "nb_detected", "nb_reference", "precision", "recall", "f1"),
+    "render": ("piece", "images"),
+    "index-motifs": ("piece", "status", "nb_onsets"),
+    "find-motif": ("piece", "measure", "offset"),
+    "shared-motifs": ("pattern", "nb_pieces", "nb_occurrences"),
+}
+ERROR_COLUMNS = ("error", "message")
+# Columns typed as strings in Parquet, whatever their first values
+STRING_COLUMNS = ("piece", "error", "message")
+# Options that do not change the rows, left out of the parameters of the result store
+RUN_OPTIONS = ("run", "workers", "chunk_size", "timeout", "cache_dir", "no_cache", "output_format", "output",
+               "store", "resume", "composers")
+
+
+class JsonLinesWriter:
+    """
+    Write rows as JSON Lines
+    """
+
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, row: dict):
+        self.f.write(json.dumps(row) + "\n")
+        self.f.flush()
+
+    def close(self):
+        self.f.flush()
+
+
+class CsvWriter:
+    """
+    Write rows as CSV with fixed columns, the missing values are empty and lists are written as JSON
+    """
+
+    def __init__(self, f, columns: tuple):
+        import csv
+        self.f = f
+        self.writer = csv.DictWriter(self.f, fieldnames=list(columns), extrasaction="ignore")
+        self.writer.writeheader()
+
+    def write(self, row: dict):
+        row = {key: json.dumps(value) if isinstance(value, (list, dict)) else value for key, value in row.items()}
+        self.writer.writerow(row)
+        self.f.flush()
+
+    def close(self):
+        self.f.flush()
+
+
+class ParquetWriter:
+    """
+    Write rows as Parquet with pyarrow with fixed columns, one row group every PARQUET_BATCH_SIZE rows.
+    The type of a column is the type of its first values, the file is created once every column has a
+    value (the first rows may all be errors).
+    """
+
+    def __init__(self, path: str, columns: tuple):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("The parquet format needs pyarrow (pip install pyarrow)")
+        self.pyarrow = pyarrow
+        self.parquet = pyarrow.parquet
+        self.path = path
+        self.columns = columns
+        self.writer = None
+        self.rows = []
+
+    def write(self, row: dict):
+        self.rows.append({column: row.get(column) for column in self.columns})
+        if len(self.rows) >= PARQUET_BATCH_SIZE:
+            self.flush()
+
+    def get_schema(self, final: bool = False):
+        """
+        Get the schema of the file from the rows not written yet
+        :param final: True when no row will come, a column without a value is then a null column
+        :return: pyarrow schema or None if a column has no value yet
+        """
+        fields = []
+        for column in self.columns:
+            if column in STRING_COLUMNS:
+                column_type = self.pyarrow.string()
+            else:
+                column_type = self.pyarrow.array([row[column] for row in self.rows]).type
+                if column_type == self.pyarrow.null() and not final:
+                    return None
+            fields.append(self.pyarrow.field(column, column_type))
+        return self.pyarrow.schema(fields)
+
+    def flush(self, final: bool = False):
+        if not self.rows:
+            return
+        if self.writer is None:
+            schema = self.get_schema(final)
+            if schema is None:
+                return
+            self.writer = self.parquet.ParquetWriter(self.path, schema)
+        self.writer.write_table(self.pyarrow.Table.from_pylist(self.rows, schema=self.writer.schema))
+        self.rows = []
+
+    def close(self):
+        self.flush(final=True)
+        if self.writer is not None:
+            self.writer.close()
+
+
+def open_writer(output_format: str, output: str, stack: contextlib.ExitStack, columns: tuple):
+    """
+    Open the writer of an output format
+    :param output_format: "jsonl", "csv" or "parquet"
+    :param output: path to the output file, "-" for the standard output
+    :param stack: ExitStack closing the file and the writer
+    :param columns: columns of the rows (CSV and Parquet), the ERROR_COLUMNS are added
+    :return: writer with write(row) and close()
+    """
+    columns = tuple(columns) + ERROR_COLUMNS
+    if output_format == "parquet":
+        if output == "-":
+            raise ValueError("The parquet format needs an output file (--output)")
+        writer = ParquetWriter(output, columns)
+    else:
+        f = sys.stdout if output == "-" else stack.enter_context(open(output, "w", newline=""))
+        writer = JsonLinesWriter(f) if output_format == "jsonl" else CsvWriter(f, columns)
+    stack.callback(writer.close)
+    return writer
+
+
+def filter_composers(paths: list, root: str, composers: list) -> list:
+    """
+    Keep the paths in the folders of some composers (the first level of the dataset)
+    :param paths: paths to pieces or files of the dataset
+    :param root: path to the dataset
+    :param composers: names of the composer folders, every path is kept if empty
+    :return: list of paths
+    """
+    if not composers:
+        return paths
+    root = os.path.normpath(root)
+    return [path for path in paths if os.path.relpath(path, root).split(os.sep)[0] in composers]
+
+
+def get_piece_key(path: str, root: str) -> str:
+    """
+    Get the name of a piece in the output, its path relative to the dataset
+    :param path: path to the piece folder or file
+    :param root: path to the dataset
+    :return: str
+    """
+    return os.path.relpath(path, os.path.normpath(root))
+
+
+def get_timing_rows(item: tuple) -> list:
+    """
+    Get the average timing of one piece as one row per beat
+    :param item: (path to the piece folder, statistic)
+    :return: list of rows {"beat", "symbolic_onset", "onset", "beat_type", "meter", "key"}
+    """
+    from src.timing_for_one_piece import get_average_timing_one_piece
+    folder_path, statistic = item
+    with contextlib.redirect_stdout(io.StringIO()):
+        timing = get_average_timing_one_piece(folder_path, statistic)
+    return [{"beat": beat, "symbolic_onset": value["symbolic"]["onset"], "onset": value["performed"]["onset"],
+             "beat_type": value["performed"]["beat_type"], "meter": value["performed"]["meter"],
+             "key": value["performed"]["key"]} for beat, value in (timing or {}).items()]
+
+
+def get_c1_rows(path: str) -> list:
+    from src.task_c4 import get_c1_result
+    return [get_c1_result(path)]
+
+
+def get_c3_rows(midi_file: str) -> list:
+    from src.task_c3 import get_c3_result
+    return [get_c3_result(midi_file)]
+
+
+def get_evaluation_rows(item: tuple) -> list:
+    """
+    Evaluate one piece as one row per tolerance
+    :param item: item of evaluation.evaluate_piece
+    :return: list of rows {"method", "tolerance", "nb_detected", "nb_reference", "precision", "recall", "f1"}
+    """
+    from src.evaluation import evaluate_piece
+    evaluation = evaluate_piece(item)
+    return [{"method": item[1], "tolerance": tolerance, "nb_detected": evaluation["nb_detected"],
+             "nb_reference": evaluation["nb_reference"], "precision": evaluation["precision"][index],
+             "recall": evaluation["recall"][index], "f1": evaluation["f1"][index]}
+            for index, tolerance in enumerate(evaluation["tolerances"])]
+
+
+def get_render_rows(item: tuple) -> list:
+    """
+    Render the figures of one piece
+    :param item: item of batch_render.render_piece
+    :return: list with one row {"images"}
+    """
+    from src.batch_render import render_piece
+    return [{"images": render_piece(item)}]
+
+
+def stream_rows(function, items: list, keys: list, writer, workers: int, chunk_size: int,
+                timeout: float, get_files=None, aggregate=None, store: str = None, resume: bool = False,
+                parameters: dict = None) -> int:
+    """
+    Run function on every item and write its rows as soon as they are produced
+    :param function: module level function taking an item and returning a list of rows
+    :param items: items of the pieces
+    :param keys: name of each piece in the output
+    :param writer: writer of open_writer
+    :param workers: number of processes, None for one per CPU
+    :param chunk_size: number of pieces sent to a process at once
+    :param timeout: timeout in seconds for each piece, None for no timeout
+    :param get_files: function giving the files read by an item, to read them ahead (see prefetch)
+    :param aggregate: RunningAggregate updated with the first row of each piece, printed to the standard error
+    :param store: path to a result store where the rows of each piece are saved as soon as it is done
+    :param resume: skip the pieces already done in the store, their stored rows are written
+    :param parameters: parameter set of the run in the store (see get_parameters)
+    :return: number of pieces that failed
+    """
+    def run(to_run: list):
+        for item, rows, error in run_in_parallel(function, to_run, workers, chunk_size, timeout, get_files):
+            for row in rows or []:
+                row.pop("profile", None)
+            yield item, None if error is not None else {"rows": rows}, error
+
+    nb_errors = 0
+    results = run_with_store(run, items, keys, parameters or {}, store, resume)
+    for index, (key, result, error, from_store) in enumerate(results):
+        if aggregate is not None:
+            aggregate.add(error if error is not None else result["rows"][0])
+        if error is not None:
+            nb_errors += 1
+            writer.write({"piece": key, **error})
+            print(f"[{index + 1}/{len(items)}] {key}: {error['error']}: {error['message']}", file=sys.stderr)
+            continue
+        for row in result["rows"]:
+            writer.write({"piece": key, **row})
+        print(f"[{index + 1}/{len(items)}] {key}{' (stored)' if from_store else ''}", file=sys.stderr)
+    if aggregate is not None:
+        print(json.dumps(aggregate.to_dict()), file=sys.stderr)
+    return nb_errors
+
+
+def get_parameters(args) -> dict:
+    """
+    Get the parameter set of a run in the result store: the options that change the rows
+    :param args: parsed arguments
+    :return: dict
+    """
+    return {key: value for key, value in sorted(vars(args).items()) if key not in RUN_OPTIONS}
+
+
+def _store_options(args) -> dict:
+    return {"store": args.store, "resume": args.resume, "parameters": get_parameters(args)}
+
+
+def _piece_folders(args) -> list:
+    paths = load_manifest(args.dataset_root).piece_folders(with_score_annotations=True)
+    return filter_composers(paths, args.dataset_root, args.composers)
+
+
+def run_timing(args, writer) -> int:
+    paths = [path for path in _piece_folders(args) if get_piece(path)["performance_annotations"]]
+    items = [(path, args.statistic) for path in paths]
+    keys = [get_piece_key(path, args.dataset_root) for path in paths]
+    return stream_rows(get_timing_rows, items, keys, writer, args.workers, args.chunk_size, args.timeout,
+                       **_store_options(args))
+
+
+def run_phrases_c1(args, writer) -> int:
+    paths = _piece_folders(args)
+    keys = [get_piece_key(path, args.dataset_root) for path in paths]
+    from src.task_c4 import get_c1_files
+    return stream_rows(get_c1_rows, paths, keys, writer, args.workers, args.chunk_size, args.timeout, get_c1_files,
+                       RunningAggregate("nb_phrases"), **_store_options(args))
+
+
+def run_patterns_c3(args, writer) -> int:
+    midi_files = filter_composers(load_manifest(args.dataset_root).score_midi_files(), args.dataset_root,
+                                  args.composers)
+    keys = [get_piece_key(midi_file, args.dataset_root) for midi_file in midi_files]
+    from src.task_c3 import get_c3_files
+    return stream_rows(get_c3_rows, midi_files, keys, writer, args.workers, args.chunk_size, args.timeout,
+                       get_c3_files, RunningAggregate("nb_boundaries"), **_store_options(args))
+
+
+def run_evaluate(args, writer) -> int:
+    paths = _piece_folders(args)
+    tolerances = tuple(float(tolerance) for tolerance in args.tolerances.split(","))
+    items = [(path, args.method, args.reference, tolerances, args.phrase_length, args.threshold_similarity)
+             for path in paths]
+    keys = [get_piece_key(path, args.dataset_root) for path in paths]
+    return stream_rows(get_evaluation_rows, items, keys, writer, args.workers, args.chunk_size, args.timeout,
+                       **_store_options(args))
+
+
+def run_render(args, writer) -> int:
+    from src.batch_render import KINDS
+    unknown = set(args.kinds.split(",")) - set(KINDS)
+    if unknown:
+        raise ValueError(f"Unknown kinds {sorted(unknown)}, expected some of {KINDS}")
+    paths = _piece_folders(args)
+    keys = [get_piece_key(path, args.dataset_root) for path in paths]
+    items = [(path, os.path.join(args.output_dir, key), tuple(args.kinds.split(",")), args.image_format,
+              args.max_points) for path, key in zip(paths, keys)]
+    return stream_rows(get_render_rows, items, keys, writer, args.workers, args.chunk_size, args.timeout,
+                       **_store_options(args))
+
+
+def run_index_motifs(args, writer) -> int:
+    from src.motif_index import MotifIndex
+    midi_files = filter_composers(load_manifest(args.dataset_root).score_midi_files(), args.dataset_root,
+                                  args.composers)
+    nb_errors = 0
+    with MotifIndex(args.index, args.ngram_length) as index:
+        # The pieces are written to the index by this process, as their n-grams come back from the workers
+        for number, (midi_file, result) in enumerate(index.update(midi_files, args.dataset_root, args.workers,
+                                                                  args.chunk_size, args.timeout)):
+            key = get_piece_key(midi_file, args.dataset_root)
+            writer.write({"piece": key, **result})
+            if "error" in result:
+                nb_errors += 1
+                print(f"[{number + 1}/{len(midi_files)}] {key}: {result['error']}: {result['message']}",
+                      file=sys.stderr)
+            else:
+                print(f"[{number + 1}/{len(midi_files)}] {key}: {result['status']}", file=sys.stderr)
+    return nb_errors
+
+
+def _open_motif_index(args):
+    from src.motif_index import MotifIndex
+    if not os.path.exists(args.index):
+        raise ValueError(f"No index {args.index}, build it with index-motifs")
+    return MotifIndex(args.index)
+
+
+def run_find_motif(args, writer) -> int:
+    from src.motif_index import decode_value
+    pattern = [decode_value(value.strip()) for value in args.pattern.split(",")]
+    with _open_motif_index(args) as index:
+        for midi_file, (measure, offset) in index.find(pattern, args.key, args.composers):
+            writer.write({"piece": get_piece_key(midi_file, args.dataset_root), "measure": measure, "offset": offset})
+    return 0
+
+
+def run_shared_motifs(args, writer) -> int:
+    from src.motif_index import encode_pattern
+    with _open_motif_index(args) as index:
+        for pattern, nb_pieces, nb_occurrences in index.shared_patterns(args.key, args.composers, args.min_pieces,
+                                                                        args.limit):
+            writer.write({"pattern": encode_pattern(pattern)[:-1], "nb_pieces": nb_pieces,
+                          "nb_occurrences": nb_occurrences})
+    return 0
+
+
+def configure(args):
+    """
+    Configure the cache and the MIDI backend from the options, the environment passes them on to the
+    worker processes
+    :param args: parsed arguments
+    """
+    if args.midi_backend:
+        configure_backend(args.midi_backend)
+    # The backend of the run is part of its parameters in the result store
+    from src.midi_features import get_default_backend
+    args.midi_backend = get_default_backend()
+    if args.no_cache:
+        os.environ[NO_CACHE_ENV] = "1"
+        configure_cache(enabled=False)
+    elif args.cache_dir:
+        os.environ[CACHE_DIR_ENV] = args.cache_dir
+        configure_cache(args.cache_dir)
+
+
+def get_parser() -> argparse.ArgumentParser:
+    """
+    Build the parser of the command line
+    :return: ArgumentParser
+    """
+    from src.evaluation import METHODS
+    from src.timing_for_one_piece import AVERAGE_STATISTICS
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--dataset-root", default="asap-dataset", help="path to the ASAP dataset")
+    common.add_argument("--composer", dest="composers", default=None, type=lambda value: value.split(","),
+                        help="comma separated composer folders, every composer if not set")
+    common.add_argument("--workers", type=int, default=1, help="number of processes, 0 for one per CPU")
+    common.add_argument("--chunk-size", type=int, default=1, help="number of pieces sent to a process at once")
+    common.add_argument("--timeout", type=float, default=None, help="timeout in seconds for each piece")
+    common.add_argument("--cache-dir", default=None, help=f"directory of the feature cache (or ${CACHE_DIR_ENV})")
+    common.add_argument("--no-cache", action="store_true", help="disable the feature cache")
+    common.add_argument("--midi-backend", choices=BACKENDS, default=None,
+                        help="MIDI parser, $DM_MIDI_BACKEND or music21 if not set")
+    common.add_argument("--format", dest="output_format", choices=FORMATS, default="jsonl")
+    common.add_argument("--output", default="-", help="output file, the standard output if not set")
+
+    # Options of the subcommands running a task on every piece
+    pieces = argparse.ArgumentParser(add_help=False, parents=[common])
+    pieces.add_argument("--store", default=None,
+                        help="JSON Lines result store where the rows of each piece are saved when it is done")
+    pieces.add_argument("--resume", action="store_true",
+                        help="skip the pieces already done in the store with the same options")
+
+    parser = argparse.ArgumentParser(prog="python -m src", description="Phrase detection on the ASAP dataset")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    timing = subparsers.add_parser("timing", parents=[pieces], help="average performed timing of every beat")
+    timing.add_argument("--statistic", choices=AVERAGE_STATISTICS, default="mean")
+    timing.set_defaults(run=run_timing)
+    subparsers.add_parser("phrases-c1", parents=[pieces], help="phrases detected from tempo and velocity (C1)") \
+        .set_defaults(run=run_phrases_c1)
+    subparsers.add_parser("patterns-c3", parents=[pieces], help="boundaries of repeating patterns (C3)") \
+        .set_defaults(run=run_patterns_c3)
+    evaluate = subparsers.add_parser("evaluate", parents=[pieces], help="precision, recall and F1 of the boundaries")
+    evaluate.add_argument("--method", choices=METHODS, default="c3")
+    evaluate.add_argument("--reference", default="downbeats",
+                          help='"downbeats", "file" (phrase_annotations.txt of each piece) or a reference file')
+    evaluate.add_argument("--tolerances", default="0,1,2", help="comma separated tolerances in measures")
+    evaluate.add_argument("--phrase-length", type=int, default=8, help="measures of a phrase for the downbeats")
+    evaluate.add_argument("--threshold-similarity", type=float, default=5,
+                          help="fusion tolerance in seconds of the c1 method")
+    evaluate.set_defaults(run=run_evaluate)
+    render = subparsers.add_parser("render", parents=[pieces], help="tempo and velocity figures of every piece")
+    render.add_argument("--output-dir", default="figures", help="folder of the images")
+    render.add_argument("--kinds", default="timing,volume", help="comma separated kinds of figures")
+    render.add_argument("--image-format", choices=("png", "svg"), default="png")
+    render.add_argument("--max-points", type=int, default=2000, help="points of a curve, 0 to keep them all")
+    render.set_defaults(run=run_render)
+    index_motifs = subparsers.add_parser("index-motifs", parents=[common],
+                                         help="add the new and modified scores to the motif index")
+    index_motifs.add_argument("--index", default="motifs.sqlite", help="path to the index")
+    index_motifs.add_argument("--ngram-length", type=int, default=None,
+                              help="values of an indexed n-gram, set when the index is created (default 4)")
+    index_motifs.set_defaults(run=run_index_motifs)
+    find_motif = subparsers.add_parser("find-motif", parents=[common],
+                                       help="occurrences of a pattern in every indexed score")
+    find_motif.add_argument("--index", default="motifs.sqlite", help="path to the index")
+    find_motif.add_argument("--key", choices=("interval", "root", "duration"), default="interval")
+    find_motif.add_argument("--pattern", required=True, help='comma separated values ("N" for no interval)')
+    find_motif.set_defaults(run=run_find_motif)
+    shared_motifs = subparsers.add_parser("shared-motifs", parents=[common],
+                                          help="n-grams of the motif index found in the most scores")
+    shared_motifs.add_argument("--index", default="motifs.sqlite", help="path to the index")
+    shared_motifs.add_argument("--key", choices=("interval", "root", "duration"), default="interval")
+    shared_motifs.add_argument("--min-pieces", type=int, default=2, help="scores of a shared pattern")
+    shared_motifs.add_argument("--limit", type=int, default=100, help="number of shared patterns")
+    shared_motifs.set_defaults(run=run_shared_motifs)
+    # The arguments of bench are parsed by benchmarks.run_benchmarks (see main)
+    subparsers.add_parser("bench", help="benchmark the stages (python -m src bench --help)")
+    return parser
+
+
+def main(arguments: list = None) -> int:
+    """
+    Run the command line
+    :param arguments: arguments without the program name, sys.argv[1:] if None
+    :return: exit code, 1 if a piece failed
+    """
+    arguments = sys.argv[1:] if arguments is None else list(arguments)
+    if arguments[:1] == ["bench"]:
+        from benchmarks.run_benchmarks import main as run_benchmarks
+        return run_benchmarks(arguments[1:])
+    parser = get_parser()
+    args = parser.parse_args(arguments)
+    args.workers = args.workers or None
+    configure(args)
+    try:
+        with contextlib.ExitStack() as stack:
+            writer = open_writer(args.output_format, args.output, stack, COLUMNS[args.command])
+            nb_errors = args.run(args, writer)
+    except (ValueError, RuntimeError) as e:
+        parser.error(str(e))
+    except BrokenPipeError:
+        # The reader of the output stopped (| head), the rest of the output is dropped
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    return 1 if nb_errors else 0
@@ -0,0 +1,251 @@
+"""
+This module contains a manifest of the pieces of the ASAP dataset, built
+once and refreshed incrementally instead of walking the dataset for every
+piece.
+
+A piece is a folder holding a score MIDI (``midi_score.mid``) or the score
+annotations (``midi_score_annotations.txt``). For each piece the manifest
+records its score MIDI, its performance MIDIs, its annotation files and the
+number of beats and downbeats of the score annotations.
+
+The manifest is saved as JSON in the dataset folder (``.asap_manifest.json``)
+along with the modification time of every directory. On refresh, a directory
+whose modification time did not change is not listed again, and the beats of
+a piece are only counted again when its score annotations changed.
+"""
+
+import json
+import os
+
+MANIFEST_VERSION = 1
+MANIFEST_FILE = ".asap_manifest.json"
+SCORE_MIDI_FILES = ("midi_score.mid", "midi_score.midi")
+SCORE_ANNOTATIONS_FILE = "midi_score_annotations.txt"
+
+# Manifests loaded in this process, by absolute path of their root
+_manifests = {}
+
+
+def count_beats(annotations_path: str) -> tuple:
+    """
+    Count the beats and the downbeats of an annotation file
+    :param annotations_path: path to the annotation file
+    :return: number of beats, number of downbeats
+    """
+    nb_beats = 0
+    nb_downbeats = 0
+    with open(annotations_path, "r") as f:
+        for line in f:
+            if line.strip():
+                nb_beats += 1
+            if "db" in line:
+                nb_downbeats += 1
+    return nb_beats, nb_downbeats
+
+
+def scan_piece(folder: str, files: list, previous: dict = None) -> dict or None:
+    """
+    Build the manifest entry of a folder
+    :param folder: path to the folder
+    :param files: names of the files of the folder
+    :param previous: previous entry of the folder, its beat counts are reused if the score annotations did not change
+    :return: dict describing the piece or None if the folder is not a piece
+    """
+    score_midis = [file for file in SCORE_MIDI_FILES if file in files]
+    has_score_annotations = SCORE_ANNOTATIONS_FILE in files
+    if not score_midis and not has_score_annotations:
+        return None
+    piece = {
+        "score_midi": score_midis[0] if score_midis else None,
+        "performance_midis": sorted(file for file in files
+                                    if file.endswith((".mid", ".midi")) and file not in SCORE_MIDI_FILES),
+        "score_annotations": SCORE_ANNOTATIONS_FILE if has_score_annotations else None,
+        "performance_annotations": sorted(file for file in files
+                                          if file.endswith("annotations.txt") and file != SCORE_ANNOTATIONS_FILE),
+        "annotations_mtime": None,
+        "nb_beats": 0,
+        "nb_downbeats": 0,
+    }
+    if has_score_annotations:
+        annotations_path = os.path.join(folder, SCORE_ANNOTATIONS_FILE)
+        piece["annotations_mtime"] = os.stat(annotations_path).st_mtime_ns
+        if previous is not None and previous.get("annotations_mtime") == piece["annotations_mtime"]:
+            piece["nb_beats"] = previous["nb_beats"]
+            piece["nb_downbeats"] = previous["nb_downbeats"]
+        else:
+            piece["nb_beats"], piece["nb_downbeats"] = count_beats(annotations_path)
+    return piece
+
+
+class DatasetManifest:
+    """
+    Manifest of the pieces below a root folder.
+
+    :ivar root: root folder of the dataset
+    :ivar path: path to the JSON file of the manifest
+    :ivar pieces: dict relative folder ('' for the root itself) -> piece entry
+    :ivar directories: dict relative folder -> {"mtime": ..., "subdirectories": [...]}
+    """
+
+    def __init__(self, root: str, path: str = None):
+        self.root = root
+        self.path = path or os.path.join(root, MANIFEST_FILE)
+        self.pieces = {}
+        self.directories = {}
+
+    def folder(self, relative_folder: str) -> str:
+        """
+        Get the path of a piece folder as it was built by the os.walk of the runners
+        :param relative_folder: folder relative to the root
+        :return: path with forward slashes
+        """
+        if relative_folder == "":
+            return self.root.replace("\\", "/")
+        return os.path.join(self.root, relative_folder).replace("\\", "/")
+
+    def refresh(self) -> bool:
+        """
+        Update the manifest with the changes of the dataset
+        :return: True if something changed
+        """
+        pieces = {}
+        directories = {}
+        changed = False
+        stack = [""]
+        while stack:
+            relative_folder = stack.pop()
+            folder = os.path.join(self.root, relative_folder) if relative_folder else self.root
+            mtime = os.stat(folder).st_mtime_ns
+            previous = self.directories.get(relative_folder)
+            previous_piece = self.pieces.get(relative_folder)
+            if previous is not None and previous["mtime"] == mtime:
+                subdirectories = previous["subdirectories"]
+                piece = previous_piece
+                if piece is not None and piece["score_annotations"] is not None:
+                    # The folder did not change but the annotations may have been rewritten in place
+                    annotations_mtime = os.stat(os.path.join(folder, SCORE_ANNOTATIONS_FILE)).st_mtime_ns
+                    if annotations_mtime != piece["annotations_mtime"]:
+                        piece = scan_piece(folder, self._files_of(piece), previous_piece)
+                        changed = True
+            else:
+                subdirectories = []
+                files = []
+                for entry in os.scandir(folder):
+                    if entry.is_dir():
+                        subdirectories.append(entry.name)
+                    elif entry.is_file():
+                        files.append(entry.name)
+                subdirectories.sort()
+                piece = scan_piece(folder, files, previous_piece)
+                # Saving the manifest in the root folder changes its mtime, only the content counts
+                changed = changed or piece != previous_piece or previous is None or \
+                    subdirectories != previous["subdirectories"]
+            directories[relative_folder] = {"mtime": mtime, "subdirectories": subdirectories}
+            if piece is not None:
+                pieces[relative_folder] = piece
+            stack.extend(os.path.join(relative_folder, name) if relative_folder else name
+                         for name in reversed(subdirectories))
+        changed = changed or directories.keys() != self.directories.keys()
+        self.pieces = dict(sorted(pieces.items()))
+        self.directories = directories
+        return changed
+
+    @staticmethod
+    def _files_of(piece: dict) -> list:
+        files = piece["performance_midis"] + piece["performance_annotations"]
+        for name in ("score_midi", "score_annotations"):
+            if piece[name] is not None:
+                files.append(piece[name])
+        return files
+
+    def save(self):
+        """
+        Save the manifest as JSON, silently skipped if the dataset is read-only
+        """
+        data = {"version": MANIFEST_VERSION, "pieces": self.pieces, "directories": self.directories}
+        temporary = self.path + ".tmp"
+        try:
+            with open(temporary, "w") as f:
+                json.dump(data, f)
+            os.replace(temporary, self.path)
+        except OSError:
+            pass
+
+    def load(self) -> bool:
+        """
+        Load the saved manifest if there is one
+        :return: True if a manifest was loaded
+        """
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get("version") != MANIFEST_VERSION:
+            return False
+        self.pieces = data["pieces"]
+        self.directories = data["directories"]
+        return True
+
+    def piece_folders(self, with_score_annotations: bool = False) -> list:
+        """
+        Get the folders of the pieces
+        :param with_score_annotations: only the pieces with score annotations
+        :return: list of paths
+        """
+        return [self.folder(relative_folder) for relative_folder, piece in self.pieces.items()
+                if not with_score_annotations or piece["score_annotations"] is not None]
+
+    def score_midi_files(self) -> list:
+        """
+        Get the score MIDI files of the pieces
+        :return: list of paths
+        """
+        return [self.folder(relative_folder) + "/" + piece["score_midi"]
+                for relative_folder, piece in self.pieces.items() if piece["score_midi"] is not None]
+
+    def get_piece(self, folder: str) -> dict or None:
+        """
+        Get the entry of a piece folder
+        :param folder: path to the piece folder
+        :return: the piece entry or None if the folder is not a piece of this manifest
+        """
+        relative_folder = os.path.relpath(os.path.abspath(folder), os.path.abspath(self.root))
+        if relative_folder == ".":
+            relative_folder = ""
+        return self.pieces.get(relative_folder)
+
+
+def load_manifest(root: str, path: str = None) -> DatasetManifest:
+    """
+    Load the manifest of a dataset folder, refresh it and save it if it changed
+    :param root: root folder of the dataset
+    :param path: path to the JSON file, <root>/.asap_manifest.json if None
+    :return: DatasetManifest
+    """
+    manifest = DatasetManifest(root, path)
+    manifest.load()
+    if manifest.refresh():
+        manifest.save()
+    _manifests[os.path.abspath(root)] = manifest
+    return manifest
+
+
+def get_piece(folder: str) -> dict:
+    """
+    Get the entry of a piece folder from the manifests loaded in this process,
+    or by listing the folder when no loaded manifest contains it
+    :param folder: path to the piece folder
+    :return: the piece entry (empty lists and None if the folder is not a piece)
+    """
+    absolute_folder = os.path.abspath(folder)
+    for root, manifest in _manifests.items():
+        if absolute_folder == root or absolute_folder.startswith(root + os.sep):
+            piece = manifest.get_piece(folder)
+            if piece is not None:
+                return piece
+    files = [entry.name for entry in os.scandir(folder) if entry.is_file()]
+    return scan_piece(folder, files) or {
+        "score_midi": None, "performance_midis": [], "score_annotations": None, "performance_annotations": [],
+        "annotations_mtime": None, "nb_beats": 0, "nb_downbeats": 0,
+    }
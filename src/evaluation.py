@@ -0,0 +1,301 @@
+"""
+This module evaluates detected phrase boundaries against reference boundaries.
+
+The boundaries are compared in measures. The references are either every
+``phrase_length``-th downbeat of the score annotations (the 8-measure
+approximation used by the whole dataset runners) or annotated positions read
+from a file of the piece folder, one measure number per line.
+
+A detected boundary is correct when a reference boundary lies within the
+tolerance, and a reference boundary is found when a detected boundary lies
+within the tolerance. Both are decided with a nearest-neighbour search over
+sorted arrays, for every tolerance at once. evaluate_many scores many
+detections of the same piece (the configurations of a sweep) in a single
+vectorized pass.
+"""
+
+import numpy as np
+
+from src.beat_annotations import load_beat_annotations
+from src.boundary_fusion import fuse_boundaries
+from src.dataset_manifest import get_piece, load_manifest
+from src.parallel import run_in_parallel
+
+REFERENCE_FILE = "phrase_annotations.txt"
+DEFAULT_TOLERANCES = (0, 1, 2)
+METHODS = ("c1", "c1_tempo", "c3", "c3_approximate")
+
+
+def get_score_midi(folder_path: str) -> str:
+    """
+    Get the path to the score MIDI file of a piece, midi_score.mid or midi_score.midi
+    :param folder_path: path to the piece folder
+    :return: path to the file
+    """
+    score_midi = get_piece(folder_path)["score_midi"]
+    if score_midi is None:
+        raise ValueError(f"No score MIDI file in {folder_path}")
+    return folder_path + "/" + score_midi
+
+
+def get_downbeat_reference(folder_path: str, phrase_length: int = 8) -> np.ndarray:
+    """
+    Get a reference boundary every phrase_length measures of the score annotations
+    :param folder_path: path to the piece folder
+    :param phrase_length: number of measures of a phrase
+    :return: float array of measure numbers (1, 1 + phrase_length, ...)
+    """
+    nb_measures = len(load_beat_annotations(folder_path + "/midi_score_annotations.txt").downbeat_indexes())
+    return np.arange(1, nb_measures + 1, phrase_length, dtype=np.float64)
+
+
+def load_reference_file(path: str) -> np.ndarray:
+    """
+    Load annotated phrase boundaries, the first column of each non-empty line is a measure number
+    :param path: path to the file
+    :return: sorted float array of measure numbers
+    """
+    with open(path, "r") as f:
+        measures = [float(line.split()[0]) for line in f if line.strip() and not line.startswith("#")]
+    return np.sort(np.array(measures, dtype=np.float64))
+
+
+def beats_to_measures(beats, downbeat_indexes: np.ndarray) -> np.ndarray:
+    """
+    Convert beat indexes of the score annotations to measure numbers
+    :param beats: beat indexes
+    :param downbeat_indexes: sorted beat indexes of the downbeats
+    :return: float array of measure numbers (1 for the first measure, 0 for a pickup)
+    """
+    return np.searchsorted(downbeat_indexes, np.asarray(beats, dtype=np.int64), side="right").astype(np.float64)
+
+
+def _nearest_distances(values: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    # Distance from each value to the closest target, inf when there is no target
+    if len(targets) == 0:
+        return np.full(len(values), np.inf)
+    indexes = np.searchsorted(targets, values)
+    before = targets[np.clip(indexes - 1, 0, len(targets) - 1)]
+    after = targets[np.clip(indexes, 0, len(targets) - 1)]
+    return np.minimum(np.abs(values - before), np.abs(values - after))
+
+
+def _scores(true_detected: np.ndarray, nb_detected, found_reference: np.ndarray, nb_reference) -> dict:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(nb_detected > 0, true_detected / np.maximum(nb_detected, 1), 0.0)
+        recall = np.where(nb_reference > 0, found_reference / np.maximum(nb_reference, 1), 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    return {"precision": precision, "recall": recall, "f1": f1}
+
+
+def evaluate_boundaries(detected, reference, tolerances=DEFAULT_TOLERANCES) -> dict:
+    """
+    Compute the precision, recall and F1 of detected boundaries for several tolerances
+    :param detected: detected boundaries in measures
+    :param reference: reference boundaries in measures
+    :param tolerances: tolerances in measures
+    :return: dict with "tolerances", "nb_detected", "nb_reference" and a list of one value per tolerance
+             for "precision", "recall" and "f1"
+    """
+    return evaluate_many([detected], reference, tolerances)[0]
+
+
+def evaluate_many(detections: list, reference, tolerances=DEFAULT_TOLERANCES) -> list:
+    """
+    evaluate_boundaries for many detections of the same piece in one pass: the detections are
+    placed side by side on one axis, far enough apart not to interact, with a copy of the reference each
+    :param detections: list of detected boundaries (one per configuration)
+    :param reference: reference boundaries in measures
+    :param tolerances: tolerances in measures
+    :return: list of the outputs of evaluate_boundaries
+    """
+    tolerances = np.asarray(tolerances, dtype=np.float64)
+    reference = np.sort(np.asarray(reference, dtype=np.float64))
+    detections = [np.unique(np.asarray(detected, dtype=np.float64)) for detected in detections]
+    nb_groups = len(detections)
+    if nb_groups == 0:
+        return []
+    nb_detected = np.array([len(detected) for detected in detections], dtype=np.int64)
+    values = np.concatenate([reference] + detections)
+    if len(values) == 0:
+        span = 1.0
+    else:
+        span = values.max() - values.min() + 2 * (tolerances.max(initial=0) + 1)
+    origin = values.min(initial=0)
+
+    groups = np.repeat(np.arange(nb_groups), nb_detected)
+    all_detected = np.concatenate(detections) - origin + groups * span
+    all_reference = (reference - origin)[None, :] + (np.arange(nb_groups) * span)[:, None]
+    all_reference = all_reference.ravel()
+    reference_groups = np.repeat(np.arange(nb_groups), len(reference))
+
+    # tolerances x boundaries
+    detected_hits = _nearest_distances(all_detected, all_reference)[None, :] <= tolerances[:, None]
+    reference_hits = _nearest_distances(all_reference, all_detected)[None, :] <= tolerances[:, None]
+    true_detected = np.zeros((len(tolerances), nb_groups))
+    found_reference = np.zeros((len(tolerances), nb_groups))
+    for index in range(len(tolerances)):
+        true_detected[index] = np.bincount(groups, weights=detected_hits[index], minlength=nb_groups)
+        found_reference[index] = np.bincount(reference_groups, weights=reference_hits[index], minlength=nb_groups)
+    scores = _scores(true_detected, nb_detected[None, :], found_reference, len(reference))
+
+    return [{
+        "tolerances": tolerances.tolist(),
+        "nb_detected": int(nb_detected[group]),
+        "nb_reference": len(reference),
+        "precision": scores["precision"][:, group].tolist(),
+        "recall": scores["recall"][:, group].tolist(),
+        "f1": scores["f1"][:, group].tolist(),
+    } for group in range(nb_groups)]
+
+
+def get_reference(folder_path: str, reference: str = "downbeats", phrase_length: int = 8) -> np.ndarray:
+    """
+    Get the reference boundaries of a piece
+    :param folder_path: path to the piece folder
+    :param reference: "downbeats" for a boundary every phrase_length measures, "file" for REFERENCE_FILE
+                      in the piece folder, or the path to a reference file
+    :param phrase_length: number of measures of a phrase for the "downbeats" reference
+    :return: float array of measure numbers
+    """
+    if reference == "downbeats":
+        return get_downbeat_reference(folder_path, phrase_length)
+    if reference == "file":
+        return load_reference_file(folder_path + "/" + REFERENCE_FILE)
+    return load_reference_file(reference)
+
+
+def detect_boundaries(folder_path: str, method: str = "c3", threshold_similarity: float = 5) -> np.ndarray:
+    """
+    Get the boundaries detected by a method, in measures
+    :param folder_path: path to the piece folder
+    :param method: "c1" (tempo boundaries fused with the velocity changes), "c1_tempo" (tempo boundaries only),
+                   "c3" (repeating patterns of the score) or "c3_approximate" (approximate repeating patterns)
+    :param threshold_similarity: for "c1", a tempo boundary closer than this (in seconds) to a split point is kept
+    :return: float array of measure numbers
+    """
+    if method in ("c3", "c3_approximate"):
+        from src.task_c3 import get_boundaries
+        pattern_source = "approximate" if method == "c3_approximate" else "exact"
+        return np.asarray(get_boundaries(get_score_midi(folder_path), pattern_source=pattern_source),
+                          dtype=np.float64)
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method!r}, expected one of {METHODS}")
+    from src.task_c1 import get_c1_features, get_velocity_split_points
+    c1_features = get_c1_features(folder_path)
+    if c1_features is None:
+        return np.zeros(0)
+    beats = c1_features["boundaries"]
+    if method == "c1":
+        beat_of_time = dict(zip(c1_features["boundaries_times"], c1_features["boundaries"]))
+        split_points = get_velocity_split_points(c1_features)
+        beats = [beat_of_time[time] for time in fuse_boundaries(split_points, c1_features["boundaries_times"],
+                                                                     threshold_similarity)]
+    downbeat_indexes = load_beat_annotations(folder_path + "/midi_score_annotations.txt").downbeat_indexes()
+    return np.unique(beats_to_measures(beats, downbeat_indexes))
+
+
+def evaluate_piece(item: tuple) -> dict:
+    """
+    Evaluate one piece
+    :param item: (path to the piece folder, method, reference, tolerances, phrase_length, threshold_similarity)
+    :return: output of evaluate_boundaries
+    """
+    folder_path, method, reference, tolerances, phrase_length, threshold_similarity = item
+    return evaluate_boundaries(detect_boundaries(folder_path, method, threshold_similarity),
+                               get_reference(folder_path, reference, phrase_length), tolerances)
+
+
+def aggregate(results: dict) -> dict:
+    """
+    Aggregate the evaluation of several pieces
+    :param results: dict piece -> output of evaluate_boundaries (error dicts are ignored)
+    :return: dict with the macro average (mean over the pieces) and the micro average (over all the boundaries)
+             of the precision, recall and F1 for each tolerance, and the number of pieces
+    """
+    valid = [result for result in results.values() if "error" not in result]
+    if not valid:
+        return {"nb_pieces": 0}
+    tolerances = valid[0]["tolerances"]
+    macro = {name: np.mean([result[name] for result in valid], axis=0).tolist()
+             for name in ("precision", "recall", "f1")}
+    nb_detected = np.array([result["nb_detected"] for result in valid], dtype=np.float64)
+    nb_reference = np.array([result["nb_reference"] for result in valid], dtype=np.float64)
+    true_detected = (np.array([result["precision"] for result in valid]) * nb_detected[:, None]).sum(axis=0)
+    found_reference = (np.array([result["recall"] for result in valid]) * nb_reference[:, None]).sum(axis=0)
+    micro = {name: values.tolist() for name, values in
+             _scores(true_detected, nb_detected.sum(), found_reference, nb_reference.sum()).items()}
+    return {"nb_pieces": len(valid), "tolerances": tolerances, "macro": macro, "micro": micro}
+
+
+def evaluate_dataset(folder_path: str = "asap-dataset/", method: str = "c3", reference: str = "downbeats",
+                     tolerances=DEFAULT_TOLERANCES, phrase_length: int = 8, threshold_similarity: float = 5,
+                     workers: int = 1, chunk_size: int = 1, timeout: float = None) -> tuple:
+    """
+    Evaluate a method on every piece of the dataset
+    :param folder_path: path to the dataset
+    :param method: "c1", "c1_tempo" or "c3"
+    :param reference: "downbeats", "file" or the path to a reference file (see get_reference)
+    :param tolerances: tolerances in measures
+    :param phrase_length: number of measures of a phrase for the "downbeats" reference
+    :param threshold_similarity: fusion tolerance in seconds of the "c1" method
+    :param workers: number of processes, None for one per CPU
+    :param chunk_size: number of pieces sent to a process at once
+    :param timeout: timeout in seconds for each piece, None for no timeout
+    :return: dict piece -> evaluation (or error dict), and the aggregate over the pieces
+    """
+    paths = load_manifest(folder_path).piece_folders(with_score_annotations=True)
+    items = [(path, method, reference, tuple(tolerances), phrase_length, threshold_similarity) for path in paths]
+    results = {}
+    for item, result, error in run_in_parallel(evaluate_piece, items, workers, chunk_size, timeout):
+        results[item[0].replace("asap-dataset/", "")] = result if error is None else error
+    return results, aggregate(results)
+
+
+def evaluate_c3_grid_piece(item: tuple) -> list:
+    """
+    Evaluate every configuration of a C3 grid (see parameter_sweep.get_grid) on one piece,
+    the pattern search runs once per min_duration and the scores are computed with evaluate_many
+    :param item: (path to the piece folder, grid, reference, tolerances, phrase_length)
+    :return: list of the outputs of evaluate_boundaries, one per configuration
+    """
+    from src.task_c3 import extract_intervals_and_durations, find_pattern_starts, merge_pattern_boundaries
+    folder_path, grid, reference, tolerances, phrase_length = item
+    data = extract_intervals_and_durations(get_score_midi(folder_path))
+    pattern_starts = {}
+    detections = []
+    for configuration in grid:
+        min_duration = configuration["min_duration"]
+        if min_duration not in pattern_starts:
+            pattern_starts[min_duration] = find_pattern_starts(data, min_duration)
+        detections.append(merge_pattern_boundaries(pattern_starts[min_duration], configuration["measure_spacing"]))
+    return evaluate_many(detections, get_reference(folder_path, reference, phrase_length), tolerances)
+
+
+def evaluate_c3_grid(folder_path: str = "asap-dataset/", grid: list = None, reference: str = "downbeats",
+                     tolerances=DEFAULT_TOLERANCES, phrase_length: int = 8, workers: int = 1, chunk_size: int = 1,
+                     timeout: float = None) -> list:
+    """
+    Evaluate every configuration of a C3 grid on the whole dataset
+    :param folder_path: path to the dataset
+    :param grid: list of configurations (see parameter_sweep.get_grid), only the defaults if None
+    :param reference: "downbeats", "file" or the path to a reference file (see get_reference)
+    :param tolerances: tolerances in measures
+    :param phrase_length: number of measures of a phrase for the "downbeats" reference
+    :param workers: number of processes, None for one per CPU
+    :param chunk_size: number of pieces sent to a process at once
+    :param timeout: timeout in seconds for each piece (all its configurations)
+    :return: list with, for each configuration, {"configuration", "results": dict piece -> evaluation,
+             "aggregate": output of aggregate}
+    """
+    from src.parameter_sweep import C3_DEFAULTS, get_grid
+    grid = grid or get_grid(C3_DEFAULTS)
+    paths = load_manifest(folder_path).piece_folders(with_score_annotations=True)
+    items = [(path, grid, reference, tuple(tolerances), phrase_length) for path in paths]
+    results = [{} for _ in grid]
+    for item, result, error in run_in_parallel(evaluate_c3_grid_piece, items, workers, chunk_size, timeout):
+        key = item[0].replace("asap-dataset/", "")
+        for index in range(len(grid)):
+            results[index][key] = result[index] if error is None else error
+    return [{"configuration": configuration, "results": results[index], "aggregate": aggregate(results[index])}
+            for index, configuration in enumerate(grid)]
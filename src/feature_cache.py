@@ -0,0 +1,180 @@
+"""
+This module contains an on-disk cache for the features extracted from the
+MIDI and annotation files of the dataset.
+
+Entries are ``.npz`` files named after the kind of features and the SHA-256
+of the content of the source file, so a modified file is never served stale
+data. The extractor version is part of the key, bump EXTRACTOR_VERSION when
+an extractor changes its output. When the cache grows over its size cap the
+least recently used entries are removed.
+
+The default cache lives in ``$DM_CACHE_DIR`` (``~/.cache/dm_assignment3``
+when not set) and is disabled by setting ``DM_NO_CACHE=1`` or calling
+``configure_cache(enabled=False)``.
+"""
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from src import instrumentation
+from src.prefetch import get_prefetched
+
+EXTRACTOR_VERSION = 3
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+CACHE_DIR_ENV = "DM_CACHE_DIR"
+NO_CACHE_ENV = "DM_NO_CACHE"
+
+
+def get_file_hash(path: str) -> str:
+    """
+    Get the SHA-256 of the content of a file
+    :param path: path to the file
+    :return: hex digest
+    """
+    data = get_prefetched(path)
+    if data is not None:
+        return hashlib.sha256(data).hexdigest()
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FeatureCache:
+    """
+    Cache of arrays keyed by the content of a source file.
+
+    :ivar directory: directory of the cache entries
+    :ivar max_bytes: size cap of the cache
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._hashes = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def entry_path(self, path: str, kind: str) -> str:
+        """
+        Get the path of the cache entry of a source file
+        :param path: path to the source file
+        :param kind: kind of features stored in the entry
+        :return: path to the .npz entry
+        """
+        # The hash is computed once per version of the file (get then put on a miss)
+        stat = os.stat(path)
+        signature = (path, stat.st_mtime_ns, stat.st_size)
+        if signature not in self._hashes:
+            self._hashes[signature] = get_file_hash(path)
+        return os.path.join(self.directory, f"{kind}-v{EXTRACTOR_VERSION}-{self._hashes[signature]}.npz")
+
+    def get(self, path: str, kind: str) -> dict or None:
+        """
+        Get the cached arrays of a source file
+        :param path: path to the source file
+        :param kind: kind of features
+        :return: dict of arrays or None if there is no entry
+        """
+        entry = self.entry_path(path, kind)
+        try:
+            with np.load(entry, allow_pickle=False) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            self.misses += 1
+            instrumentation.count("cache_misses")
+            return None
+        # Touch the entry to keep it out of the eviction
+        os.utime(entry)
+        self.hits += 1
+        instrumentation.count("cache_hits")
+        return arrays
+
+    def put(self, path: str, kind: str, arrays: dict):
+        """
+        Store the arrays of a source file
+        :param path: path to the source file
+        :param kind: kind of features
+        :param arrays: dict of arrays
+        """
+        entry = self.entry_path(path, kind)
+        # Write to a temporary file first so that concurrent readers never see a partial entry
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(temporary, entry)
+        except BaseException:
+            os.remove(temporary)
+            raise
+        if self._size is not None:
+            self._size += os.path.getsize(entry)
+        if self._size is None or self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in max_bytes
+        """
+        entries = []
+        for dir_entry in os.scandir(self.directory):
+            if dir_entry.name.endswith(".npz"):
+                stat = dir_entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, dir_entry.path))
+        entries.sort()
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, entry_path in entries:
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+        self._size = size
+
+    def clear(self):
+        """
+        Remove every entry of the cache
+        """
+        for dir_entry in os.scandir(self.directory):
+            if dir_entry.name.endswith(".npz"):
+                os.remove(dir_entry.path)
+        self._size = 0
+
+
+_default_cache = None
+_default_configured = False
+
+
+def configure_cache(directory: str = None, max_bytes: int = DEFAULT_MAX_BYTES, enabled: bool = True):
+    """
+    Configure the cache used by the loaders
+    :param directory: directory of the cache, the default directory if None
+    :param max_bytes: size cap of the cache
+    :param enabled: False to disable the cache
+    """
+    global _default_cache, _default_configured
+    _default_configured = True
+    if not enabled:
+        _default_cache = None
+        return
+    if directory is None:
+        directory = os.environ.get(CACHE_DIR_ENV, os.path.join(os.path.expanduser("~"), ".cache", "dm_assignment3"))
+    _default_cache = FeatureCache(directory, max_bytes)
+
+
+def get_default_cache() -> FeatureCache or None:
+    """
+    Get the cache used by the loaders, configured from the environment on first use
+    :return: FeatureCache or None if the cache is disabled
+    """
+    if not _default_configured:
+        configure_cache(enabled=os.environ.get(NO_CACHE_ENV, "") in ("", "0"))
+    return _default_cache
@@ -0,0 +1,274 @@
+"""
+This module contains timers and counters around the stages of the pipeline,
+to find where the time of a corpus run goes.
+
+Instrumentation is disabled by default. It is enabled with ``enable()`` or by
+setting ``DM_INSTRUMENT=1``. While it is disabled, ``stage`` returns a shared
+no-op context and ``count`` returns immediately.
+
+Stages nest: a stage opened inside another one is recorded under the path of
+its parents (``"piece;phrase_boundaries;average_timing;annotation_read"``), with its total
+and self time. Each piece of the whole dataset runs gets its own profile. The
+profiles can be exported as JSON, as a Chrome trace (chrome://tracing,
+Perfetto, speedscope), or as collapsed stacks for flamegraph.pl.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+
+INSTRUMENT_ENV = "DM_INSTRUMENT"
+
+_enabled = os.environ.get(INSTRUMENT_ENV, "") not in ("", "0")
+
+
+class Profile:
+    """
+    Timers and counters of one piece (or of everything outside the pieces).
+
+    :ivar name: name of the profile, the path to the piece
+    :ivar stages: dict stage path -> {"calls": ..., "seconds": ..., "self_seconds": ...}
+    :ivar counters: dict counter name -> value
+    :ivar events: list of Chrome trace events
+    """
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self.stages = {}
+        self.counters = {}
+        self.events = []
+        self._stack = []
+
+    def to_dict(self) -> dict:
+        """
+        Convert to a JSON serializable dict
+        :return: dict
+        """
+        return {"name": self.name, "stages": self.stages, "counters": self.counters, "events": self.events}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Profile":
+        """
+        Build from the output of to_dict
+        :param data: dict
+        :return: Profile
+        """
+        profile = cls(data["name"])
+        profile.stages = data["stages"]
+        profile.counters = data["counters"]
+        profile.events = data["events"]
+        return profile
+
+
+class _Stage:
+    def __init__(self, profile: Profile, name: str):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        # [name, start, time spent in the children]
+        self.profile._stack.append([self.name, time.perf_counter(), 0.0])
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter()
+        stack = self.profile._stack
+        path = ";".join(frame[0] for frame in stack)
+        _, start, children = stack.pop()
+        seconds = end - start
+        if stack:
+            stack[-1][2] += seconds
+        stage = self.profile.stages.get(path)
+        if stage is None:
+            stage = self.profile.stages[path] = {"calls": 0, "seconds": 0.0, "self_seconds": 0.0}
+        stage["calls"] += 1
+        stage["seconds"] += seconds
+        stage["self_seconds"] += seconds - children
+        self.profile.events.append({
+            "name": self.name, "ph": "X", "ts": start * 1e6, "dur": seconds * 1e6,
+            "pid": os.getpid(), "tid": threading.get_ident(), "args": {"piece": self.profile.name},
+        })
+        return False
+
+
+class _NullContext:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_CONTEXT = _NullContext()
+_current = Profile()
+_profiles = []
+
+
+def enable(enabled: bool = True):
+    """
+    Enable or disable the instrumentation
+    :param enabled: bool
+    """
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled() -> bool:
+    """
+    :return: True if the instrumentation is enabled
+    """
+    return _enabled
+
+
+def stage(name: str):
+    """
+    Time a stage: ``with stage("midi_parse"): ...``
+    :param name: name of the stage
+    :return: context manager
+    """
+    if not _enabled:
+        return _NULL_CONTEXT
+    return _Stage(_current, name)
+
+
+def timed(name: str):
+    """
+    Decorator timing every call of a function as a stage
+    :param name: name of the stage
+    :return: decorator
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _Stage(_current, name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name: str, value: int = 1):
+    """
+    Increment a counter
+    :param name: name of the counter
+    :param value: increment
+    """
+    if not _enabled:
+        return
+    _current.counters[name] = _current.counters.get(name, 0) + value
+
+
+class _Piece:
+    def __init__(self, name: str):
+        self.profile = Profile(name)
+        self.previous = None
+        self.stage = _Stage(self.profile, "piece")
+
+    def __enter__(self):
+        global _current
+        self.previous = _current
+        _current = self.profile
+        self.stage.__enter__()
+        return self.profile
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _current
+        self.stage.__exit__(exc_type, exc_value, traceback)
+        _current = self.previous
+        return False
+
+
+def piece(name: str):
+    """
+    Record the stages and counters of one piece in their own profile:
+    ``with piece(path) as profile: ...``, profile is None when the instrumentation is disabled.
+    The profile is not kept, pass it to add_profile (the pieces may run in other processes).
+    :param name: name of the piece
+    :return: context manager
+    """
+    if not _enabled:
+        return _NULL_CONTEXT
+    return _Piece(name)
+
+
+def add_profile(profile: Profile or dict):
+    """
+    Keep the profile of a piece for the exports
+    :param profile: Profile or the output of Profile.to_dict
+    """
+    if isinstance(profile, dict):
+        profile = Profile.from_dict(profile)
+    _profiles.append(profile)
+
+
+def collect_profiles(results):
+    """
+    Keep the profiles sent back with the results of the pieces and remove them from the results
+    :param results: iterable of (item, result, error) as returned by parallel.run_in_parallel
+    :return: generator of (item, result, error)
+    """
+    for item, result, error in results:
+        if error is None and isinstance(result, dict) and "profile" in result:
+            add_profile(result.pop("profile"))
+        yield item, result, error
+
+
+def get_profiles() -> list:
+    """
+    Get the profiles kept with add_profile and the profile of what ran outside the pieces
+    :return: list of Profile
+    """
+    return _profiles + ([_current] if _current.stages or _current.counters else [])
+
+
+def reset():
+    """
+    Forget every profile
+    """
+    global _current
+    _current = Profile()
+    _profiles.clear()
+
+
+def export_json(path: str, with_events: bool = False):
+    """
+    Write the stages and counters of every profile as JSON
+    :param path: path to the file
+    :param with_events: also write the individual events
+    """
+    profiles = []
+    for profile in get_profiles():
+        data = profile.to_dict()
+        if not with_events:
+            del data["events"]
+        profiles.append(data)
+    with open(path, "w") as f:
+        json.dump(profiles, f, indent=2)
+
+
+def export_chrome_trace(path: str):
+    """
+    Write the events of every profile in the Chrome trace event format
+    :param path: path to the file
+    """
+    events = [event for profile in get_profiles() for event in profile.events]
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def export_collapsed_stacks(path: str):
+    """
+    Write the self time of every stage path in the collapsed stack format of flamegraph.pl
+    (one line "piece;stage;substage microseconds" per stage path)
+    :param path: path to the file
+    """
+    totals = {}
+    for profile in get_profiles():
+        for stage_path, stage_times in profile.stages.items():
+            totals[stage_path] = totals.get(stage_path, 0.0) + stage_times["self_seconds"]
+    with open(path, "w") as f:
+        for stage_path, seconds in sorted(totals.items()):
+            f.write(f"{stage_path} {round(seconds * 1e6)}\n")
@@ -0,0 +1,219 @@
+"""
+This module contains the features of a MIDI file used by tasks C1 and C3,
+extracted from a single music21 parse.
+
+music21 is imported on the first parse, importing this module (to read
+cached features or to use the native reader) does not load it.
+"""
+
+import os
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from src import instrumentation
+from src.feature_cache import get_default_cache
+from src.onset_table import OnsetTable, to_quarter_length
+from src.prefetch import get_prefetched
+
+if TYPE_CHECKING:
+    import music21
+
+CACHE_KIND = "midi"
+# "music21" or "native" (see midi_reader), the default can be set with $DM_MIDI_BACKEND or configure_backend
+BACKENDS = ("music21", "native")
+MIDI_BACKEND_ENV = "DM_MIDI_BACKEND"
+DEFAULT_BACKEND = os.environ.get(MIDI_BACKEND_ENV, "music21")
+
+
+class MidiFeatures:
+    """
+    Features of one MIDI file.
+
+    :ivar path: path to the MIDI file
+    :ivar times: offset of each note or chord of the flattened parts
+    :ivar volumes: velocity of each note or chord of the flattened parts
+    :ivar measures: measure number of each note or chord of the flattened parts
+    :ivar onset_table: OnsetTable of the onsets (measure number, offset in the measure) with their pitches,
+                       the duration of their first note, their root and interval
+    :ivar metronome_marks: list of (start offset, end offset, BPM)
+    :ivar number_of_measures: number of measures of the first part
+    """
+
+    def __init__(self, path: str, times: list, volumes: list, measures: list, onset_table: OnsetTable,
+                 metronome_marks: list, number_of_measures: int):
+        self.path = path
+        self.times = times
+        self.volumes = volumes
+        self.measures = measures
+        self.onset_table = onset_table
+        self.metronome_marks = metronome_marks
+        self.number_of_measures = number_of_measures
+
+    @property
+    def tempo(self) -> float:
+        """
+        Tempo in BPM of the first metronome mark
+        :return: float
+        """
+        return self.metronome_marks[0][2]
+
+    def to_arrays(self) -> dict:
+        """
+        Convert to a dict of arrays that can be saved with numpy.savez.
+        The columns of the onset table are stored as they are.
+        :return: dict of arrays
+        """
+        table = self.onset_table
+        return {
+            "times": np.array(self.times, dtype=np.float64),
+            "volumes": _to_int_array(self.volumes),
+            "measures": _to_int_array(self.measures),
+            "onset_measures": table.measures,
+            "onset_offsets": table.offsets,
+            "onset_durations": table.durations,
+            "onset_roots": table.roots,
+            "onset_intervals": table.intervals,
+            "pitches": table.pitches,
+            "pitch_starts": table.pitch_starts,
+            "metronome_marks": np.array(self.metronome_marks, dtype=np.float64).reshape(-1, 3),
+            "number_of_measures": np.array(self.number_of_measures, dtype=np.int64),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, path: str = "") -> "MidiFeatures":
+        """
+        Build from the output of to_arrays
+        :param arrays: dict of arrays (or NpzFile)
+        :param path: path to the MIDI file
+        :return: MidiFeatures
+        """
+        onset_table = OnsetTable(*(arrays[name] for name in (
+            "onset_measures", "onset_offsets", "onset_durations", "onset_roots", "onset_intervals", "pitches",
+            "pitch_starts")))
+        return cls(
+            path,
+            [to_quarter_length(time) for time in arrays["times"].tolist()],
+            _from_int_array(arrays["volumes"]),
+            _from_int_array(arrays["measures"]),
+            onset_table,
+            [tuple(mark) for mark in arrays["metronome_marks"].tolist()],
+            int(arrays["number_of_measures"]),
+        )
+
+
+def _to_int_array(values: list) -> np.ndarray:
+    # None (no measure or no velocity) is stored as -1
+    return np.array([-1 if value is None else value for value in values], dtype=np.int64)
+
+
+def _from_int_array(values: np.ndarray) -> list:
+    return [None if value == -1 else value for value in values.tolist()]
+
+
+def extract_midi_features(midi_data: "music21.stream.Score", path: str = "") -> MidiFeatures:
+    """
+    Extract the features from a parsed MIDI file
+    :param midi_data: stream returned by music21.converter.parse
+    :param path: path to the MIDI file
+    :return: MidiFeatures
+    """
+    import music21
+
+    times = []
+    volumes = []
+    measures = []
+    for part in midi_data.parts:
+        for element in part.flatten().notesAndRests:
+            if isinstance(element, (music21.note.Note, music21.chord.Chord)):
+                times.append(element.offset)
+                volumes.append(element.volume.velocity)
+                measures.append(element.measureNumber)
+
+    # One event per pitch, the onset table groups the events at the same position
+    event_measures = []
+    event_offsets = []
+    event_durations = []
+    event_pitches = []
+    for n in midi_data.recurse().notes:
+        if n.isNote:
+            pitches = [n.pitch.midi]
+        elif n.isChord:
+            pitches = [p.midi for p in n.pitches]
+        else:
+            continue
+        event_measures.extend([n.measureNumber] * len(pitches))
+        event_offsets.extend([n.offset] * len(pitches))
+        event_durations.extend([n.duration.quarterLength] * len(pitches))
+        event_pitches.extend(pitches)
+    onset_table = OnsetTable.from_events(event_measures, event_offsets, event_durations, event_pitches)
+
+    metronome_marks = [(start, end, mark.number) for start, end, mark in midi_data.metronomeMarkBoundaries()]
+    number_of_measures = len(midi_data.parts[0].getElementsByClass('Measure'))
+    return MidiFeatures(path, times, volumes, measures, onset_table, metronome_marks, number_of_measures)
+
+
+def configure_backend(backend: str):
+    """
+    Set the backend used when load_midi_features is not given one, in this process and, through the
+    environment, in the worker processes
+    :param backend: "music21" or "native"
+    """
+    global DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown MIDI backend {backend!r}, expected one of {BACKENDS}")
+    os.environ[MIDI_BACKEND_ENV] = backend
+    DEFAULT_BACKEND = backend
+
+
+def get_default_backend() -> str:
+    """
+    :return: the backend used when load_midi_features is not given one
+    """
+    return DEFAULT_BACKEND
+
+
+def load_midi_features(midi_file_path: str, backend: str = None) -> MidiFeatures:
+    """
+    Parse a MIDI file once and extract its features, through the feature cache when it is enabled
+    :param midi_file_path: path to the MIDI file
+    :param backend: "music21" or "native", DEFAULT_BACKEND if None
+    :return: MidiFeatures
+    """
+    backend = backend or DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown MIDI backend {backend!r}, expected one of {BACKENDS}")
+    kind = CACHE_KIND if backend == "music21" else f"{CACHE_KIND}-{backend}"
+    cache = get_default_cache()
+    if cache is not None:
+        arrays = cache.get(midi_file_path, kind)
+        if arrays is not None:
+            return MidiFeatures.from_arrays(arrays, midi_file_path)
+    with instrumentation.stage("midi_parse"):
+        if backend == "native":
+            from src.midi_reader import load_native_midi_features
+            features = load_native_midi_features(midi_file_path)
+        else:
+            import music21
+            data = get_prefetched(midi_file_path)
+            if data is None:
+                midi_data = music21.converter.parse(midi_file_path)
+            else:
+                midi_data = music21.converter.parseData(data, format="midi")
+            features = extract_midi_features(midi_data, midi_file_path)
+    instrumentation.count("midi_files_parsed")
+    instrumentation.count("notes_extracted", len(features.times))
+    if cache is not None:
+        cache.put(midi_file_path, kind, features.to_arrays())
+    return features
+
+
+def as_midi_features(midi_file: str or MidiFeatures) -> MidiFeatures:
+    """
+    Get the features of a MIDI file given either its path or its already extracted features
+    :param midi_file: path to the MIDI file or MidiFeatures
+    :return: MidiFeatures
+    """
+    if isinstance(midi_file, MidiFeatures):
+        return midi_file
+    return load_midi_features(midi_file)
@@ -0,0 +1,390 @@
+"""
+This module contains a lightweight Standard MIDI File reader that builds the
+MidiFeatures of a file without the music21 object model.
+
+The tracks are decoded with ``struct`` into NumPy arrays of notes, tempo and
+time signature events. The features are then rebuilt following the rules of
+the music21 MIDI import: notes starting and ending together are grouped into
+chords, offsets and durations are quantized to quarters and triplets (with the
+float arithmetic of music21), bars are laid out from the time signatures and
+notes crossing a barline are split into tied notes, listed after the notes
+starting at the same offset as music21 does. On the synthetic corpus of the
+benchmarks the features are the same as the ones of the music21 path. Files
+where music21 has to split overlapping notes into voices may still list their
+notes in another order, music21 stays the default backend.
+``validate_native_reader`` compares the result with the music21 path for a
+given file.
+"""
+
+import math
+import struct
+from bisect import bisect_left, bisect_right
+from fractions import Fraction
+
+import numpy as np
+
+from src.midi_features import MidiFeatures
+from src.onset_table import OnsetTable, to_quarter_length
+from src.prefetch import read_bytes
+
+QUARTER_LENGTH_DIVISORS = (4, 3)
+DEFAULT_TEMPO = 120.0
+NOTE_DTYPE = np.dtype([("start", np.int64), ("end", np.int64), ("pitch", np.int16),
+                       ("velocity", np.int16), ("channel", np.int8)])
+
+
+class MidiFileData:
+    """
+    Decoded content of a Standard MIDI File.
+
+    :ivar format: SMF format (0, 1 or 2)
+    :ivar ticks_per_quarter: resolution of the file
+    :ivar tracks: one structured array of notes (NOTE_DTYPE) per track, in the order of their note on
+    :ivar tempos: int array of (tick, microseconds per quarter) rows
+    :ivar time_signatures: int array of (tick, numerator, denominator) rows
+    """
+
+    def __init__(self, format: int, ticks_per_quarter: int, tracks: list, tempos: np.ndarray,
+                 time_signatures: np.ndarray):
+        self.format = format
+        self.ticks_per_quarter = ticks_per_quarter
+        self.tracks = tracks
+        self.tempos = tempos
+        self.time_signatures = time_signatures
+
+
+def _read_variable_length(data: bytes, position: int) -> tuple:
+    value = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, position
+
+
+def _read_track(data: bytes, tempos: list, time_signatures: list) -> np.ndarray:
+    note_events = []
+    tick = 0
+    position = 0
+    running_status = 0
+    while position < len(data):
+        delta, position = _read_variable_length(data, position)
+        tick += delta
+        status = running_status
+        if data[position] & 0x80:
+            status = data[position]
+            position += 1
+        if status < 0xF0:
+            running_status = status
+        if status == 0xFF:
+            meta_type = data[position]
+            length, position = _read_variable_length(data, position + 1)
+            payload = data[position:position + length]
+            position += length
+            if meta_type == 0x51 and length == 3:
+                tempos.append((tick, int.from_bytes(payload, "big")))
+            elif meta_type == 0x58 and length >= 2:
+                time_signatures.append((tick, payload[0], 2 ** payload[1]))
+            elif meta_type == 0x2F:
+                break
+        elif status in (0xF0, 0xF7):
+            length, position = _read_variable_length(data, position)
+            position += length
+        else:
+            kind = status & 0xF0
+            channel = (status & 0x0F) + 1
+            if kind in (0xC0, 0xD0):
+                position += 1
+                continue
+            pitch, velocity = data[position], data[position + 1]
+            position += 2
+            if kind == 0x90 or kind == 0x80:
+                note_events.append((tick, kind == 0x90 and velocity > 0, pitch, velocity, channel))
+
+    # Like music21, each note on ends at the first following note off of the same pitch and channel
+    notes = []
+    note_offs = {}
+    for tick, is_note_on, pitch, velocity, channel in reversed(note_events):
+        if not is_note_on:
+            note_offs[pitch, channel] = tick
+        elif (pitch, channel) in note_offs:
+            notes.append((tick, note_offs[pitch, channel], pitch, velocity, channel))
+    return np.array(notes[::-1], dtype=NOTE_DTYPE)
+
+
+def parse_midi_bytes(data: bytes) -> MidiFileData:
+    """
+    Decode the content of a Standard MIDI File
+    :param data: bytes of the file
+    :return: MidiFileData
+    """
+    if data[:4] != b"MThd":
+        raise ValueError("Not a Standard MIDI File")
+    header_length, midi_format, nb_tracks, division = struct.unpack(">IHHH", data[4:14])
+    if division & 0x8000:
+        raise ValueError("SMPTE time division is not supported")
+    position = 8 + header_length
+    tracks = []
+    tempos = []
+    time_signatures = []
+    while position < len(data) and len(tracks) < nb_tracks:
+        chunk_type, length = struct.unpack(">4sI", data[position:position + 8])
+        position += 8
+        if chunk_type == b"MTrk":
+            tracks.append(_read_track(data[position:position + length], tempos, time_signatures))
+        position += length
+    return MidiFileData(
+        midi_format, division, tracks,
+        np.array(sorted(tempos, key=lambda event: event[0]), dtype=np.int64).reshape(-1, 2),
+        np.array(sorted(time_signatures, key=lambda event: event[0]), dtype=np.int64).reshape(-1, 3),
+    )
+
+
+def read_midi_file(midi_file_path: str) -> MidiFileData:
+    """
+    Decode a Standard MIDI File
+    :param midi_file_path: path to the MIDI file
+    :return: MidiFileData
+    """
+    return parse_midi_bytes(read_bytes(midi_file_path))
+
+
+def best_match(target: float, zero_allowed: bool = True, gap_to_fill: float = 0.0) -> float:
+    """
+    Quantize a quarter length to the nearest multiple of 1/4 or 1/3 like music21's Stream.quantize:
+    the grid leaving the smallest gap before the next note wins, then the smallest error, then the finest grid
+    :param target: quarter length to quantize
+    :param zero_allowed: False to never quantize to 0 (durations of notes)
+    :param gap_to_fill: distance to the next note (0 for offsets)
+    :return: quantized quarter length as a float
+    """
+    found = []
+    for divisor in QUARTER_LENGTH_DIVISORS:
+        tick = 1 / divisor
+        multiple = math.floor(target / tick)
+        low = tick * multiple
+        if target <= low + tick / 2.0:
+            match, error = low, round(target - low, 7)
+        else:
+            match = tick * (multiple + 1)
+            error = round(match - target, 7)
+        if not zero_allowed and match == 0.0:
+            match = tick
+            error = abs(round(target - match, 7))
+        remaining_gap = 0.0 if gap_to_fill % tick == 0 else max(gap_to_fill - match, 0.0)
+        found.append((remaining_gap, error, tick, match))
+    return min(found)[3]
+
+
+def _to_fraction(value: float) -> Fraction:
+    # Quantized quarter lengths are exact as Fractions (thirds are rounded as floats)
+    return Fraction(to_quarter_length(float(value)))
+
+
+def _to_music21_number(value: Fraction) -> float or Fraction:
+    # music21 stores multiples of a power of two as floats and the other quarter lengths as Fractions
+    if value.denominator & (value.denominator - 1) == 0:
+        return float(value)
+    return value
+
+
+def _group_chords(notes: np.ndarray, ticks_per_quarter: int) -> list:
+    """
+    Group the notes starting and ending together into chords, as music21 does on import
+    :param notes: structured array of notes sorted by start
+    :param ticks_per_quarter: resolution of the file
+    :return: list of (start tick, end tick, velocity, pitches)
+    """
+    tolerance = ticks_per_quarter / max(QUARTER_LENGTH_DIVISORS)
+    starts = notes["start"].tolist()
+    ends = notes["end"].tolist()
+    pitches = notes["pitch"].tolist()
+    velocities = notes["velocity"].tolist()
+    gathered = [False] * len(starts)
+    events = []
+    for i in range(len(starts)):
+        if gathered[i]:
+            continue
+        group = [i]
+        for j in range(i + 1, len(starts)):
+            if abs(starts[j] - starts[i]) >= tolerance:
+                break
+            if abs(ends[j] - ends[i]) > tolerance:
+                continue
+            group.append(j)
+            gathered[j] = True
+        if len(group) == 1:
+            velocity = velocities[i]
+        else:
+            velocity = int(round(sum(velocities[j] for j in group) / len(group)))
+        # The duration of a chord is the one of its last note
+        last = group[-1]
+        events.append((starts[i], starts[i] + ends[last] - starts[last], velocity,
+                       [pitches[j] for j in group]))
+    return events
+
+
+def _quantize_part(events: list, ticks_per_quarter: int) -> list:
+    """
+    Quantize the offsets and durations of the notes and chords of a part
+    :param events: list of (start tick, end tick, velocity, pitches) sorted by start
+    :param ticks_per_quarter: resolution of the file
+    :return: list of (start, end, velocity, pitches) with Fraction offsets, sorted by start
+    """
+    offsets = [best_match(start / ticks_per_quarter) for start, _, _, _ in events]
+    part = []
+    for i, (start, end, velocity, pitches) in enumerate(events):
+        offset = _to_fraction(offsets[i])
+        duration = (end - start) / ticks_per_quarter
+        # The duration is quantized to fill the gap up to the next note when possible
+        for j in range(i + 1, len(events)):
+            if offsets[j] > offsets[i]:
+                # As music21, the float offset of the next note minus the offset of this one
+                gap_to_fill = to_quarter_length(offsets[j] - _to_music21_number(offset))
+                duration = best_match(duration, zero_allowed=False, gap_to_fill=gap_to_fill)
+                break
+        else:
+            duration = best_match(duration, zero_allowed=False)
+        part.append((offset, offset + _to_fraction(duration), velocity, pitches))
+    part.sort(key=lambda note: note[0])
+    return part
+
+
+def _get_bar_starts(time_signatures: np.ndarray, ticks_per_quarter: int, end: Fraction) -> list:
+    """
+    Lay out the bars from the time signatures
+    :param time_signatures: int array of (tick, numerator, denominator) rows
+    :param ticks_per_quarter: resolution of the file
+    :param end: offset in quarter lengths that the bars must cover
+    :return: list of Fractions with the offset of each bar followed by the end of the last bar
+    """
+    changes = [(Fraction(0), Fraction(4))]
+    for tick, numerator, denominator in time_signatures.tolist():
+        offset = _to_fraction(tick / ticks_per_quarter)
+        if changes[-1][0] == offset:
+            changes.pop()
+        changes.append((offset, Fraction(4 * numerator, denominator)))
+    bar_starts = []
+    offset = Fraction(0)
+    k = 0
+    while offset < end or not bar_starts:
+        while k + 1 < len(changes) and changes[k + 1][0] <= offset:
+            k += 1
+        bar_starts.append(offset)
+        offset += changes[k][1]
+    bar_starts.append(offset)
+    return bar_starts
+
+
+def extract_native_midi_features(midi_data: MidiFileData, path: str = "") -> MidiFeatures:
+    """
+    Build the features of a MIDI file from its decoded content
+    :param midi_data: MidiFileData
+    :param path: path to the MIDI file
+    :return: MidiFeatures
+    """
+    ticks_per_quarter = midi_data.ticks_per_quarter
+    tracks = [track for track in midi_data.tracks if len(track) > 0]
+    parts = [_quantize_part(_group_chords(track, ticks_per_quarter), ticks_per_quarter) for track in tracks]
+
+    end = max((max(note[1] for note in part) for part in parts if part), default=Fraction(0))
+    bar_starts = _get_bar_starts(midi_data.time_signatures, ticks_per_quarter, end)
+
+    times = []
+    volumes = []
+    measures = []
+    # One event per pitch, the onset table groups the events at the same position
+    event_measures = []
+    event_offsets = []
+    event_durations = []
+    event_pitches = []
+    for part in parts:
+        starting = [[] for _ in range(len(bar_starts) - 1)]
+        for note in part:
+            starting[bisect_right(bar_starts, note[0]) - 1].append(note)
+        # Split the notes at the barlines like the ties made by music21, measure after measure: the tied
+        # continuations are inserted in a measure already filled, after its notes at the same offset
+        pieces = []
+        continued = []
+        for bar, notes in enumerate(starting):
+            bar_end = bar_starts[bar + 1]
+            last_bar = bar + 2 >= len(bar_starts)
+            carried = []
+            for start, stop, velocity, pitches in sorted(notes + continued, key=lambda note: note[0]):
+                pieces.append((bar, start, min(stop, bar_end), velocity, pitches))
+                if stop > bar_end and not last_bar:
+                    carried.append((bar_end, stop, velocity, pitches))
+            continued = carried
+        for bar, start, stop, velocity, pitches in pieces:
+            times.append(_to_music21_number(start))
+            volumes.append(velocity)
+            measures.append(bar + 1)
+            event_measures.extend([bar + 1] * len(pitches))
+            event_offsets.extend([start - bar_starts[bar]] * len(pitches))
+            event_durations.extend([stop - start] * len(pitches))
+            event_pitches.extend(pitches)
+
+    # Number of bars needed to hold the first part, and end of the last bar of the score
+    first_part_end = max((note[1] for note in parts[0]), default=Fraction(0)) if parts else Fraction(0)
+    number_of_measures = max(1, bisect_left(bar_starts, first_part_end))
+    score_end = bar_starts[max(1, bisect_left(bar_starts, end))]
+    onset_table = OnsetTable.from_events(event_measures, event_offsets, event_durations, event_pitches)
+    return MidiFeatures(path, times, volumes, measures, onset_table,
+                        _get_metronome_marks(midi_data, float(score_end)), number_of_measures)
+
+
+def _get_metronome_marks(midi_data: MidiFileData, score_end: float) -> list:
+    marks = {}
+    for tick, microseconds in midi_data.tempos.tolist():
+        marks[to_quarter_length(tick / midi_data.ticks_per_quarter)] = round(60_000_000 / microseconds, 2)
+    if 0 not in marks:
+        marks[0.0] = DEFAULT_TEMPO
+    starts = sorted(marks)
+    return [(start, starts[k + 1] if k + 1 < len(starts) else score_end, marks[start])
+            for k, start in enumerate(starts)]
+
+
+def load_native_midi_features(midi_file_path: str) -> MidiFeatures:
+    """
+    Read a MIDI file with the native reader and build its features
+    :param midi_file_path: path to the MIDI file
+    :return: MidiFeatures
+    """
+    return extract_native_midi_features(read_midi_file(midi_file_path), midi_file_path)
+
+
+def validate_native_reader(midi_file_path: str) -> dict:
+    """
+    Compare the features of the native reader with the ones of the music21 path
+    :param midi_file_path: path to the MIDI file
+    :return: dict with, for each feature, None if both readers agree or a description of the first difference
+    """
+    from src.midi_features import load_midi_features
+
+    native = load_native_midi_features(midi_file_path)
+    reference = load_midi_features(midi_file_path, backend="music21")
+    report = {}
+    for name in ("times", "volumes", "measures"):
+        expected = getattr(reference, name)
+        found = getattr(native, name)
+        report[name] = None
+        if len(expected) != len(found):
+            report[name] = f"{len(found)} values instead of {len(expected)}"
+            continue
+        for i, (value, reference_value) in enumerate(zip(found, expected)):
+            if value != reference_value:
+                report[name] = f"index {i}: {value!r} instead of {reference_value!r}"
+                break
+    report["onsets"] = None
+    native_onsets = native.onset_table.to_dict()
+    reference_onsets = reference.onset_table.to_dict()
+    if native_onsets != reference_onsets:
+        missing = len(set(reference_onsets) - set(native_onsets))
+        extra = len(set(native_onsets) - set(reference_onsets))
+        report["onsets"] = f"{missing} onsets missing, {extra} extra onsets, or different pitches/durations"
+    report["tempo"] = None if native.tempo == reference.tempo else f"{native.tempo} instead of {reference.tempo}"
+    report["number_of_measures"] = None
+    if native.number_of_measures != reference.number_of_measures:
+        report["number_of_measures"] = f"{native.number_of_measures} instead of {reference.number_of_measures}"
+    return report
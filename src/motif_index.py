@@ -0,0 +1,325 @@
+"""
+This module contains a persistent index of the patterns of the intervals,
+roots and durations of the scores, to find the occurrences of a pattern in
+every piece of the dataset (task C3 only compares a piece with itself).
+
+The index is a SQLite database with one row per onset of each piece (its
+position) and one row per onset and key with the n-gram of the values that
+start at the onset, shorter at the end of the piece. An n-gram is stored as
+text, every value followed by a comma: the n-grams starting with a pattern
+shorter than n are a range of the index on (key, n-gram), a longer pattern
+is found by intersecting the occurrences of the n-grams covering it.
+
+Pieces are added one at a time, each in its own transaction. A piece whose
+file did not change (same SHA-256) is skipped and a modified one is replaced,
+so updating the index with the files of the dataset only parses the new and
+modified pieces.
+
+    index = MotifIndex("motifs.sqlite")
+    for midi_file, result in index.update(list_midi_files("asap-dataset"), "asap-dataset", workers=8):
+        ...
+    index.find((2, 2, -4), "interval", composers=["Bach"])
+"""
+
+import os
+import sqlite3
+from fractions import Fraction
+
+from src.feature_cache import EXTRACTOR_VERSION, get_file_hash
+from src.midi_features import get_default_backend, load_midi_features
+from src.parallel import run_in_parallel
+
+INDEX_VERSION = 2
+DEFAULT_NGRAM_LENGTH = 4
+KEYS = ("interval", "root", "duration")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS pieces (id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE, composer TEXT,
+                                   file_hash TEXT NOT NULL, nb_onsets INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS onsets (piece INTEGER NOT NULL, position INTEGER NOT NULL, measure INTEGER,
+                                   offset REAL NOT NULL, PRIMARY KEY (piece, position)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ngrams (key TEXT NOT NULL, gram TEXT NOT NULL, piece INTEGER NOT NULL,
+                                   position INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS ngrams_gram ON ngrams (key, gram, piece, position);
+CREATE INDEX IF NOT EXISTS ngrams_piece ON ngrams (piece);
+"""
+
+
+def encode_value(value) -> str:
+    """
+    Encode a value of an onset column as text, equal numbers give the same text
+    :param value: int, float, Fraction or None (no interval)
+    :return: str without comma
+    """
+    return "N" if value is None else str(Fraction(value))
+
+
+def decode_value(text: str) -> int or Fraction or None:
+    """
+    Decode a value encoded by encode_value (or typed in the command line: "2", "-4", "0.5", "1/3", "N")
+    :param text: str
+    :return: int, Fraction or None
+    """
+    if text == "N":
+        return None
+    value = Fraction(text)
+    return value.numerator if value.denominator == 1 else value
+
+
+def encode_pattern(values) -> str:
+    """
+    Encode a pattern as the text of the n-grams, every value followed by a comma
+    :param values: sequence of values
+    :return: str
+    """
+    return "".join(encode_value(value) + "," for value in values)
+
+
+def decode_pattern(gram: str) -> tuple:
+    """
+    Decode a pattern encoded by encode_pattern
+    :param gram: str
+    :return: tuple of values
+    """
+    return tuple(decode_value(text) for text in gram.split(",")[:-1])
+
+
+def get_ngrams(values: list, ngram_length: int) -> list:
+    """
+    Get the n-gram starting at each value, the last ones are shorter
+    :param values: list of values
+    :param ngram_length: number of values of an n-gram
+    :return: list of str, one per value
+    """
+    texts = [encode_value(value) + "," for value in values]
+    return ["".join(texts[start:start + ngram_length]) for start in range(len(texts))]
+
+
+def get_piece_ngrams(item: tuple) -> dict or None:
+    """
+    Extract the n-grams of a piece, run by the workers of MotifIndex.update
+    :param item: (path to the MIDI file, hash of the file in the index or None, n-gram length)
+    :return: None if the file did not change, else dict with the file hash, the positions (measure, offset)
+             and the n-grams of each key
+    """
+    midi_file, indexed_hash, ngram_length = item
+    file_hash = get_file_hash(midi_file)
+    if file_hash == indexed_hash:
+        return None
+    data = load_midi_features(midi_file).onset_table
+    measures = data.column("measure")
+    return {
+        "file_hash": file_hash,
+        "positions": list(zip(measures, data.offsets.tolist())),
+        "ngrams": {key: get_ngrams(data.column(key), ngram_length) for key in KEYS},
+    }
+
+
+def get_piece_files(item: tuple) -> list:
+    """
+    Get the files read for an item of get_piece_ngrams, to read them ahead (see prefetch)
+    :param item: item of get_piece_ngrams
+    :return: list of paths
+    """
+    return [item[0]]
+
+
+class MotifIndex:
+    """
+    Index of the n-grams of the pieces, stored in a SQLite database.
+
+    :ivar path: path to the database
+    :ivar ngram_length: number of values of the indexed n-grams
+    """
+
+    def __init__(self, path: str, ngram_length: int = None):
+        """
+        Open an index, created if it does not exist
+        :param path: path to the database
+        :param ngram_length: number of values of the n-grams, the one of the index (or DEFAULT_NGRAM_LENGTH) if None
+        """
+        if ngram_length is not None and ngram_length < 1:
+            raise ValueError("The n-gram length must be at least 1")
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        metadata = {"version": str(INDEX_VERSION), "extractor_version": str(EXTRACTOR_VERSION),
+                    "midi_backend": get_default_backend()}
+        if ngram_length is not None:
+            metadata["ngram_length"] = str(ngram_length)
+        with self.connection:
+            self.connection.executescript(_SCHEMA)
+            stored = dict(self.connection.execute("SELECT name, value FROM metadata"))
+            if not stored:
+                stored = {**metadata, "ngram_length": str(ngram_length or DEFAULT_NGRAM_LENGTH)}
+                self.connection.executemany("INSERT INTO metadata VALUES (?, ?)", stored.items())
+        for name, value in metadata.items():
+            if stored.get(name) != value:
+                self.connection.close()
+                raise ValueError(f"The index {path} was built with {name} {stored.get(name)} instead of {value}, "
+                                 f"remove it to build it again")
+        self.ngram_length = int(stored["ngram_length"])
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self) -> "MotifIndex":
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM pieces").fetchone()[0]
+
+    def get_hashes(self) -> dict:
+        """
+        :return: dict path -> hash of the file of every indexed piece
+        """
+        return dict(self.connection.execute("SELECT path, file_hash FROM pieces"))
+
+    def add(self, midi_file: str, piece: dict, composer: str = None):
+        """
+        Add or replace a piece
+        :param midi_file: path to the MIDI file, the name of the piece in the index
+        :param piece: output of get_piece_ngrams
+        :param composer: composer of the piece, to restrict the searches
+        """
+        positions = piece["positions"]
+        with self.connection:
+            self._remove(midi_file)
+            piece_id = self.connection.execute(
+                "INSERT INTO pieces (path, composer, file_hash, nb_onsets) VALUES (?, ?, ?, ?)",
+                (midi_file, composer, piece["file_hash"], len(positions))).lastrowid
+            self.connection.executemany("INSERT INTO onsets VALUES (?, ?, ?, ?)",
+                                        ((piece_id, position, measure, offset)
+                                         for position, (measure, offset) in enumerate(positions)))
+            for key, grams in piece["ngrams"].items():
+                self.connection.executemany("INSERT INTO ngrams VALUES (?, ?, ?, ?)",
+                                            ((key, gram, piece_id, position) for position, gram in enumerate(grams)))
+
+    def remove(self, midi_file: str):
+        """
+        Remove a piece from the index
+        :param midi_file: path to the MIDI file
+        """
+        with self.connection:
+            self._remove(midi_file)
+
+    def _remove(self, midi_file: str):
+        row = self.connection.execute("SELECT id FROM pieces WHERE path = ?", (midi_file,)).fetchone()
+        if row is None:
+            return
+        for table in ("ngrams", "onsets"):
+            self.connection.execute(f"DELETE FROM {table} WHERE piece = ?", row)
+        self.connection.execute("DELETE FROM pieces WHERE id = ?", row)
+
+    def update(self, midi_files: list, root: str = None, workers: int = 1, chunk_size: int = 1,
+               timeout: float = None):
+        """
+        Add the new and modified pieces, the n-grams are extracted in parallel and written by this process
+        :param midi_files: paths to the MIDI files (list_midi_files)
+        :param root: path to the dataset, the composer of a piece is its first folder below the root
+        :param workers: number of processes, None for one per CPU
+        :param chunk_size: number of pieces sent to a process at once
+        :param timeout: timeout in seconds for each piece, None for no timeout
+        :return: generator of (MIDI file, result) as soon as each piece is written, the result is
+                 {"status": "added", "updated" or "unchanged", "nb_onsets": ...} or a dict {"error": type, "message"}
+        """
+        hashes = self.get_hashes()
+        items = [(midi_file, hashes.get(midi_file), self.ngram_length) for midi_file in midi_files]
+        for (midi_file, indexed_hash, _), piece, error in run_in_parallel(get_piece_ngrams, items, workers,
+                                                                          chunk_size, timeout, get_piece_files):
+            if error is not None:
+                yield midi_file, error
+                continue
+            if piece is None:
+                yield midi_file, {"status": "unchanged", "nb_onsets": self.get_number_of_onsets(midi_file)}
+                continue
+            composer = None if root is None else os.path.relpath(midi_file, os.path.normpath(root)).split(os.sep)[0]
+            self.add(midi_file, piece, composer)
+            yield midi_file, {"status": "added" if indexed_hash is None else "updated",
+                              "nb_onsets": len(piece["positions"])}
+
+    def get_number_of_onsets(self, midi_file: str) -> int or None:
+        """
+        :param midi_file: path to the MIDI file
+        :return: number of onsets of an indexed piece, None if the piece is not in the index
+        """
+        row = self.connection.execute("SELECT nb_onsets FROM pieces WHERE path = ?", (midi_file,)).fetchone()
+        return None if row is None else row[0]
+
+    def _gram_condition(self, alias: str, gram: str, length: int) -> tuple:
+        # One n-gram (equality) or the n-grams starting with a shorter pattern (range)
+        if length == self.ngram_length:
+            return f"{alias}.gram = ?", [gram]
+        # "," + 1 == "-": the range holds the texts starting with gram
+        return f"{alias}.gram >= ? AND {alias}.gram < ?", [gram, gram[:-1] + "-"]
+
+    def find(self, pattern, key: str = "interval", composers: list = None) -> list:
+        """
+        Find every occurrence of a pattern in the indexed pieces, with a single query
+        :param pattern: sequence of values of the key (None for no interval)
+        :param key: "interval", "root" or "duration"
+        :param composers: composers to search, every piece if empty
+        :return: list of (MIDI file, (measure, offset)) sorted by piece and position, the offsets are floats
+        """
+        if key not in KEYS:
+            raise ValueError(f"Unknown key {key!r}, expected one of {KEYS}")
+        values = list(pattern)
+        if not values:
+            raise ValueError("The pattern is empty")
+        length = self.ngram_length
+        if len(values) <= length:
+            grams = [(0, values)]
+        else:
+            # n-grams every n values and one at the end, they cover the pattern
+            shifts = list(range(0, len(values) - length + 1, length))
+            if shifts[-1] != len(values) - length:
+                shifts.append(len(values) - length)
+            grams = [(shift, values[shift:shift + length]) for shift in shifts]
+
+        # The n-grams after the first one are joined at their shift from the start of the occurrence
+        joins = [f"JOIN ngrams AS g{index} ON g{index}.piece = g0.piece AND g{index}.position = g0.position + {shift}"
+                 for index, (shift, _) in enumerate(grams) if index > 0]
+        conditions = []
+        parameters = []
+        for index, (_, gram_values) in enumerate(grams):
+            condition, gram_parameters = self._gram_condition(f"g{index}", encode_pattern(gram_values),
+                                                              len(gram_values))
+            conditions += [f"g{index}.key = ?", condition]
+            parameters += [key] + gram_parameters
+        if composers:
+            conditions.append(f"pieces.composer IN ({', '.join('?' * len(composers))})")
+            parameters += list(composers)
+        query = "SELECT pieces.path, onsets.measure, onsets.offset FROM ngrams AS g0 " + " ".join(joins) + \
+                " JOIN onsets ON onsets.piece = g0.piece AND onsets.position = g0.position" \
+                " JOIN pieces ON pieces.id = g0.piece" \
+                " WHERE " + " AND ".join(conditions) + " ORDER BY pieces.path, onsets.position"
+        return [(path, (measure, offset)) for path, measure, offset in self.connection.execute(query, parameters)]
+
+    def shared_patterns(self, key: str = "interval", composers: list = None, min_pieces: int = 2,
+                        limit: int = 100) -> list:
+        """
+        Get the n-grams found in the most pieces
+        :param key: "interval", "root" or "duration"
+        :param composers: composers to search, every piece if empty
+        :param min_pieces: minimal number of pieces of an n-gram
+        :param limit: maximal number of n-grams returned
+        :return: list of (pattern, number of pieces, number of occurrences) sorted by decreasing number of pieces
+        """
+        if key not in KEYS:
+            raise ValueError(f"Unknown key {key!r}, expected one of {KEYS}")
+        query = "SELECT ngrams.gram, COUNT(DISTINCT ngrams.piece) AS nb_pieces, COUNT(*) AS nb_occurrences " \
+                "FROM ngrams JOIN pieces ON pieces.id = ngrams.piece " \
+                "WHERE ngrams.key = ? AND ngrams.position <= pieces.nb_onsets - ?"
+        parameters = [key, self.ngram_length]
+        if composers:
+            query += f" AND pieces.composer IN ({', '.join('?' * len(composers))})"
+            parameters += list(composers)
+        query += " GROUP BY ngrams.gram HAVING nb_pieces >= ? ORDER BY nb_pieces DESC, nb_occurrences DESC, " \
+                 "ngrams.gram LIMIT ?"
+        parameters += [min_pieces, limit]
+        return [(decode_pattern(gram), nb_pieces, nb_occurrences)
+                for gram, nb_pieces, nb_occurrences in self.connection.execute(query, parameters)]
@@ -0,0 +1,150 @@
+"""
+This module contains incremental versions of the phrase detection of task C1,
+fed one beat or one note at a time, for performances annotated live (by a
+beat tracker for instance).
+
+OnlinePhraseDetector applies the rule of get_phrase_boundaries_from_tempo: a
+downbeat is a boundary when the mean tempo change of the measure after it is
+positive and of the opposite sign to the one of the measure before it, the
+first and last downbeats are boundaries. The decision on a downbeat is made as
+soon as the measure after it closes, that is when the next downbeat arrives.
+The last downbeat is only known at the end of the stream (finish). The
+boundaries are the same as get_phrase_boundaries_from_tempo on the whole
+stream.
+
+OnlineVelocitySpikeDetector applies get_scaled_differences_in_volumes,
+get_times_threshold and filter_closest. The differences are scaled by a fixed
+maximum when one is given, then the split points are the same as the batch
+functions with that maximum. Otherwise they are scaled by the maximum seen so
+far, which cannot be known in advance.
+
+Both do a constant amount of work and keep a constant amount of memory per
+beat or note.
+"""
+
+import math
+
+
+class OnlinePhraseDetector:
+    """
+    Phrase boundaries from a stream of beats.
+
+    :ivar boundaries: list of (beat index, performed onset) of the boundaries decided so far
+    """
+
+    def __init__(self):
+        self.boundaries = []
+        self._nb_beats = 0
+        self._previous_beat = None
+        self._previous_ratio = None
+        # Current measure: first beat, performed onset of its downbeat, sum of the tempo changes
+        self._measure_start = None
+        self._measure_onset = None
+        self._measure_sum = 0.0
+        self._previous_slope = None
+        self._first_downbeat_pending = False
+        self._finished = False
+
+    def add_beat(self, symbolic_onset: float, performed_onset: float, beat_type: str) -> list:
+        """
+        Add the next beat
+        :param symbolic_onset: onset of the beat in the score
+        :param performed_onset: onset of the beat in the performance (NaN for a missed beat)
+        :param beat_type: "db" for a downbeat, "b" or anything else for a beat
+        :return: list of (beat index, performed onset) of the boundaries decided with this beat
+        """
+        if self._finished:
+            raise ValueError("The stream is finished")
+        decided = []
+        index = self._nb_beats
+        self._nb_beats += 1
+        if self._previous_beat is not None:
+            previous_symbolic, previous_performed = self._previous_beat
+            # Tempo ratio of the previous beat, as in get_tempo_ratios
+            ratio = _divide(float(symbolic_onset) - previous_symbolic, float(performed_onset) - previous_performed)
+            if self._measure_start is not None and index - 1 > self._measure_start:
+                self._measure_sum += ratio - self._previous_ratio
+            self._previous_ratio = ratio
+            if self._first_downbeat_pending:
+                # The first downbeat has a tempo ratio, it is a boundary
+                self._first_downbeat_pending = False
+                decided.append((self._measure_start, self._measure_onset))
+        if beat_type == "db":
+            if self._measure_start is not None:
+                slope = self._measure_sum / (index - self._measure_start)
+                # The measure closed: decide on its downbeat if it is not the first one
+                if self._previous_slope is not None and self._previous_slope * slope < 0 and slope > 0:
+                    decided.append((self._measure_start, self._measure_onset))
+                self._previous_slope = slope
+            else:
+                self._first_downbeat_pending = True
+            self._measure_start = index
+            self._measure_onset = float(performed_onset)
+            self._measure_sum = 0.0
+        self._previous_beat = (float(symbolic_onset), float(performed_onset))
+        self.boundaries.extend(decided)
+        return decided
+
+    def finish(self) -> list:
+        """
+        End the stream: the last downbeat is a boundary if a beat follows it
+        :return: list of (beat index, performed onset) of the boundaries decided at the end
+        """
+        decided = []
+        # A single downbeat was decided as the first one
+        if not self._finished and self._previous_slope is not None and self._measure_start < self._nb_beats - 1:
+            decided.append((self._measure_start, self._measure_onset))
+        self._finished = True
+        self.boundaries.extend(decided)
+        return decided
+
+
+class OnlineVelocitySpikeDetector:
+    """
+    Velocity split points from a stream of notes.
+
+    :ivar threshold: threshold on the scaled squared velocity differences
+    :ivar min_distance: a spike is kept if it is more than min_distance after the last kept one
+    :ivar max_difference: fixed scale of the squared differences, None to use the maximum seen so far
+    :ivar split_points: list of the times of the spikes kept so far
+    """
+
+    def __init__(self, threshold: float = 0.15, min_distance: float = 2, max_difference: float = None):
+        self.threshold = threshold
+        self.min_distance = min_distance
+        self.max_difference = max_difference
+        self.split_points = []
+        self._previous = None
+        self._running_max = 0
+
+    def add_note(self, time: float, velocity: int) -> float or None:
+        """
+        Add the next note or chord
+        :param time: offset or time of the note (the unit of min_distance)
+        :param velocity: velocity of the note
+        :return: the time of the previous note if the velocity change to this note is a kept spike, None otherwise
+        """
+        previous = self._previous
+        self._previous = (time, velocity)
+        if previous is None:
+            return None
+        previous_time, previous_velocity = previous
+        difference = abs(previous_velocity - velocity) ** 2
+        self._running_max = max(self._running_max, difference)
+        scale = self.max_difference if self.max_difference is not None else self._running_max
+        if scale == 0 or not difference / scale > self.threshold:
+            return None
+        if self.split_points and not previous_time - self.split_points[-1] > self.min_distance:
+            return None
+        self.split_points.append(previous_time)
+        return previous_time
+
+
+def _divide(numerator: float, denominator: float) -> float:
+    # Like numpy: a division by zero gives inf or NaN instead of raising
+    try:
+        return numerator / denominator
+    except ZeroDivisionError:
+        if numerator == 0 or math.isnan(numerator):
+            return math.nan
+        return math.copysign(math.inf, numerator) * math.copysign(1.0, denominator)
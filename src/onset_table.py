@@ -0,0 +1,205 @@
+"""
+This module contains the onset table of task C3: one row per onset (measure
+number, offset in the measure) of a score, sorted by position.
+
+The columns are parallel numpy arrays (measure, offset, duration, root,
+interval) and the pitch sets of the chords are stored CSR style, as one flat
+array of pitches with the start of each set. A range of measures is a slice of
+every column, it shares the memory of the table.
+
+The table is built from the note events of the parsed MIDI file (one per
+pitch of a note or chord) and kept in MidiFeatures, no dict of the onsets is
+made. The intervals are computed in the order in which the onsets were found
+in the parts of the score (the root of an onset minus the root of the onset
+found before it, none for the first onset and for the start of measure 1),
+before the rows are sorted, as extract_intervals_and_durations has always
+done.
+"""
+
+from fractions import Fraction
+
+import numpy as np
+
+# MIDI pitches and their differences fit in 16 bits, the interval column uses its minimum where there is none
+PITCH_DTYPE = np.int16
+NO_INTERVAL = np.iinfo(PITCH_DTYPE).min
+COLUMNS = ("measure", "offset", "duration", "root", "interval")
+
+
+def to_quarter_length(value: float) -> float or Fraction:
+    """
+    Restore a quarter length stored as a float the way music21 represents it (music21.common.opFrac):
+    a float when it is a multiple of a power of two, a Fraction otherwise (triplets...)
+    :param value: quarter length as a float
+    :return: float or Fraction
+    """
+    fraction = Fraction(value).limit_denominator(65535)
+    if fraction.denominator & (fraction.denominator - 1) == 0:
+        # Rounding errors of a float computation are removed (0.9999999999999991 is 1.0)
+        return float(fraction)
+    return fraction
+
+
+class OnsetTable:
+    """
+    Onsets of a score sorted by (measure, offset).
+
+    :ivar measures: int32 array of the measure numbers (-1 for no measure)
+    :ivar offsets: float64 array of the offsets in the measures, in quarter lengths
+    :ivar durations: float64 array of the durations of the first note of each onset, in quarter lengths
+    :ivar roots: int16 array of the lowest MIDI pitch of each onset
+    :ivar intervals: int16 array of the intervals between roots, NO_INTERVAL where there is none
+    :ivar pitches: int16 array of the sorted pitches of every onset, one after another
+    :ivar pitch_starts: int32 array, the pitches of onset i are pitches[pitch_starts[i]:pitch_starts[i + 1]]
+    """
+
+    def __init__(self, measures: np.ndarray, offsets: np.ndarray, durations: np.ndarray, roots: np.ndarray,
+                 intervals: np.ndarray, pitches: np.ndarray, pitch_starts: np.ndarray):
+        self.measures = measures
+        self.offsets = offsets
+        self.durations = durations
+        self.roots = roots
+        self.intervals = intervals
+        self.pitches = pitches
+        self.pitch_starts = pitch_starts
+
+    def __len__(self) -> int:
+        return len(self.measures)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory used by the columns in bytes (the pitches of a slice are shared with its table)
+        :return: int
+        """
+        return sum(array.nbytes for array in (self.measures, self.offsets, self.durations, self.roots,
+                                               self.intervals, self.pitches, self.pitch_starts))
+
+    @classmethod
+    def from_arrays(cls, measures: np.ndarray, offsets: np.ndarray, durations: np.ndarray, pitches: np.ndarray,
+                    pitch_starts: np.ndarray) -> "OnsetTable":
+        """
+        Build the table from the onsets in the order they were found in the score
+        :param measures: measure number of each onset
+        :param offsets: offset in the measure of each onset
+        :param durations: duration of each onset
+        :param pitches: pitches of every onset, one after another
+        :param pitch_starts: start of the pitches of each onset followed by the number of pitches
+        :return: OnsetTable
+        """
+        measures = np.asarray(measures, dtype=np.int32)
+        offsets = np.asarray(offsets, dtype=np.float64)
+        pitches = np.asarray(pitches, dtype=PITCH_DTYPE)
+        pitch_starts = np.asarray(pitch_starts, dtype=np.int64)
+        sizes = np.diff(pitch_starts)
+        if len(measures) and sizes.min() == 0:
+            raise ValueError("An onset has no pitch")
+        roots = np.minimum.reduceat(pitches, pitch_starts[:-1]) if len(measures) else np.zeros(0, dtype=PITCH_DTYPE)
+        intervals = np.diff(roots, prepend=roots[:1])
+        no_interval = (measures == 1) & (offsets == 0)
+        no_interval[:1] = True
+        intervals[no_interval] = NO_INTERVAL
+
+        order = np.lexsort((offsets, measures))
+        sorted_sizes = sizes[order]
+        sorted_starts = np.concatenate(([0], np.cumsum(sorted_sizes))).astype(np.int64)
+        # Index in pitches of each pitch of the sorted table
+        gather = np.repeat(pitch_starts[:-1][order] - sorted_starts[:-1], sorted_sizes) + \
+            np.arange(sorted_starts[-1], dtype=np.int64)
+        return cls(measures[order], offsets[order], np.asarray(durations, dtype=np.float64)[order], roots[order],
+                   intervals[order], pitches[gather], sorted_starts.astype(np.int32))
+
+    @classmethod
+    def from_events(cls, measures: list, offsets: list, durations: list, pitches: list) -> "OnsetTable":
+        """
+        Build the table from the note events of a score, one per pitch of each note or chord in the order they
+        were found in the parts. The events at the same position are one onset, with the duration of the first one.
+        :param measures: measure number of each event (None for no measure)
+        :param offsets: offset in the measure of each event
+        :param durations: duration of the note or chord of each event
+        :param pitches: MIDI pitch of each event
+        :return: OnsetTable
+        """
+        size = len(pitches)
+        positions = np.empty(size, dtype=[("measure", np.int32), ("offset", np.float64)])
+        positions["measure"] = np.fromiter((-1 if measure is None else measure for measure in measures),
+                                           dtype=np.int32, count=size)
+        positions["offset"] = np.fromiter(offsets, dtype=np.float64, count=size)
+        pitches = np.fromiter(pitches, dtype=PITCH_DTYPE, count=size)
+        _, first_events, event_onsets = np.unique(positions, return_index=True, return_inverse=True)
+        # Number the onsets in the order of their first event
+        order = np.argsort(first_events, kind="stable")
+        ranks = np.empty_like(order)
+        ranks[order] = np.arange(len(order))
+        event_onsets = ranks[event_onsets.reshape(-1)]
+        first_events = first_events[order]
+
+        # Pitches grouped by onset, each pitch once
+        by_onset = np.lexsort((pitches, event_onsets))
+        event_onsets, pitches = event_onsets[by_onset], pitches[by_onset]
+        unique = np.ones(size, dtype=bool)
+        unique[1:] = (event_onsets[1:] != event_onsets[:-1]) | (pitches[1:] != pitches[:-1])
+        event_onsets, pitches = event_onsets[unique], pitches[unique]
+        pitch_starts = np.searchsorted(event_onsets, np.arange(len(first_events) + 1)).astype(np.int64)
+        return cls.from_arrays(positions["measure"][first_events], positions["offset"][first_events],
+                               np.fromiter(durations, dtype=np.float64, count=size)[first_events], pitches,
+                               pitch_starts)
+
+    def measure_range(self, first: int, last: int) -> "OnsetTable":
+        """
+        Get the onsets of the measures first to last (included), sharing the memory of this table
+        :param first: first measure number
+        :param last: last measure number
+        :return: OnsetTable
+        """
+        start, stop = np.searchsorted(self.measures, [first, last + 1]).tolist()
+        # The pitch starts keep indexing the whole pitches array
+        return OnsetTable(self.measures[start:stop], self.offsets[start:stop], self.durations[start:stop],
+                          self.roots[start:stop], self.intervals[start:stop], self.pitches,
+                          self.pitch_starts[start:stop + 1])
+
+    def pitch_set(self, index: int) -> np.ndarray:
+        """
+        Get the pitches of an onset
+        :param index: row of the onset
+        :return: sorted int16 array (a view of the pitches)
+        """
+        return self.pitches[self.pitch_starts[index]:self.pitch_starts[index + 1]]
+
+    def positions(self) -> list:
+        """
+        Get the positions of the onsets
+        :return: list of (measure number, offset in the measure) with the offsets as music21 quarter lengths
+        """
+        return list(zip(self.column("measure"), self.column("offset")))
+
+    def column(self, name: str) -> list:
+        """
+        Get a column as a list of Python values, the values of the onset dicts built before the onset table
+        :param name: "measure", "offset", "duration", "root" or "interval"
+        :return: list (None for the missing measures and intervals, quarter lengths as floats or Fractions)
+        """
+        if name == "measure":
+            return [None if value == -1 else value for value in self.measures.tolist()]
+        if name in ("offset", "duration"):
+            values = self.offsets if name == "offset" else self.durations
+            # Few distinct quarter lengths in a score, each is converted once
+            unique_values, inverse = np.unique(values, return_inverse=True)
+            quarter_lengths = [to_quarter_length(value) for value in unique_values.tolist()]
+            return [quarter_lengths[index] for index in inverse.tolist()]
+        if name == "root":
+            return self.roots.tolist()
+        if name == "interval":
+            return [None if value == NO_INTERVAL else value for value in self.intervals.tolist()]
+        raise ValueError(f"Unknown column {name!r}, expected one of {COLUMNS}")
+
+    def to_dict(self) -> dict:
+        """
+        Convert to the dict (measure, offset) -> {'pitch', 'root', 'interval', 'duration'} built by
+        extract_intervals_and_durations before the onset table
+        :return: dict sorted by position
+        """
+        columns = zip(self.column("root"), self.column("interval"), self.column("duration"))
+        return {position: {'pitch': set(self.pitch_set(index).tolist()), 'root': root, 'interval': interval,
+                           'duration': duration}
+                for index, (position, (root, interval, duration)) in enumerate(zip(self.positions(), columns))}
@@ -0,0 +1,207 @@
+"""
+This module contains a process pool runner for the whole dataset runs.
+
+The pieces are sent to the workers in chunks, every piece runs under its own
+timeout and the results come back in the order of the input, whatever the
+order in which the workers finish. A piece that fails or times out does not
+stop the run: its error is returned as a dict with the type and the message
+of the exception.
+
+The files of the pieces are read ahead in the parent while the workers run,
+and sent with the chunks, so the prefetch does not depend on the chunk size.
+"""
+
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from src.prefetch import DEFAULT_DEPTH, prefetch_items, provide_files, read_ahead
+
+
+class PieceTimeout(Exception):
+    """
+    Raised in a worker when a piece runs longer than its timeout
+    """
+
+
+def get_error(exception: BaseException) -> dict:
+    """
+    Describe an exception as a structured error
+    :param exception: the exception raised by a piece
+    :return: dict with the type and the message of the exception
+    """
+    return {"error": type(exception).__name__, "message": str(exception)}
+
+
+def _raise_timeout(signum, frame):
+    raise PieceTimeout("piece timed out")
+
+
+def call_with_timeout(function, item, timeout: float = None):
+    """
+    Call function(item), raising PieceTimeout after timeout seconds.
+    The timeout uses SIGALRM, it is ignored where this signal is not available
+    (Windows) or outside the main thread.
+    :param function: function to call
+    :param item: argument of the function
+    :param timeout: timeout in seconds, None for no timeout
+    :return: the result of the function
+    """
+    if not timeout or not hasattr(signal, "setitimer") or threading.current_thread() is not threading.main_thread():
+        return function(item)
+    previous_handler = signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return function(item)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+def _run_items(function, items: list, timeout: float = None, get_files=None, prefetch_depth: int = DEFAULT_DEPTH,
+               files: list = None):
+    if get_files is not None:
+        items = prefetch_items(items, get_files, prefetch_depth)
+    for index, item in enumerate(items):
+        try:
+            with provide_files(files[index] if files else {}):
+                result = call_with_timeout(function, item, timeout)
+        except Exception as e:
+            yield None, get_error(e)
+        else:
+            yield result, None
+
+
+def run_chunk(function, items: list, timeout: float = None, get_files=None,
+              prefetch_depth: int = DEFAULT_DEPTH, files: list = None) -> list:
+    """
+    Run function on each item of a chunk
+    :param function: function to call on each item
+    :param items: list of items
+    :param timeout: timeout in seconds for each item
+    :param get_files: picklable function giving the files read by an item, they are read ahead
+                      (see prefetch.prefetch_items), None to read them when the item runs
+    :param prefetch_depth: number of items whose files are read ahead
+    :param files: for each item, dict path -> bytes of its files already read by the parent
+                  (see prefetch.read_ahead), None if the parent did not read them
+    :return: list of (result, error) where error is None on success
+    """
+    return list(_run_items(function, items, timeout, get_files, prefetch_depth, files))
+
+
+def _iter_chunks(items: list, chunk_size: int, get_files=None, prefetch_depth: int = DEFAULT_DEPTH):
+    # (chunk, files of each item of the chunk or None), the files are read ahead of the dispatch
+    if get_files is None:
+        for i in range(0, len(items), chunk_size):
+            yield items[i:i + chunk_size], None
+        return
+    chunk, files = [], []
+    for item, item_files in read_ahead(items, get_files, prefetch_depth):
+        chunk.append(item)
+        files.append(item_files)
+        if len(chunk) == chunk_size:
+            yield chunk, files
+            chunk, files = [], []
+    if chunk:
+        yield chunk, files
+
+
+def run_in_parallel(function, items: list, workers: int = None, chunk_size: int = 1, timeout: float = None,
+                    get_files=None, prefetch_depth: int = DEFAULT_DEPTH):
+    """
+    Run function on each item with a pool of processes
+    :param function: picklable (module level) function taking one item
+    :param items: list of items
+    :param workers: number of processes, os.cpu_count() if None, 1 runs everything in this process
+    :param chunk_size: number of items sent to a worker at once
+    :param timeout: timeout in seconds for each item, None for no timeout
+    :param get_files: picklable function giving the files read by an item, they are read ahead while the
+                      previous items run (by this process, which sends them to the workers with the chunks),
+                      None to disable the prefetch
+    :param prefetch_depth: number of items whose files are read ahead
+    :return: generator of (item, result, error) in the order of items, error is None on success
+    """
+    items = list(items)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for item, (result, error) in zip(items, _run_items(function, items, timeout, get_files, prefetch_depth)):
+            yield item, result, error
+        return
+    chunks = _iter_chunks(items, chunk_size, get_files, prefetch_depth)
+
+    # Keep a bounded number of chunks in flight so that results are yielded while the run goes on
+    max_pending = 2 * workers
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        # [chunk, files, future, attempts], the future is None for a chunk to run one item at a time
+        pending = []
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < max_pending:
+                next_chunk = next(chunks, None)
+                if next_chunk is None:
+                    exhausted = True
+                    break
+                chunk, files = next_chunk
+                pending.append((chunk, files, executor.submit(run_chunk, function, chunk, timeout, None,
+                                                              prefetch_depth, files), 0))
+            if not pending:
+                break
+            chunk, files, future, attempts = pending.pop(0)
+            if future is None:
+                chunk_results = _run_isolated(function, chunk, timeout, prefetch_depth, files)
+            else:
+                try:
+                    chunk_results = future.result()
+                except BrokenProcessPool:
+                    # A worker died (killed, out of memory...) and any chunk that did not finish may have
+                    # killed it: they are all sent again to a new pool. A chunk that was already sent again
+                    # broke the pool twice, its items are run one at a time so that only the item that
+                    # kills its process gets the error.
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    executor = ProcessPoolExecutor(max_workers=workers)
+                    unfinished = [(chunk, files, future, attempts)] + pending
+                    pending = []
+                    for other_chunk, other_files, other_future, other_attempts in unfinished:
+                        if other_future is None or _has_result(other_future):
+                            pending.append((other_chunk, other_files, other_future, other_attempts))
+                        elif other_attempts == 0:
+                            pending.append((other_chunk, other_files,
+                                            executor.submit(run_chunk, function, other_chunk, timeout, None,
+                                                            prefetch_depth, other_files), 1))
+                        else:
+                            pending.append((other_chunk, other_files, None, other_attempts))
+                    continue
+            for item, (result, error) in zip(chunk, chunk_results):
+                yield item, result, error
+    finally:
+        chunks.close()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _run_isolated(function, items: list, timeout: float = None, prefetch_depth: int = DEFAULT_DEPTH,
+                  files: list = None) -> list:
+    """
+    Run each item in its own process, one after another
+    :param function: function to call on each item
+    :param items: list of items
+    :param timeout: timeout in seconds for each item
+    :param prefetch_depth: number of items whose files are read ahead
+    :param files: bytes of the files of each item read by the parent (see run_chunk)
+    :return: list of (result, error), the error is BrokenProcessPool for an item that killed its process
+    """
+    results = []
+    for index, item in enumerate(items):
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            try:
+                results.extend(executor.submit(run_chunk, function, [item], timeout, None, prefetch_depth,
+                                               [files[index]] if files else None).result())
+            except BrokenProcessPool as e:
+                results.append((None, get_error(e)))
+    return results
+
+
+def _has_result(future) -> bool:
+    return future.done() and not future.cancelled() and future.exception() is None
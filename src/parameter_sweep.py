@@ -0,0 +1,146 @@
+"""
+This module evaluates the phrase detection of tasks C1 and C3 over a grid of
+thresholds, parsing each piece only once.
+
+For each piece, the features are extracted once: the tempo boundaries and the
+velocity differences for C1, the intervals, roots and durations for C3. Every
+configuration of the grid is then evaluated on these features. The
+intermediate results shared by several configurations (the velocity split
+points for C1, the pattern occurrences for C3) are computed once. The pieces
+run on a process pool like the whole dataset runners. The output is a table
+with one row per piece and configuration.
+"""
+
+import csv
+import itertools
+
+from src.dataset_manifest import load_manifest
+from src.parallel import get_error, run_in_parallel
+from src.task_c1 import count_fused_boundaries, get_c1_features, get_velocity_split_points
+from src.task_c3 import extract_intervals_and_durations, find_pattern_starts, list_midi_files, \
+    merge_pattern_boundaries
+
+C1_DEFAULTS = {"velocity_threshold": 0.15, "threshold_closest": 2, "threshold_similarity": 5}
+C3_DEFAULTS = {"min_duration": 6.0, "measure_spacing": 2}
+
+
+def get_grid(defaults: dict, **values) -> list:
+    """
+    Build every combination of the given parameter values, the other parameters keep their default value
+    :param defaults: dict parameter -> default value (C1_DEFAULTS or C3_DEFAULTS)
+    :param values: parameter -> list of values
+    :return: list of dicts parameter -> value
+    """
+    unknown = set(values) - set(defaults)
+    if unknown:
+        raise ValueError(f"Unknown parameters {sorted(unknown)}, expected some of {list(defaults)}")
+    names = list(defaults)
+    choices = [values.get(name, [defaults[name]]) for name in names]
+    return [dict(zip(names, combination)) for combination in itertools.product(*choices)]
+
+
+def sweep_c1_piece(item: tuple) -> list:
+    """
+    Count the phrases of one piece for every configuration of a C1 grid
+    :param item: (path to the piece folder, grid)
+    :return: list with the number of phrases of each configuration, or an error dict for a failed configuration
+    """
+    path, grid = item
+    c1_features = get_c1_features(path)
+    if c1_features is None:
+        return [0] * len(grid)
+    split_points = {}
+    counts = []
+    for configuration in grid:
+        try:
+            key = (configuration["velocity_threshold"], configuration["threshold_closest"])
+            if key not in split_points:
+                split_points[key] = get_velocity_split_points(c1_features, *key)
+            counts.append(count_fused_boundaries(split_points[key], c1_features["boundaries_times"],
+                                                 configuration["threshold_similarity"]))
+        except Exception as e:
+            counts.append(get_error(e))
+    return counts
+
+
+def sweep_c3_piece(item: tuple) -> list:
+    """
+    Count the boundaries of one MIDI file for every configuration of a C3 grid
+    :param item: (path to the MIDI file, grid)
+    :return: list with the number of boundaries of each configuration
+    """
+    midi_file, grid = item
+    data = extract_intervals_and_durations(midi_file)
+    pattern_starts = {}
+    counts = []
+    for configuration in grid:
+        min_duration = configuration["min_duration"]
+        if min_duration not in pattern_starts:
+            pattern_starts[min_duration] = find_pattern_starts(data, min_duration)
+        counts.append(len(merge_pattern_boundaries(pattern_starts[min_duration], configuration["measure_spacing"])))
+    return counts
+
+
+def _sweep(function, pieces: list, keys: list, grid: list, workers: int, chunk_size: int, timeout: float,
+           value_name: str) -> list:
+    rows = []
+    items = [(piece, grid) for piece in pieces]
+    for key, (_, result, error) in zip(keys, run_in_parallel(function, items, workers, chunk_size, timeout)):
+        for index, configuration in enumerate(grid):
+            value = error if error is not None else result[index]
+            row = {"piece": key, **configuration}
+            if isinstance(value, dict):
+                row[value_name] = None
+                row["error"] = f"{value['error']}: {value['message']}"
+            else:
+                row[value_name] = value
+                row["error"] = None
+            rows.append(row)
+    return rows
+
+
+def sweep_c1(folder_path: str = "asap-dataset/", grid: list = None, workers: int = 1, chunk_size: int = 1,
+             timeout: float = None) -> list:
+    """
+    Run task C1 on the whole dataset for every configuration of a grid
+    :param folder_path: path to the dataset
+    :param grid: list of configurations (see get_grid), only the defaults if None
+    :param workers: number of processes, None for one per CPU
+    :param chunk_size: number of pieces sent to a process at once
+    :param timeout: timeout in seconds for each piece (all its configurations)
+    :return: list of rows {"piece", parameters..., "nb_phrases", "error"}
+    """
+    grid = grid or get_grid(C1_DEFAULTS)
+    paths = load_manifest(folder_path).piece_folders(with_score_annotations=True)
+    keys = [path.replace("asap-dataset/", "") for path in paths]
+    return _sweep(sweep_c1_piece, paths, keys, grid, workers, chunk_size, timeout, "nb_phrases")
+
+
+def sweep_c3(base_path: str = '../asap-dataset/Bach', grid: list = None, workers: int = 1, chunk_size: int = 1,
+             timeout: float = None) -> list:
+    """
+    Run task C3 on the whole dataset for every configuration of a grid
+    :param base_path: path to the dataset
+    :param grid: list of configurations (see get_grid), only the defaults if None
+    :param workers: number of processes, None for one per CPU
+    :param chunk_size: number of pieces sent to a process at once
+    :param timeout: timeout in seconds for each piece (all its configurations)
+    :return: list of rows {"piece", parameters..., "nb_boundaries", "error"}
+    """
+    grid = grid or get_grid(C3_DEFAULTS)
+    midi_files = list_midi_files(base_path)
+    return _sweep(sweep_c3_piece, midi_files, midi_files, grid, workers, chunk_size, timeout, "nb_boundaries")
+
+
+def write_table(rows: list, path: str):
+    """
+    Write the rows of a sweep as CSV
+    :param rows: output of sweep_c1 or sweep_c3
+    :param path: path to the CSV file
+    """
+    if not rows:
+        return
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
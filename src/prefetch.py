@@ -0,0 +1,214 @@
+"""
+This module reads the files of the next pieces in background threads while
+the current piece is parsed.
+
+The loaders (annotation files, MIDI files, hashes of the feature cache) read
+their files with read_bytes, which returns the bytes already prefetched for a
+path or reads the file. prefetch_items wraps the loop over the pieces of a
+run: it keeps the files of the current piece and of the next ``depth`` pieces
+in memory, so the memory stays bounded whatever the size of the run. The
+bytes of a piece are dropped as soon as the piece is done.
+
+The prefetched bytes belong to the process. With a process pool, the parent
+reads the files of the next chunks while the workers run (read_ahead) and
+sends the bytes with each chunk, a worker makes them available to the loaders
+with provide_files.
+"""
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+from src import instrumentation
+
+# Number of pieces read ahead of the current one
+DEFAULT_DEPTH = 4
+# Number of files read at the same time
+DEFAULT_THREADS = 4
+
+# path -> [future of the bytes, number of users]
+_prefetched = {}
+_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # A worker forked while a prefetch thread of the parent held the lock would wait for it forever,
+    # and the reads of the parent do not run in the worker
+    global _lock, _prefetched
+    _lock = threading.Lock()
+    _prefetched = {}
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def get_prefetched(path: str) -> bytes or None:
+    """
+    Get the bytes of a file if they were prefetched, waiting for the read when it is still running
+    :param path: path to the file
+    :return: bytes or None if the file was not prefetched (or its read failed)
+    """
+    with _lock:
+        entry = _prefetched.get(path)
+    if entry is None:
+        return None
+    try:
+        data = entry[0].result()
+    except OSError:
+        # Read again by the caller, which gets the error
+        return None
+    instrumentation.count("prefetch_hits")
+    return data
+
+
+def read_bytes(path: str) -> bytes:
+    """
+    Get the content of a file, from the prefetched bytes when there are some
+    :param path: path to the file
+    :return: bytes
+    """
+    data = get_prefetched(path)
+    if data is None:
+        data = _read_file(path)
+    return data
+
+
+def read_text(path: str) -> str:
+    """
+    Get the content of a text file, from the prefetched bytes when there are some
+    :param path: path to the file
+    :return: str with the line endings converted to "\\n" like open(path, "r")
+    """
+    return read_bytes(path).decode().replace("\r\n", "\n").replace("\r", "\n")
+
+
+def _acquire(executor: ThreadPoolExecutor, paths: list):
+    with _lock:
+        for path in paths:
+            entry = _prefetched.get(path)
+            if entry is None:
+                _prefetched[path] = [executor.submit(_read_file, path), 1]
+            else:
+                entry[1] += 1
+
+
+def _release(paths: list):
+    with _lock:
+        for path in paths:
+            entry = _prefetched.get(path)
+            if entry is None:
+                continue
+            entry[1] -= 1
+            if entry[1] == 0:
+                entry[0].cancel()
+                del _prefetched[path]
+
+
+def prefetch_items(items, get_files, depth: int = DEFAULT_DEPTH, threads: int = DEFAULT_THREADS):
+    """
+    Iterate over items while the files of the next ones are read in background threads
+    :param items: iterable of items (pieces)
+    :param get_files: function giving the list of paths of the files an item reads,
+                      it should not fail (an item whose files are unknown is not prefetched)
+    :param depth: number of items whose files are read ahead of the current one
+    :param threads: number of files read at the same time
+    :return: generator of the items, the files of an item are dropped when the next item is asked for
+    """
+    executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="prefetch")
+    pending = deque()
+    iterator = iter(items)
+
+    def submit_next() -> bool:
+        for item in iterator:
+            paths = list(get_files(item))
+            _acquire(executor, paths)
+            pending.append((item, paths))
+            return True
+        return False
+
+    try:
+        for _ in range(depth + 1):
+            if not submit_next():
+                break
+        while pending:
+            item, paths = pending[0]
+            yield item
+            pending.popleft()
+            _release(paths)
+            submit_next()
+    finally:
+        for _, paths in pending:
+            _release(paths)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def read_ahead(items, get_files, depth: int = DEFAULT_DEPTH, threads: int = DEFAULT_THREADS):
+    """
+    prefetch_items giving the bytes of the files of each item, to send them to another process
+    :param items: iterable of items (pieces)
+    :param get_files: function giving the list of paths of the files an item reads
+    :param depth: number of items whose files are read ahead of the current one
+    :param threads: number of files read at the same time
+    :return: generator of (item, dict path -> bytes), a file whose read failed is left out
+    """
+    items_and_paths = ((item, list(get_files(item))) for item in items)
+    for item, paths in prefetch_items(items_and_paths, lambda item_and_paths: item_and_paths[1], depth, threads):
+        files = {}
+        for path in paths:
+            data = get_prefetched(path)
+            if data is not None:
+                files[path] = data
+        yield item, files
+
+
+@contextmanager
+def provide_files(files: dict):
+    """
+    Make bytes read by another process available to read_bytes and get_prefetched:
+    ``with provide_files(files): ...``, the bytes are dropped at the end of the block
+    :param files: dict path -> bytes (see read_ahead)
+    """
+    with _lock:
+        for path, data in files.items():
+            entry = _prefetched.get(path)
+            if entry is None:
+                future = Future()
+                future.set_result(data)
+                _prefetched[path] = [future, 1]
+            else:
+                entry[1] += 1
+    try:
+        yield
+    finally:
+        _release(list(files))
+
+
+@contextmanager
+def prefetch_files(paths: list, threads: int = DEFAULT_THREADS):
+    """
+    Read files at the same time, for a loader reading several files one after another:
+    ``with prefetch_files(paths): ...``, the bytes are dropped at the end of the block
+    :param paths: paths to the files
+    :param threads: number of files read at the same time
+    """
+    with _lock:
+        missing = [path for path in paths if path not in _prefetched]
+    if len(missing) < 2:
+        # Nothing to overlap
+        yield
+        return
+    executor = ThreadPoolExecutor(max_workers=min(threads, len(missing)), thread_name_prefix="prefetch")
+    _acquire(executor, missing)
+    try:
+        yield
+    finally:
+        _release(missing)
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,269 @@
+"""
+This module contains a suffix array based search for the repeating patterns
+used by task C3.
+
+The sequence is encoded as integers, sorted into a suffix array and the LCP
+intervals of the array give every repeated pattern together with all its
+positions. A pattern is kept when it has a repetition that does not overlap
+its first occurrence, when its first occurrence lasts at least
+``min_duration`` quarter lengths and when it is not contained in a longer
+kept pattern.
+
+Several sequences over the same positions (the intervals, roots and
+durations of a piece) are searched together in one suffix array, see
+find_repeated_patterns_multi.
+"""
+
+import math
+from fractions import Fraction
+from itertools import accumulate
+
+import numpy as np
+
+from src import instrumentation
+
+
+def encode_sequence(sequence) -> np.ndarray:
+    """
+    Replace each value of the sequence by an integer code, equal values get the same code
+    :param sequence: list of hashable values
+    :return: int array of codes
+    """
+    codes = {}
+    return np.array([codes.setdefault(value, len(codes)) for value in sequence], dtype=np.int64)
+
+
+def build_suffix_array(codes: np.ndarray) -> np.ndarray:
+    """
+    Build the suffix array of an integer sequence by prefix doubling
+    :param codes: int array
+    :return: int array with the start of the suffixes in lexicographic order
+    """
+    n = len(codes)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    rank = np.unique(codes, return_inverse=True)[1].astype(np.int64)
+    suffix_array = np.argsort(rank, kind="stable")
+    step = 1
+    while step < n:
+        second = np.full(n, -1, dtype=np.int64)
+        second[:n - step] = rank[step:]
+        suffix_array = np.lexsort((second, rank))
+        first_sorted = rank[suffix_array]
+        second_sorted = second[suffix_array]
+        changes = (first_sorted[1:] != first_sorted[:-1]) | (second_sorted[1:] != second_sorted[:-1])
+        new_rank = np.empty(n, dtype=np.int64)
+        new_rank[suffix_array] = np.concatenate(([0], np.cumsum(changes)))
+        rank = new_rank
+        if rank[suffix_array[-1]] == n - 1:
+            break
+        step *= 2
+    return suffix_array.astype(np.int64)
+
+
+def build_lcp_array(codes: np.ndarray, suffix_array: np.ndarray) -> np.ndarray:
+    """
+    Build the LCP array with Kasai's algorithm
+    :param codes: int array
+    :param suffix_array: suffix array of codes
+    :return: int array where lcp[k] is the longest common prefix of the suffixes k - 1 and k (lcp[0] = 0)
+    """
+    n = len(codes)
+    values = codes.tolist()
+    order = suffix_array.tolist()
+    rank = [0] * n
+    for k, start in enumerate(order):
+        rank[start] = k
+    lcp = [0] * n
+    h = 0
+    for start in range(n):
+        k = rank[start]
+        if k == 0:
+            h = 0
+            continue
+        previous = order[k - 1]
+        while start + h < n and previous + h < n and values[start + h] == values[previous + h]:
+            h += 1
+        lcp[k] = h
+        if h > 0:
+            h -= 1
+    return np.array(lcp, dtype=np.int64)
+
+
+class SparseTable:
+    """
+    Constant time range queries (min or max) over a static array
+    """
+
+    def __init__(self, values: np.ndarray, operation=np.maximum):
+        self.operation = operation
+        self._table = None
+        self.levels = [np.asarray(values)]
+        width = 1
+        while 2 * width <= len(values):
+            previous = self.levels[-1]
+            self.levels.append(operation(previous[:-width], previous[width:]))
+            width *= 2
+
+    def query(self, left: int, right: int):
+        """
+        Reduce the values between left and right (both included)
+        :param left: first index
+        :param right: last index
+        :return: the min or max of the range
+        """
+        level = (right - left + 1).bit_length() - 1
+        values = self.levels[level]
+        return self.operation(values[left], values[right - (1 << level) + 1])
+
+    def query_many(self, lefts: np.ndarray, rights: np.ndarray) -> np.ndarray:
+        """
+        query for many ranges at once
+        :param lefts: int array with the first index of each range
+        :param rights: int array with the last index of each range
+        :return: array with the min or max of each range
+        """
+        if self._table is None:
+            # One row per level, padded to the length of the values
+            self._table = np.stack([np.concatenate((level, self.levels[0][len(level):])) for level in self.levels])
+        # frexp gives the exponent e with 2 ** (e - 1) <= width < 2 ** e
+        levels = np.frexp((rights - lefts + 1).astype(np.float64))[1] - 1
+        return self.operation(self._table[levels, lefts], self._table[levels, rights - (1 << levels) + 1])
+
+
+def get_scaled_prefix_durations(durations: list) -> tuple:
+    """
+    Get the exact prefix sums of durations as integers: the durations are multiplied by
+    the least common multiple of their denominators (music21 mixes floats and Fractions)
+    :param durations: list of durations as floats or Fractions
+    :return: int array (object array if it does not fit in int64) of the prefix sums starting with 0, and the scale
+    """
+    fractions = [Fraction(duration) for duration in durations]
+    scale = math.lcm(*(fraction.denominator for fraction in fractions)) if fractions else 1
+    sums = list(accumulate((fraction.numerator * (scale // fraction.denominator) for fraction in fractions),
+                           initial=0))
+    if max(abs(value) for value in sums) < 2 ** 62:
+        return np.array(sums, dtype=np.int64), scale
+    return np.array(sums, dtype=object), scale
+
+
+def get_lcp_intervals(lcp: np.ndarray):
+    """
+    Enumerate the LCP intervals (the internal nodes of the suffix tree) bottom-up
+    :param lcp: LCP array
+    :return: generator of (depth, parent depth, left bound, right bound)
+    """
+    n = len(lcp)
+    values = lcp.tolist()
+    stack = [(0, 0)]
+    for k in range(1, n + 1):
+        h = values[k] if k < n else 0
+        left = k - 1
+        while h < stack[-1][0]:
+            depth, left = stack.pop()
+            yield depth, max(h, stack[-1][0]), left, k - 1
+        if h > stack[-1][0]:
+            stack.append((h, left))
+
+
+def find_repeated_patterns(sequence: list, positions: list, durations: list, min_duration: float = 6.0) -> list:
+    """
+    Find the maximal repeating patterns of a sequence
+    :param sequence: list of the values
+    :param positions: position (measure, offset) of each value
+    :param durations: duration of each value in quarter lengths
+    :param min_duration: minimal duration of the first occurrence of a pattern
+    :return: list of (pattern, positions) sorted by decreasing pattern length, the positions start with the first
+             occurrence followed by every occurrence that does not overlap it
+    """
+    return find_repeated_patterns_multi({None: sequence}, positions, durations, min_duration)[None]
+
+
+def find_repeated_patterns_multi(sequences: dict, positions: list, durations: list,
+                                 min_duration: float = 6.0) -> dict:
+    """
+    Find the maximal repeating patterns of several sequences sharing the same positions and durations
+    (the intervals, roots and durations of a piece) in one search.
+    The sequences are concatenated with disjoint alphabets and a distinct separator after each of them,
+    so that no pattern spans two sequences, and share one suffix array, LCP array and duration prefix sums.
+    :param sequences: dict name -> list of the values
+    :param positions: position (measure, offset) of each value
+    :param durations: duration of each value in quarter lengths
+    :param min_duration: minimal duration of the first occurrence of a pattern
+    :return: dict name -> patterns, the same as find_repeated_patterns on each sequence
+    """
+    # The last element of the sequences is never part of a pattern
+    size = len(positions) - 1
+    if size < 2:
+        return {name: [] for name in sequences}
+    names = list(sequences)
+    stride = size + 1
+    encoded = []
+    alphabet_start = 0
+    for name in names:
+        codes = encode_sequence(sequences[name][:size])
+        encoded.append(codes + alphabet_start)
+        alphabet_start += int(codes.max()) + 1
+    for index in range(len(names)):
+        encoded[index] = np.append(encoded[index], alphabet_start + index)
+    codes = np.concatenate(encoded)
+    suffix_array = build_suffix_array(codes)
+    lcp = build_lcp_array(codes, suffix_array)
+    # The separators (start == size) are never inside an LCP interval
+    streams = suffix_array // stride
+    starts_in_stream = suffix_array % stride
+    first_occurrence = SparseTable(starts_in_stream, np.minimum)
+    last_occurrence = SparseTable(starts_in_stream, np.maximum)
+    prefix_durations, scale = get_scaled_prefix_durations(durations[:size])
+    # The prefix sums are integers: sum >= min_duration * scale <=> sum >= ceil(min_duration * scale)
+    scaled_min_duration = math.ceil(Fraction(min_duration) * scale)
+
+    # At most one pattern per node: the longest one that does not overlap its first occurrence
+    intervals = np.array(list(get_lcp_intervals(lcp)), dtype=np.int64).reshape(-1, 4)
+    depths, parent_depths, lefts, rights = intervals.T
+    firsts = first_occurrence.query_many(lefts, rights)
+    lengths = np.minimum(depths, last_occurrence.query_many(lefts, rights) - firsts)
+    is_candidate = (lengths > parent_depths) & \
+        (prefix_durations[firsts + lengths] - prefix_durations[firsts] >= scaled_min_duration).astype(bool)
+    lengths, firsts, lefts, rights = lengths[is_candidate], firsts[is_candidate], lefts[is_candidate], \
+        rights[is_candidate]
+    candidate_streams = streams[lefts]
+    instrumentation.count("patterns_examined", len(lengths))
+
+    # A pattern is removed if one of its occurrences is covered by the first occurrence of a longer candidate
+    # of the same sequence
+    starts = np.arange(size)
+    covered_before_values = np.full(len(codes), -1, dtype=np.int64)
+    covered_at_values = np.full(len(codes), -1, dtype=np.int64)
+    for stream in np.unique(candidate_streams).tolist():
+        in_candidates = candidate_streams == stream
+        end_at_start = np.full(size, -1, dtype=np.int64)
+        np.maximum.at(end_at_start, firsts[in_candidates], firsts[in_candidates] + lengths[in_candidates])
+        end_before_start = np.maximum.accumulate(np.concatenate(([-1], end_at_start[:-1])))
+        # Suffix array entries of this sequence, without its separator
+        in_stream = (streams == stream) & (starts_in_stream < size)
+        stream_starts = starts_in_stream[in_stream]
+        covered_before_values[in_stream] = (end_before_start - starts)[stream_starts]
+        covered_at_values[in_stream] = (end_at_start - starts)[stream_starts]
+    covered_before = SparseTable(covered_before_values, np.maximum)
+    covered_at = SparseTable(covered_at_values, np.maximum)
+    is_kept = (covered_before.query_many(lefts, rights) < lengths) & (covered_at.query_many(lefts, rights) <= lengths)
+
+    candidates = [[] for _ in names]
+    for stream, length, first, left, right in zip(candidate_streams[is_kept].tolist(), lengths[is_kept].tolist(),
+                                                  firsts[is_kept].tolist(), lefts[is_kept].tolist(),
+                                                  rights[is_kept].tolist()):
+        candidates[stream].append((length, first, left, right))
+
+    results = {}
+    for name, sequence, stream_candidates in zip(names, (sequences[name] for name in names), candidates):
+        patterns = []
+        for length, first, left, right in stream_candidates:
+            occurrences = np.sort(starts_in_stream[left:right + 1])
+            repetitions = occurrences[occurrences >= first + length].tolist()
+            second = repetitions[0]
+            patterns.append((second, tuple(sequence[second:second + length]),
+                             [positions[first]] + [positions[i] for i in repetitions]))
+        patterns.sort(key=lambda pattern: (-len(pattern[1]), pattern[0]))
+        results[name] = [(pattern, pattern_positions) for _, pattern, pattern_positions in patterns]
+    return results
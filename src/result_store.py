@@ -0,0 +1,156 @@
+"""
+This module contains an append-only store for the results of the whole
+dataset runs, so that an interrupted run can be resumed.
+
+The store is a JSON Lines file with one record per piece:
+``{"piece": ..., "parameters": {...}, "parameters_hash": ..., "result": {...}}``.
+Every record is flushed to disk as soon as its piece is done. When a piece is
+stored more than once, the last record wins. A line cut short by a crash is
+ignored when the store is read back.
+"""
+
+import hashlib
+import json
+import os
+
+
+def get_parameters_hash(parameters: dict) -> str:
+    """
+    Get a short hash identifying a parameter set
+    :param parameters: JSON serializable dict of parameters
+    :return: hex digest
+    """
+    encoded = json.dumps(parameters, sort_keys=True, separators=(",", ":")).encode()
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+class ResultStore:
+    """
+    Append-only store of results keyed by piece and parameter set.
+
+    :ivar path: path to the JSON Lines file
+    :ivar records: dict (piece, parameters hash) -> result of the last record
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = {}
+        self._file = None
+        self._ends_with_newline = True
+        self.load()
+
+    def load(self):
+        """
+        Read the records already in the store
+        """
+        self.records = {}
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as f:
+            for line in f:
+                self._ends_with_newline = line.endswith("\n")
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Last line of a run killed while writing
+                    continue
+                self.records[(record["piece"], record["parameters_hash"])] = record["result"]
+
+    def get(self, piece: str, parameters: dict) -> dict or None:
+        """
+        Get the stored result of a piece
+        :param piece: path to the piece
+        :param parameters: parameter set of the run
+        :return: the result or None if the piece is not in the store
+        """
+        return self.records.get((piece, get_parameters_hash(parameters)))
+
+    def is_done(self, piece: str, parameters: dict) -> bool:
+        """
+        Check if a piece already has a result that is not an error
+        :param piece: path to the piece
+        :param parameters: parameter set of the run
+        :return: bool
+        """
+        result = self.get(piece, parameters)
+        return result is not None and "error" not in result
+
+    def append(self, piece: str, parameters: dict, result: dict):
+        """
+        Append the result of a piece and flush it to disk
+        :param piece: path to the piece
+        :param parameters: parameter set of the run
+        :param result: JSON serializable result (or error dict)
+        """
+        parameters_hash = get_parameters_hash(parameters)
+        record = {"piece": piece, "parameters": parameters, "parameters_hash": parameters_hash, "result": result}
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, "a")
+            if not self._ends_with_newline:
+                # Do not glue the first record to a line cut short by a crash
+                self._file.write("\n")
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.records[(piece, parameters_hash)] = result
+
+    def close(self):
+        """
+        Close the file of the store
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_store(store: str or ResultStore or None) -> ResultStore or None:
+    """
+    Get a ResultStore given either its path or the store itself
+    :param store: path to the JSON Lines file, ResultStore or None
+    :return: ResultStore or None
+    """
+    if store is None or isinstance(store, ResultStore):
+        return store
+    return ResultStore(store)
+
+
+def run_with_store(run, items: list, keys: list, parameters: dict, store: str or ResultStore or None = None,
+                   resume: bool = False):
+    """
+    Run the pieces that are not done yet and stream their results to the store
+    :param run: function taking the list of items to run and returning a generator of (item, result, error),
+                like run_in_parallel
+    :param items: items of the pieces
+    :param keys: key of each piece in the store
+    :param parameters: parameter set of the run
+    :param store: path to the store, ResultStore or None for no store
+    :param resume: skip the pieces already done in the store
+    :return: generator of (key, result, error, from_store) in the order of items
+    """
+    result_store = open_store(store)
+    try:
+        done = {}
+        if resume and result_store is not None:
+            done = {key: result_store.get(key, parameters) for key in keys if result_store.is_done(key, parameters)}
+        to_run = [item for item, key in zip(items, keys) if key not in done]
+        results = iter(run(to_run))
+        for key in keys:
+            if key in done:
+                yield key, done[key], None, True
+                continue
+            _, result, error = next(results)
+            if result_store is not None:
+                result_store.append(key, parameters, result if error is None else error)
+            yield key, result, error, False
+    finally:
+        if result_store is not None and result_store is not store:
+            result_store.close()
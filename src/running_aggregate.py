@@ -0,0 +1,99 @@
+"""
+This module contains aggregates of the results of a whole dataset run that
+are updated one piece at a time, in constant memory: the number of pieces and
+of errors, the mean, variance, minimum and maximum of the ratio between the
+number of phrases detected and the approximate number of phrases (a phrase
+every 8 measures), and a histogram of this ratio.
+"""
+
+import math
+from bisect import bisect_right
+
+# Edges of the histogram of the ratios, the last bin holds every ratio above the last edge
+DEFAULT_BINS = (0.0, 0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 2.0, 3.0, 4.0)
+
+
+class RunningAggregate:
+    """
+    Aggregate of the results of the pieces.
+
+    :ivar value_name: key of the number of phrases in the results ("nb_phrases" for C1, "nb_boundaries" for C3)
+    :ivar bins: edges of the histogram of the ratios
+    :ivar nb_pieces: number of pieces added, errors included
+    :ivar errors: dict error type -> number of pieces
+    :ivar nb_ratios: number of ratios (pieces without error and with measures)
+    :ivar histogram: number of ratios in each bin, one more than the edges
+    """
+
+    def __init__(self, value_name: str, bins: tuple = DEFAULT_BINS):
+        self.value_name = value_name
+        self.bins = tuple(bins)
+        self.nb_pieces = 0
+        self.errors = {}
+        self.nb_ratios = 0
+        self.histogram = [0] * (len(self.bins) + 1)
+        self.total_value = 0
+        self._total_ratio = 0.0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._min = math.inf
+        self._max = -math.inf
+
+    def add(self, result: dict):
+        """
+        Add the result of a piece
+        :param result: result of get_c1_result or get_c3_result, or a dict {"error": type, "message": message}
+        """
+        self.nb_pieces += 1
+        if "error" in result:
+            self.errors[result["error"]] = self.errors.get(result["error"], 0) + 1
+            return
+        value = result[self.value_name]
+        self.total_value += value
+        if not result["approx_ratio"]:
+            return
+        ratio = value / result["approx_ratio"]
+        self.nb_ratios += 1
+        self._total_ratio += ratio
+        # Welford's update of the variance
+        delta = ratio - self._mean
+        self._mean += delta / self.nb_ratios
+        self._m2 += delta * (ratio - self._mean)
+        self._min = min(self._min, ratio)
+        self._max = max(self._max, ratio)
+        self.histogram[bisect_right(self.bins, ratio)] += 1
+
+    @property
+    def mean_ratio(self) -> float or None:
+        """
+        Mean ratio, summed in the order of the pieces like the average ratio printed by the runners
+        :return: float or None if there is no ratio
+        """
+        return self._total_ratio / self.nb_ratios if self.nb_ratios else None
+
+    @property
+    def variance_ratio(self) -> float or None:
+        """
+        :return: population variance of the ratios or None if there is no ratio
+        """
+        return self._m2 / self.nb_ratios if self.nb_ratios else None
+
+    def to_dict(self) -> dict:
+        """
+        Convert to a JSON serializable dict
+        :return: dict
+        """
+        return {
+            "value_name": self.value_name,
+            "nb_pieces": self.nb_pieces,
+            "nb_errors": sum(self.errors.values()),
+            "errors": dict(self.errors),
+            "total_value": self.total_value,
+            "nb_ratios": self.nb_ratios,
+            "mean_ratio": self.mean_ratio,
+            "variance_ratio": self.variance_ratio,
+            "min_ratio": self._min if self.nb_ratios else None,
+            "max_ratio": self._max if self.nb_ratios else None,
+            "bins": list(self.bins),
+            "histogram": list(self.histogram),
+        }
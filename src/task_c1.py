@@ -5,12 +5,14 @@ by averaging the timing attributes for each beat of a meter.
 @Author: Joris Monnet
 @Date: 2024-03-26
 """
-import os
+import numpy as np
 
-import matplotlib.pyplot as plt
-import music21
+from src import instrumentation
+from src.boundary_fusion import filter_closest, fuse_boundaries
+from src.dataset_manifest import get_piece
+from src.midi_features import MidiFeatures, as_midi_features, load_midi_features
 
-from src.timing_for_one_piece import get_average_timing_one_piece
+from src.timing_for_one_piece import get_average_timing_one_piece, get_onset_arrays, load_performance_matrix
 
 
 def get_tempo_map_db(symbolic_to_performed_times: dict) -> dict and list[int]:
@@ -20,65 +22,121 @@ def get_tempo_map_db(symbolic_to_performed_times: dict) -> dict and list[int]:
     :param symbolic_to_performed_times:
     :return: dict
     """
-    result = {}
-    indexes = []
-    for i in range(len(symbolic_to_performed_times) - 1):
-        beat_type = symbolic_to_performed_times[i]["performed"]["beat_type"]
-        if beat_type == "db":
-            indexes.append(i)
-        onset = symbolic_to_performed_times[i]["performed"]["onset"]
-        next_onset = symbolic_to_performed_times[i + 1]["performed"]["onset"]
-        duration_performed = float(next_onset) - float(onset)
-        onset_symbolic = symbolic_to_performed_times[i]["symbolic"]["onset"]
-        next_onset_symbolic = symbolic_to_performed_times[i + 1]["symbolic"]["onset"]
-        duration_symbolic = float(next_onset_symbolic) - float(onset_symbolic)
-        result[i] = duration_symbolic / duration_performed
-    if symbolic_to_performed_times[len(symbolic_to_performed_times) - 1]["performed"]["beat_type"] == "db":
-        indexes.append(len(symbolic_to_performed_times) - 1)
-    return result, indexes
-
-
-def get_phrase_boundaries(path: str):
+    symbolic_onsets, performed_onsets, beat_types = get_onset_arrays(symbolic_to_performed_times)
+    ratios, indexes = get_tempo_ratios(symbolic_onsets, performed_onsets, beat_types)
+    return dict(enumerate(ratios.tolist())), indexes.tolist()
+
+
+def get_tempo_ratios(symbolic_onsets: np.ndarray, performed_onsets: np.ndarray, beat_types) -> tuple:
+    """
+    Array version of get_tempo_map_db
+    :param symbolic_onsets: float array with the symbolic onset of each beat
+    :param performed_onsets: float array with the performed onset of each beat
+    :param beat_types: beat type of each beat
+    :return: the tempo ratio of each beat except the last one and the indexes of the downbeats
+    """
+    ratios = np.diff(symbolic_onsets) / np.diff(performed_onsets)
+    indexes = np.flatnonzero(np.array([beat_type == "db" for beat_type in beat_types], dtype=bool))
+    return ratios, indexes
+
+
+def get_measure_slopes(tempo_ratios: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """
+    Get the mean tempo change inside each measure: the sum of the differences
+    between consecutive tempo ratios divided by the number of beats.
+    The differences are accumulated in order so that the result is the same
+    as a Python loop over the measure.
+    :param tempo_ratios: float array of tempo ratios, or 2D array with the tempo ratios of one performance per row
+    :param starts: first beat of each measure
+    :param ends: beat after the last beat of each measure
+    :return: float array with the mean tempo change of each measure (one row per performance for a 2D input)
+    """
+    differences = np.diff(tempo_ratios)
+    lengths = ends - starts
+    sums = np.zeros(tempo_ratios.shape[:-1] + (len(starts),))
+    nb_differences = lengths - 1
+    for step in range(int(nb_differences.max(initial=0))):
+        mask = nb_differences > step
+        sums[..., mask] += differences[..., starts[mask] + step]
+    return sums / np.maximum(lengths, 1)
+
+
+def get_phrase_boundaries_from_tempo(tempo_ratios: np.ndarray, indexes_db: np.ndarray) -> list[int]:
+    """
+    Get the phrase boundaries from the tempo ratios and the downbeats.
+    The first and last downbeats are boundaries, the other downbeats are
+    boundaries if the tempo starts increasing in the measure after them
+    while it was decreasing in the measure before them.
+    :param tempo_ratios: float array of tempo ratios
+    :param indexes_db: sorted int array with the indexes of the downbeats
+    :return: list of the beats which are phrase boundaries
+    """
+    return get_phrase_boundaries_from_tempo_batch(np.asarray(tempo_ratios)[None], indexes_db)[0]
+
+
+def get_phrase_boundaries_from_tempo_batch(tempo_ratios: np.ndarray, indexes_db: np.ndarray) -> list[list[int]]:
+    """
+    get_phrase_boundaries_from_tempo for several performances of the same score at once.
+    A measure with a missing beat (NaN) has a NaN slope and never makes a boundary.
+    :param tempo_ratios: 2D float array with the tempo ratios of one performance per row
+    :param indexes_db: sorted int array with the indexes of the downbeats of the score
+    :return: list of the phrase boundaries of each performance
+    """
+    nb_ratios = tempo_ratios.shape[1]
+    indexes_db = np.asarray(indexes_db, dtype=np.int64)
+    candidates = np.flatnonzero(indexes_db < nb_ratios)
+    if len(candidates) == 0:
+        return [[] for _ in range(len(tempo_ratios))]
+    # Measure j goes from indexes_db[j] to indexes_db[j + 1] (or the end of the tempo map)
+    starts = indexes_db[:-1]
+    ends = np.minimum(indexes_db[1:], nb_ratios)
+    valid = starts < nb_ratios
+    slopes = np.zeros((len(tempo_ratios), len(starts)))
+    slopes[:, valid] = get_measure_slopes(tempo_ratios, starts[valid], ends[valid])
+
+    last = len(indexes_db) - 1
+    middle = candidates[(candidates > 0) & (candidates < last)]
+    last_measure_change = slopes[:, middle - 1]
+    next_measure_change = slopes[:, middle]
+    is_boundary = (last_measure_change * next_measure_change < 0) & (next_measure_change > 0)
+
+    edges = candidates[(candidates == 0) | (candidates == last)]
+    return [np.sort(indexes_db[np.concatenate((edges, middle[row]))]).tolist() for row in is_boundary]
+
+
+@instrumentation.timed("phrase_boundaries")
+def get_phrase_boundaries(path: str, average: dict = None):
     """
     Get the phrase boundaries from the tempo map
     :param path:
+    :param average: output of get_average_timing_one_piece for the piece, computed from path if None
     :return:
     """
-    average = get_average_timing_one_piece(path)
-    tempo_map, indexes_db = get_tempo_map_db(average)
-
-    phrase_boundaries = []
-    for i in range(len(tempo_map)):
-        if i in indexes_db:
-            current_index = indexes_db.index(i)
-            if current_index == 0:
-                phrase_boundaries.append(i)
-                continue
-            last_db = indexes_db[current_index - 1]
-            if current_index == len(indexes_db) - 1:
-                phrase_boundaries.append(i)
-                continue
-            next_db = indexes_db[current_index + 1]
-            last_measure = list(tempo_map.values())[last_db:i]
-            next_measure = list(tempo_map.values())[i:next_db]
-            # -1 if the tempo is decreasing, 1 if the tempo is increasing inside the measure
-            last_measure_change = 0
-            for j in range(len(last_measure) - 1):
-                last_measure_change += last_measure[j + 1] - last_measure[j]
-            last_measure_change = last_measure_change / len(last_measure)
-            next_measure_change = 0
-            for j in range(len(next_measure) - 1):
-                next_measure_change += next_measure[j + 1] - next_measure[j]
-            next_measure_change = next_measure_change / len(next_measure)
-            # Check if sign of tempo change is different
-            if last_measure_change * next_measure_change < 0:
-                # Phrase boundary if the tempo is increasing inside the new measure
-                if next_measure_change > 0:
-                    phrase_boundaries.append(i)
-    boundaries_time = get_time_of_phrase_boundaries(phrase_boundaries, average)
+    if average is None:
+        average = get_average_timing_one_piece(path)
+    with instrumentation.stage("tempo_map"):
+        symbolic_onsets, performed_onsets, beat_types = get_onset_arrays(average)
+        tempo_ratios, indexes_db = get_tempo_ratios(symbolic_onsets, performed_onsets, beat_types)
+        phrase_boundaries = get_phrase_boundaries_from_tempo(tempo_ratios, indexes_db)
+    boundaries_time = performed_onsets[phrase_boundaries].tolist()
     return phrase_boundaries, boundaries_time
 
 
+@instrumentation.timed("phrase_boundaries")
+def get_phrase_boundaries_per_performance(path: str) -> list[tuple]:
+    """
+    Get the phrase boundaries of each performance of a piece separately, in one batch
+    :param path: path to the piece folder
+    :return: list with the phrase boundaries and their performed times for each performance annotation file
+             (in the order of the dataset manifest)
+    """
+    score, matrix = load_performance_matrix(path)
+    with instrumentation.stage("tempo_map"):
+        tempo_ratios = np.diff(score.onsets) / np.diff(matrix)
+        all_boundaries = get_phrase_boundaries_from_tempo_batch(tempo_ratios, score.downbeat_indexes())
+    return [(boundaries, matrix[row, boundaries].tolist()) for row, boundaries in enumerate(all_boundaries)]
+
+
 def get_time_of_phrase_boundaries(phrase_boundaries: list[int], average: dict):
     """
     Get the time of the phrase boundaries
@@ -92,42 +150,20 @@ def get_time_of_phrase_boundaries(phrase_boundaries: list[int], average: dict):
     return boundaries_time
 
 
-def get_times_volumes_measures(midi_file_path: str) -> tuple:
+def get_times_volumes_measures(midi_file: str or MidiFeatures) -> tuple:
     """
     Extracts the start times, velocity values (volume), and measure numbers of each note from a MIDI file.
 
     Parameters:
-    midi_file_path (str): The path to the input MIDI file.
+    midi_file (str or MidiFeatures): The path to the input MIDI file or its extracted features.
     
     Returns:
     times (list of float): A list containing the start times of all the notes in the MIDI file.
     volumes (list of int): A list containing the velocity values of all the notes in the MIDI file.
     measures (list of int): A list containing the measure numbers of all the notes in the MIDI file.
     """
-    midi_data = music21.converter.parse(midi_file_path)
-
-    times = []
-    volumes = []
-    measures = []
-
-    for part in midi_data.parts:
-        for element in part.flatten().notesAndRests:
-            if isinstance(element, music21.note.Note):
-                start_time = element.offset
-                velocity = element.volume.velocity
-                measure_number = element.measureNumber
-                times.append(start_time)
-                volumes.append(velocity)
-                measures.append(measure_number)
-            elif isinstance(element, music21.chord.Chord):
-                start_time = element.offset
-                velocity = element.volume.velocity
-                measure_number = element.measureNumber
-                times.append(start_time)
-                volumes.append(velocity)
-                measures.append(measure_number)
-
-    return times, volumes, measures
+    features = as_midi_features(midi_file)
+    return features.times, features.volumes, features.measures
 
 
 def get_scaled_differences_in_volumes(list_volume_performed: list) -> list:
@@ -149,6 +185,7 @@ def get_scaled_differences_in_volumes(list_volume_performed: list) -> list:
     return list_volume_differences_scaled
 
 
+@instrumentation.timed("velocity_threshold")
 def get_times_threshold(list_time: list, list_volume_differences_scaled: list, threshold: float) -> list:
     """
     Function to return the times when volume changes exceed a specified threshold.
@@ -190,6 +227,30 @@ def offset_to_seconds(offset: float, tempo: float) -> float:
     return offset * quarter_note_duration
 
 
+def draw_volume(ax, list_volume_differences_scaled: list[float], list_time_second: list[float],
+                list_filtered_second: list[float], max_points: int = None):
+    """
+    Draws the scaled volume differences and the highlighted times on existing axes.
+
+    Args:
+    ax (matplotlib Axes): The axes to draw on.
+    list_volume_differences_scaled (list of float): Scaled volume differences.
+    list_time_second (list of float): Times in seconds of the differences.
+    list_filtered_second (list of float): Times in seconds that need to be highlighted.
+    max_points (int): Decimate the curve to this number of points, None to keep them all.
+    """
+    from src.timing_plotter import decimate_min_max
+    length = min(len(list_time_second), len(list_volume_differences_scaled))
+    times, differences = decimate_min_max(list_time_second[:length], list_volume_differences_scaled[:length],
+                                          max_points)
+    ax.plot(times, differences, linestyle='-', color='b')
+    for x in list_filtered_second:
+        ax.axvline(x=x, color='y', linestyle='--')
+    ax.set_xlabel('Time[s]')
+    ax.set_ylabel('Volume Differences Scaled ')
+    ax.set_title('Volume Differences Scaled')
+
+
 def plot_volume(list_volume_performed: list[float], filtered_data: list[float], list_time: list[float], tempo: float):
     """
     Plots the scaled volume differences and highlights certain points with vertical lines.
@@ -202,74 +263,81 @@ def plot_volume(list_volume_performed: list[float], filtered_data: list[float],
     """
     list_time_second = [offset_to_seconds(x, tempo) for x in list_time]
     list_filtered_second = [offset_to_seconds(x, tempo) for x in filtered_data]
+    import matplotlib.pyplot as plt
     list_volume_differences_scaled = get_scaled_differences_in_volumes(list_volume_performed)
-    plt.figure(figsize=(10, 6))
-    plt.plot(list_time_second[:-2], list_volume_differences_scaled, linestyle='-', color='b')
-    for x in list_filtered_second:
-        plt.axvline(x=x, color='y', linestyle='--')
-    plt.xlabel('Time[s]')
-    plt.ylabel('Volume Differences Scaled ')
-    plt.title('Volume Differences Scaled')
+    fig, ax = plt.subplots(figsize=(10, 6))
+    draw_volume(ax, list_volume_differences_scaled, list_time_second[:-2], list_filtered_second)
     plt.show()
 
 
-def get_number_of_phrases_detected(path: str) -> int:
+def get_c1_features(path: str) -> dict or None:
     """
-    Merged model_p
-    :param path:
-    :return: number of phrases detected
+    Extract once what task C1 needs from a piece: the tempo boundaries and the
+    velocity differences of its first performance
+    :param path: path to the piece folder
+    :return: dict with "boundaries", "boundaries_times", "times", "volume_differences" and "tempo",
+             None if the piece has no performance MIDI
     """
     boundaries, boundaries_times = get_phrase_boundaries(path)
-    midi_path = ""
-    for root, dirs, files in os.walk(path):
-        for file in files:
-            if file.endswith(".mid") and file != "midi_score.mid":
-                midi_path = root + "/" + file
-                break
-    if midi_path == "":
-        return 0
-    midi_data = music21.converter.parse(midi_path)
-    tempo = midi_data.metronomeMarkBoundaries()[0][2].number
-    list_time, list_volumes, list_measures = get_times_volumes_measures(midi_path)
-    list_volume_differences_scaled = get_scaled_differences_in_volumes(list_volumes)
-    times_above_threshold_ = get_times_threshold(list_time, list_volume_differences_scaled, 0.15)
+    performance_midis = get_piece(path)["performance_midis"]
+    if not performance_midis:
+        return None
+    midi_path = path + "/" + performance_midis[0]
+    features = load_midi_features(midi_path)
+    list_time, list_volumes, list_measures = get_times_volumes_measures(features)
+    return {
+        "boundaries": boundaries,
+        "boundaries_times": boundaries_times,
+        "times": list_time,
+        "volume_differences": get_scaled_differences_in_volumes(list_volumes),
+        "tempo": features.tempo,
+    }
+
+
+def get_velocity_split_points(c1_features: dict, velocity_threshold: float = 0.15,
+                              threshold_closest: float = 2) -> list:
+    """
+    Get the times in seconds of the velocity changes above the threshold,
+    keeping only the changes more than threshold_closest quarter lengths after the previous kept one
+    :param c1_features: output of get_c1_features
+    :param velocity_threshold: threshold on the scaled squared velocity differences
+    :param threshold_closest: minimal distance in quarter lengths between two kept changes
+    :return: list of times in seconds
+    """
+    times_above_threshold_ = get_times_threshold(c1_features["times"], c1_features["volume_differences"],
+                                                 velocity_threshold)
     times_above_threshold = [float(x) for x in times_above_threshold_]
-    threshold_closest = 2
-
-    filtered_data = [times_above_threshold[0]]
-    for i in range(1, len(times_above_threshold)):
-        if times_above_threshold[i] - filtered_data[-1] > threshold_closest:
-            filtered_data.append(times_above_threshold[i])
-
-    split_point = [offset_to_seconds(x, tempo) for x in filtered_data]
-
-    potential_split_point = [split_point[0]]
-    for point in split_point:
-        for p in potential_split_point:
-            if abs(p - point) < 5:
-                break
-        else:
-            potential_split_point.append(point)
-
-    result_boundaries = []
-    boundaries_to_times = {}
-    for i in range(len(boundaries)):
-        boundaries_to_times[boundaries_times[i]] = boundaries[i]
-
-    threshold_similarity = 5
-    min_velocity = min(split_point) - threshold_similarity
-    max_velocity = max(split_point) + threshold_similarity
-
-    for point in split_point:
-        for boundaries_time in boundaries_times:
-            if abs(boundaries_time - point) < threshold_similarity and boundaries_time not in result_boundaries:
-                result_boundaries.append(boundaries_time)
-                break
-            elif boundaries_time < min_velocity and boundaries_time not in result_boundaries:
-                result_boundaries.append(boundaries_time)
-                break
-            elif boundaries_time > max_velocity and boundaries_time not in result_boundaries:
-                result_boundaries.append(boundaries_time)
-                break
+    filtered_data = filter_closest(times_above_threshold, threshold_closest)
+    return [offset_to_seconds(x, c1_features["tempo"]) for x in filtered_data]
 
+
+def count_fused_boundaries(split_point: list, boundaries_times: list, threshold_similarity: float = 5) -> int:
+    """
+    Fuse the velocity split points with the tempo boundaries and count the phrases
+    :param split_point: output of get_velocity_split_points
+    :param boundaries_times: performed times of the tempo boundaries
+    :param threshold_similarity: a tempo boundary closer than this (in seconds) to a split point is kept
+    :return: number of phrases detected
+    """
+    if not split_point:
+        raise ValueError("No velocity change above the threshold")
+    with instrumentation.stage("boundary_fusion"):
+        result_boundaries = fuse_boundaries(split_point, boundaries_times, threshold_similarity)
     return len(result_boundaries)
+
+
+def get_number_of_phrases_detected(path: str, velocity_threshold: float = 0.15, threshold_closest: float = 2,
+                                   threshold_similarity: float = 5) -> int:
+    """
+    Merged model_p
+    :param path:
+    :param velocity_threshold: threshold on the scaled squared velocity differences
+    :param threshold_closest: minimal distance in quarter lengths between two velocity changes
+    :param threshold_similarity: tolerance in seconds between a velocity change and a tempo boundary
+    :return: number of phrases detected
+    """
+    c1_features = get_c1_features(path)
+    if c1_features is None:
+        return 0
+    split_point = get_velocity_split_points(c1_features, velocity_threshold, threshold_closest)
+    return count_fused_boundaries(split_point, c1_features["boundaries_times"], threshold_similarity)
@@ -1,136 +1,127 @@
-import os
+from src import instrumentation
+from src.approximate_repeats import DEFAULT_MAX_DISTANCE, DEFAULT_WINDOW, find_approximate_repeats, \
+    get_rhythm_classes
+from src.boundary_fusion import space_points
+from src.dataset_manifest import load_manifest
+from src.midi_features import as_midi_features, get_default_backend, load_midi_features
+from src.onset_table import OnsetTable
+from src.parallel import run_in_parallel
+from src.repeat_search import find_repeated_patterns, find_repeated_patterns_multi
+from src.result_store import ResultStore, run_with_store
+from src.running_aggregate import RunningAggregate
+
+# Searches giving the patterns of get_boundaries
+PATTERN_SOURCES = ("exact", "approximate")
+# Sequences of the approximate search, the same for a transposed repeat or a repeat with scaled durations
+APPROXIMATE_KEYS = ("interval", "rhythm")
+
+
+@instrumentation.timed("interval_extraction")
+def extract_intervals_and_durations(midi_file) -> OnsetTable:
+    """
+    Extract intervals and durations from a MIDI file.
+    :param midi_file: path to the MIDI file or its MidiFeatures
+    :return: OnsetTable of the onsets with their root, interval and duration
+    """
+    return as_midi_features(midi_file).onset_table
 
-import music21
+
+@instrumentation.timed("pattern_search")
+def find_repeating_sequences(data: OnsetTable, key, min_duration: float = 6.0):
+    """
+    Find the repeating patterns of one column of the onsets
+    :param data: output of extract_intervals_and_durations
+    :param key: "interval", "root" or "duration"
+    :param min_duration: minimal duration in quarter lengths of a repeating pattern
+    :return: list of (pattern, positions) (see repeat_search.find_repeated_patterns)
+    """
+    patterns = find_repeated_patterns(data.column(key), data.positions(), data.column("duration"), min_duration)
+    instrumentation.count("patterns_found", len(patterns))
+    return patterns
 
 
-def extract_intervals_and_durations(midi_file_path) -> dict:
+@instrumentation.timed("pattern_search")
+def find_repeating_sequences_multi(data: OnsetTable, keys=('interval', 'root', 'duration'),
+                                   min_duration: float = 6.0) -> dict:
     """
-    Extract intervals and durations from a MIDI file.
+    find_repeating_sequences for several keys in one search
+    :param data: output of extract_intervals_and_durations
+    :param keys: keys of the sequences
+    :param min_duration: minimal duration in quarter lengths of a repeating pattern
+    :return: dict key -> patterns
+    """
+    durations = data.column("duration")
+    sequences = {key: durations if key == "duration" else data.column(key) for key in keys}
+    patterns = find_repeated_patterns_multi(sequences, data.positions(), durations, min_duration)
+    instrumentation.count("patterns_found", sum(len(key_patterns) for key_patterns in patterns.values()))
+    return patterns
+
+
+@instrumentation.timed("pattern_search")
+def find_approximate_repeating_sequences(data: OnsetTable, key, min_duration: float = 6.0,
+                                         window: int = DEFAULT_WINDOW, max_distance: int = DEFAULT_MAX_DISTANCE):
+    """
+    Find the repeating patterns of one sequence of the onsets allowing a few changed, added or removed onsets
+    :param data: output of extract_intervals_and_durations
+    :param key: "interval", "root", "duration" or "rhythm" (ratio of each duration to the previous one)
+    :param min_duration: minimal duration in quarter lengths of a repeating pattern
+    :param window: number of onsets of the shortest pattern
+    :param max_distance: maximal number of edits in a window of a repeat
+    :return: list of (pattern, positions) (see approximate_repeats.find_approximate_repeats)
     """
-    midi_data = music21.converter.parse(midi_file_path)
-    pitches = {}
-    for n in midi_data.recurse().notes:
-        if n.isNote:
-            if (n.measureNumber, n.offset) not in pitches:
-                pitches[(n.measureNumber, n.offset)] = {
-                    'pitch': {n.pitch.midi},
-                    'duration': n.duration.quarterLength
-                }
-            else:
-                pitches[(n.measureNumber, n.offset)]['pitch'].add(n.pitch.midi)
-        elif n.isChord:
-            if (n.measureNumber, n.offset) not in pitches:
-                pitches[(n.measureNumber, n.offset)] = {
-                    'pitch': {p.midi for p in n.pitches},
-                    'duration': n.duration.quarterLength
-                }
-            else:
-                pitches[(n.measureNumber, n.offset)]['pitch'].update({p.midi for p in n.pitches})
-
-    # Calculate the interval (difference) between pitches
-    pitches_with_intervals = {}
-    last_pitch = None
-    for onset, pitch in pitches.items():
-        if onset == (1, 0) or last_pitch is None:
-            pitches_with_intervals[onset] = {
-                'pitch': pitch['pitch'],
-                'root': min(pitch['pitch']),
-                'interval': None,
-                'duration': pitch['duration']
-            }
-        else:
-            pitches_with_intervals[onset] = {
-                'pitch': pitch['pitch'],
-                'root': min(pitch['pitch']),
-                'interval': min(pitch['pitch']) - last_pitch,
-                'duration': pitch['duration']
-            }
-        last_pitch = min(pitch['pitch'])
-    return pitches_with_intervals
-
-
-def find_repeating_sequences(data, key):
-    sequence = []
-    positions = []
-    durations = []
-
-    # Concatenate sequences, positions, and durations from all measures
-    for (measure, offset), value in sorted(data.items()):
-        sequence.append(value[key])
-        positions.append((measure, offset))
-        durations.append(value['duration'])
-
-    # Function to find repeating patterns with their positions
-    def find_patterns_with_positions(seq, pos, dur):
-        n = len(seq)
-        patterns = []
-        seen = {}
-        for i in range(n):
-            for length in range(1, n - i):
-                pattern = tuple(seq[i:i + length])
-                if pattern in seen:
-                    first_occurrence = seen[pattern]
-                    if i - first_occurrence[0] >= length:
-                        total_duration = sum(dur[first_occurrence[0]:first_occurrence[0] + length])
-                        if total_duration >= 6.0:
-                            if pattern not in [p[0] for p in patterns]:
-                                patterns.append((pattern, [first_occurrence[1]]))
-                            for pat in patterns:
-                                if pat[0] == pattern:
-                                    pat[1].append(pos[i])
-                else:
-                    seen[pattern] = (i, pos[i])
-        return patterns
-
-    # Function to remove sub-patterns
-    def remove_sub_patterns(patterns):
-        patterns.sort(key=lambda x: len(x[0]), reverse=True)
-        filtered_patterns = []
-        for i, (pattern, positions) in enumerate(patterns):
-            is_sub_pattern = False
-            for longer_pattern, _ in filtered_patterns:
-                if len(pattern) < len(longer_pattern):
-                    for j in range(len(longer_pattern) - len(pattern) + 1):
-                        if pattern == longer_pattern[j:j + len(pattern)]:
-                            is_sub_pattern = True
-                            break
-            if not is_sub_pattern:
-                filtered_patterns.append((pattern, positions))
-        return filtered_patterns
-
-    # Collect repeating sequences with positions
-    patterns = find_patterns_with_positions(sequence, positions, durations)
-    filtered_patterns = remove_sub_patterns(patterns)
-
-    return filtered_patterns
-
-
-def get_boundaries(midi_file_path):
+    durations = data.column("duration")
+    sequence = get_rhythm_classes(durations) if key == "rhythm" else data.column(key)
+    patterns = find_approximate_repeats(sequence, data.positions(), durations, min_duration, window, max_distance)
+    instrumentation.count("patterns_found", len(patterns))
+    return patterns
+
+
+def get_boundaries(midi_file, min_duration: float = 6.0, measure_spacing: int = 2, pattern_source: str = "exact"):
     """
     Get boundaries for repeating patterns in a MIDI file.
-    :param midi_file_path:
+    :param midi_file: path to the MIDI file or its MidiFeatures
+    :param min_duration: minimal duration in quarter lengths of a repeating pattern
+    :param measure_spacing: minimal distance in measures between two boundaries
+    :param pattern_source: "exact" (exact repeats of the intervals, roots and durations) or "approximate"
+                           (repeats of the intervals and of the rhythms with a few edits)
     :return:
     """
-    data = extract_intervals_and_durations(midi_file_path)
-    repeating_intervals = find_repeating_sequences(data, 'interval')
-    repeating_root = find_repeating_sequences(data, 'root')
-    repeating_durations = find_repeating_sequences(data, 'duration')
+    data = extract_intervals_and_durations(midi_file)
+    return merge_pattern_boundaries(find_pattern_starts(data, min_duration, pattern_source), measure_spacing)
+
+
+def find_pattern_starts(data: OnsetTable, min_duration: float = 6.0, pattern_source: str = "exact") -> list:
+    """
+    Find the positions of the occurrences of the repeating patterns of the intervals, roots and durations
+    :param data: output of extract_intervals_and_durations
+    :param min_duration: minimal duration in quarter lengths of a repeating pattern
+    :param pattern_source: "exact" or "approximate" (see get_boundaries)
+    :return: list of (measure, offset)
+    """
+    if pattern_source == "approximate":
+        return [position for key in APPROXIMATE_KEYS
+                for _, positions in find_approximate_repeating_sequences(data, key, min_duration)
+                for position in positions]
+    if pattern_source != "exact":
+        raise ValueError(f"Unknown pattern source {pattern_source!r}, expected one of {PATTERN_SOURCES}")
+    patterns = find_repeating_sequences_multi(data, ('interval', 'root', 'duration'), min_duration)
     boundaries = []
-    for pattern, start_pos in repeating_intervals:
-        boundaries.extend(start_pos)
-    for pattern, start_pos in repeating_root:
-        boundaries.extend(start_pos)
-    for pattern, start_pos in repeating_durations:
-        boundaries.extend(start_pos)
-    boundaries = list(set(boundaries))
-    boundary_results = set()
-    for (measure, offset) in boundaries:
-        for result in boundary_results:
-            if abs(result - measure) < 2:
-                break
-        else:
-            boundary_results.add(measure)
-    return sorted(boundary_results)
+    for key_patterns in patterns.values():
+        for pattern, start_pos in key_patterns:
+            boundaries.extend(start_pos)
+    return boundaries
+
+
+def merge_pattern_boundaries(boundaries: list, measure_spacing: int = 2) -> list:
+    """
+    Keep one boundary per group of close measures: the distinct boundaries are scanned in the
+    order of a set of the (measure, offset), as the original model did, and a measure is kept
+    when no measure kept before it is closer than measure_spacing
+    :param boundaries: list of (measure, offset)
+    :param measure_spacing: minimal distance in measures between two boundaries
+    :return: sorted list of measures
+    """
+    return sorted(space_points([measure for measure, offset in set(boundaries)], measure_spacing))
 
 
 def list_midi_files(base_path):
@@ -139,52 +130,113 @@ def list_midi_files(base_path):
     :param base_path:
     :return:
     """
-    midi_paths = []
-    # Specify exact filenames to search for
-    target_files = ['midi_score.mid', 'midi_score.midi']
-    for root, dirs, files in os.walk(base_path):
-        for file in files:
-            if file in target_files:
-                midi_paths.append(os.path.join(root, file).replace('\\', '/'))
-    return midi_paths
+    return load_manifest(base_path).score_midi_files()
 
 
-def get_number_of_measures(midi_file_path):
+def get_number_of_measures(midi_file):
     """
     Get the number of measures in a MIDI file.
-    :param midi_file_path:
+    :param midi_file: path to the MIDI file or its MidiFeatures
     :return:
     """
-    midi_data = music21.converter.parse(midi_file_path)
-    return len(midi_data.parts[0].getElementsByClass('Measure'))
+    return as_midi_features(midi_file).number_of_measures
 
 
-def run_on_whole_dataset(base_path: str = '../asap-dataset/Bach') -> dict:
+def get_c3_result(midi_file: str) -> dict:
     """
-    Run the functions on the whole dataset.
+    Run the functions on one MIDI file.
+    :param midi_file: path to the MIDI file
+    :return: dict with the boundaries, their number, the number of measures and the approximate ratio
+    """
+    with instrumentation.piece(midi_file) as profile:
+        features = load_midi_features(midi_file)
+        boundaries = get_boundaries(features)
+        nb_measures = get_number_of_measures(features)
+    result = {
+        'boundaries': boundaries,
+        "nb_boundaries": len(boundaries),
+        "nb_measures": nb_measures,
+        "approx_ratio": nb_measures / 8
+    }
+    if profile is not None:
+        # Sent back with the result, the piece may have run in another process
+        result["profile"] = profile.to_dict()
+    return result
+
+
+def get_c3_files(midi_file: str) -> list:
+    """
+    Get the files task C3 reads for one MIDI file, to read them ahead (see prefetch)
+    :param midi_file: path to the MIDI file
+    :return: list of paths
+    """
+    return [midi_file]
+
+
+def iter_on_whole_dataset(base_path: str = '../asap-dataset/Bach', workers: int = 1, chunk_size: int = 1,
+                          timeout: float = None, store: str or ResultStore = None, resume: bool = False,
+                          aggregate: RunningAggregate = None):
+    """
+    Run the functions on the whole dataset, yielding the result of each MIDI file as soon as it is done.
+    Nothing is kept for a MIDI file once its result is yielded.
     :param base_path: path to the dataset
-    :return results: dict
+    :param workers: number of processes, None for one per CPU
+    :param chunk_size: number of pieces sent to a process at once
+    :param timeout: timeout in seconds for each piece, None for no timeout
+    :param store: path to a JSON Lines result store (or ResultStore) where each piece is saved when it is done
+    :param resume: skip the pieces that already have a result in the store
+    :param aggregate: RunningAggregate("nb_boundaries") updated with each result
+    :return: generator of (MIDI file, result), the result is a dict {"error": type, "message": message}
+             for the pieces that failed
     """
     midi_files = list_midi_files(base_path)
+    parameters = {"task": "c3", "midi_backend": get_default_backend()}
+    for midi_file, result, error, _ in run_with_store(
+            lambda items: instrumentation.collect_profiles(
+                run_in_parallel(get_c3_result, items, workers, chunk_size, timeout, get_c3_files)),
+            midi_files, midi_files, parameters, store, resume):
+        result = result if error is None else error
+        if aggregate is not None:
+            aggregate.add(result)
+        yield midi_file, result
+
+
+def run_on_whole_dataset(base_path: str = '../asap-dataset/Bach', workers: int = 1, chunk_size: int = 1,
+                         timeout: float = None, store: str or ResultStore = None, resume: bool = False) -> dict:
+    """
+    Run the functions on the whole dataset.
+    :param base_path: path to the dataset
+    :param workers: number of processes, None for one per CPU
+    :param chunk_size: number of pieces sent to a process at once
+    :param timeout: timeout in seconds for each piece, None for no timeout
+    :param store: path to a JSON Lines result store (or ResultStore) where each piece is saved when it is done
+    :param resume: skip the pieces that already have a result in the store
+    :return results: dict, the pieces that failed have a dict {"error": type, "message": message}
+    """
+    aggregate = RunningAggregate("nb_boundaries")
     results = {}
-    for midi_file in midi_files:
-        try:
-            boundaries = get_boundaries(midi_file)
+    for midi_file, result in iter_on_whole_dataset(base_path, workers, chunk_size, timeout, store, resume,
+                                                   aggregate):
+        if "error" not in result:
             print(f"MIDI File: {midi_file}")
-            nb_measures = get_number_of_measures(midi_file)
-            results[midi_file] = {
-                'boundaries': boundaries,
-                "nb_boundaries": len(boundaries),
-                "nb_measures": nb_measures,
-                "approx_ratio": nb_measures / 8
-            }
-        except Exception as e:
-            print(f"Error for {midi_file}: {e}")
-    print("AVERAGE RATIO:",
-          sum([value["nb_boundaries"] / value['approx_ratio'] for value in results.values()]) / len(results))
+        results[midi_file] = result
+    print("AVERAGE RATIO:", aggregate.mean_ratio)
     return results
 
 
+def draw_results(ax, results: dict):
+    """
+    Draw the number of boundaries for each piece and the approximate ratio on existing axes.
+    :param ax: matplotlib Axes
+    :param results: output of run_on_whole_dataset
+    """
+    results = {key: value for key, value in results.items() if "error" not in value}
+    ax.plot([value["approx_ratio"] for value in results.values()], label='Approximate Ratio', linewidth=0.8)
+    ax.plot([value["nb_boundaries"] for value in results.values()], label='Number of Boundaries', linewidth=0.8)
+    ax.set(xlabel='Piece', ylabel='Value',
+           title='Number of Boundaries vs Approximate Ratio')
+
+
 def plot_results(results: dict):
     """
     Plot the results as a line chart with the number of boundaries for each piece and the approximate ratio.
@@ -195,8 +247,5 @@ def plot_results(results: dict):
     import seaborn as sns
     sns.set_theme()
     fig, ax = plt.subplots()
-    ax.plot([value["approx_ratio"] for value in results.values()], label='Approximate Ratio', linewidth=0.8)
-    ax.plot([value["nb_boundaries"] for value in results.values()], label='Number of Boundaries', linewidth=0.8)
-    ax.set(xlabel='Piece', ylabel='Value',
-           title='Number of Boundaries vs Approximate Ratio')
+    draw_results(ax, results)
     plt.show()
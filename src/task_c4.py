@@ -1,49 +1,95 @@
-import os
-
+from src import instrumentation
+from src.dataset_manifest import get_piece, load_manifest
+from src.midi_features import get_default_backend
+from src.parallel import run_in_parallel
+from src.result_store import ResultStore, run_with_store
+from src.running_aggregate import RunningAggregate
 from src.task_c1 import get_number_of_phrases_detected
 
 
-def run_c1_whole_dataset(folder_path: str = "asap-dataset/"):
+def get_c1_result(path: str) -> dict:
+    """
+    Run task C1 for one piece
+    :param path: path to the piece folder
+    :return: dict with the number of phrases detected, the number of measures and the approximate ratio
+    """
+    with instrumentation.piece(path) as profile:
+        nb_measures = get_number_of_measures(path)
+        nb_phrases = get_number_of_phrases_detected(path)
+    result = {
+        "nb_phrases": nb_phrases,
+        "nb_measures": nb_measures,
+        "approx_ratio": nb_measures / 8
+    }
+    if profile is not None:
+        # Sent back with the result, the piece may have run in another process
+        result["profile"] = profile.to_dict()
+    return result
+
+
+def get_c1_files(path: str) -> list:
+    """
+    Get the files task C1 reads for one piece, to read them ahead (see prefetch)
+    :param path: path to the piece folder
+    :return: list of paths, empty if the piece is not in the dataset manifest
+    """
+    try:
+        piece = get_piece(path)
+    except OSError:
+        return []
+    files = [piece["score_annotations"]] + piece["performance_annotations"] + piece["performance_midis"][:1]
+    return [path + "/" + file for file in files if file]
+
+
+def iter_c1_whole_dataset(folder_path: str = "asap-dataset/", workers: int = 1, chunk_size: int = 1,
+                          timeout: float = None, store: str or ResultStore = None, resume: bool = False,
+                          aggregate: RunningAggregate = None):
+    """
+    Run task C1 for the whole dataset, yielding the result of each piece as soon as it is done.
+    Nothing is kept for a piece once its result is yielded.
+    :param folder_path: path to the dataset
+    :param workers: number of processes, None for one per CPU
+    :param chunk_size: number of pieces sent to a process at once
+    :param timeout: timeout in seconds for each piece, None for no timeout
+    :param store: path to a JSON Lines result store (or ResultStore) where each piece is saved when it is done
+    :param resume: skip the pieces that already have a result in the store
+    :param aggregate: RunningAggregate("nb_phrases") updated with each result
+    :return: generator of (piece, result), the result is a dict {"error": type, "message": message}
+             for the pieces that failed
+    """
+    paths = load_manifest(folder_path).piece_folders(with_score_annotations=True)
+    keys = [path.replace("asap-dataset/", "") for path in paths]
+    parameters = {"task": "c1", "midi_backend": get_default_backend()}
+    for key, result, error, _ in run_with_store(
+            lambda items: instrumentation.collect_profiles(
+                run_in_parallel(get_c1_result, items, workers, chunk_size, timeout, get_c1_files)),
+            paths, keys, parameters, store, resume):
+        result = result if error is None else error
+        if aggregate is not None:
+            aggregate.add(result)
+        yield key, result
+
+
+def run_c1_whole_dataset(folder_path: str = "asap-dataset/", workers: int = 1, chunk_size: int = 1,
+                         timeout: float = None, store: str or ResultStore = None, resume: bool = False):
     """
     Run task C1 for the whole dataset
     :param folder_path: path to the dataset
-    :return: a dictionary with the number of phrases detected for each piece
-    """
-    paths = []
-    for root, dirs, files in os.walk(folder_path):
-        if root in paths:
-            continue
-        for file in files:
-            if file.endswith("midi_score_annotations.txt"):
-                paths.append(root.replace("\\", "/"))
-                break
-    results = {}
-    for path in paths:
-        try:
-            nb_measures = get_number_of_measures(path)
-            nb_phrases = get_number_of_phrases_detected(path)
-            results[path.replace("asap-dataset/", "")] = {
-                "nb_phrases": nb_phrases,
-                "nb_measures": nb_measures,
-                "approx_ratio": nb_measures / 8
-            }
-        except Exception as e:
-            print(f"Error for {path}: {e}")
-            results[path.replace("asap-dataset/", "")] = "Error"
-    return results
+    :param workers: number of processes, None for one per CPU
+    :param chunk_size: number of pieces sent to a process at once
+    :param timeout: timeout in seconds for each piece, None for no timeout
+    :param store: path to a JSON Lines result store (or ResultStore) where each piece is saved when it is done
+    :param resume: skip the pieces that already have a result in the store
+    :return: a dictionary with the number of phrases detected for each piece,
+             or a dict {"error": type, "message": message} for the pieces that failed
+    """
+    return dict(iter_c1_whole_dataset(folder_path, workers, chunk_size, timeout, store, resume))
 
 
 def get_number_of_measures(folder_path: str):
     """
-    Get the number of measures for a piece
+    Get the number of measures for a piece, counted when the piece was indexed in the dataset manifest
     :param folder_path: path to the piece folder
     :return: int
     """
-    file = folder_path + "/midi_score_annotations.txt"
-    count = 0
-    with open(file, "r") as f:
-        lines = f.readlines()
-        for line in lines:
-            if "db" in line:
-                count += 1
-    return count
+    return get_piece(folder_path)["nb_downbeats"]
@@ -6,7 +6,17 @@ From ASSIGNMENT 1 - Task A
 @Date: 2024-03-26
 """
 
-import os
+import warnings
+
+import numpy as np
+
+from src import instrumentation
+from src.beat_annotations import BeatAnnotations, load_beat_annotations
+from src.dataset_manifest import get_piece
+from src.prefetch import prefetch_files
+
+# Statistics of get_onset_statistics that can replace the performed onsets of several performances
+AVERAGE_STATISTICS = ("mean", "median", "trimmed_mean")
 
 
 def get_performed_attributes(performed_path: str) -> dict:
@@ -15,30 +25,7 @@ def get_performed_attributes(performed_path: str) -> dict:
     :param performed_path: path to the annotation file with the performed times
     :return: dict of the performed attributes for each beat
     """
-    result_performed = {}
-    with open(performed_path, "r") as f:
-        performed_data = f.readlines()
-        current_key = None
-        current_meter = None
-        current_beat = 0
-        for line in performed_data:
-            line_data = line.split()
-            beat_key_meter = line_data[2].split(',')
-            beat_type = beat_key_meter[0]
-            if len(beat_key_meter) == 3:
-                current_meter = beat_key_meter[1]
-                current_key = beat_key_meter[2]
-            elif len(beat_key_meter) == 2:
-                current_meter = beat_key_meter[1]
-
-            result_performed[current_beat] = {
-                "key": current_key,
-                "meter": current_meter,
-                "onset": line_data[0],
-                "beat_type": beat_type
-            }
-            current_beat += 1
-    return result_performed
+    return load_beat_annotations(performed_path).to_performed_dict()
 
 
 def get_symbolic_attributes(symbolic_path: str) -> dict:
@@ -47,17 +34,7 @@ def get_symbolic_attributes(symbolic_path: str) -> dict:
     :param symbolic_path: path to the annotation file with the symbolic times
     :return: dict of the symbolic attributes for each beat
     """
-    result_symbolic = {}
-    with open(symbolic_path, "r") as f:
-        unperformed_data = f.readlines()
-        current_beat = 0
-        for line in unperformed_data:
-            line_data = line.split()
-            result_symbolic[current_beat] = {
-                "onset": line_data[0],
-            }
-            current_beat += 1
-    return result_symbolic
+    return load_beat_annotations(symbolic_path).to_symbolic_dict()
 
 
 def get_piece_symbolic_to_performed_times(symbolic_path: str, performed_path: str) -> dict:
@@ -78,6 +55,19 @@ def get_piece_symbolic_to_performed_times(symbolic_path: str, performed_path: st
     return result
 
 
+def get_onset_arrays(symbolic_to_performed_times: dict) -> tuple:
+    """
+    Convert the symbolic to performed times dict to arrays
+    :param symbolic_to_performed_times: dict as returned by get_piece_symbolic_to_performed_times
+    :return: symbolic onsets, performed onsets (float64 arrays) and beat types (list of str)
+    """
+    beats = [symbolic_to_performed_times[i] for i in range(len(symbolic_to_performed_times))]
+    symbolic_onsets = np.array([float(beat["symbolic"]["onset"]) for beat in beats], dtype=np.float64)
+    performed_onsets = np.array([float(beat["performed"]["onset"]) for beat in beats], dtype=np.float64)
+    beat_types = [beat["performed"]["beat_type"] for beat in beats]
+    return symbolic_onsets, performed_onsets, beat_types
+
+
 def get_tempo_map(symbolic_to_performed_times: dict) -> dict:
     """
     Get the tempo map from the symbolic to the performed times
@@ -99,15 +89,76 @@ def get_tempo_map(symbolic_to_performed_times: dict) -> dict:
     return result
 
 
-def get_average_timing_one_piece(folder_path: str) -> dict or None:
+def get_performance_matrix(score: BeatAnnotations, performances: list) -> np.ndarray:
+    """
+    Align the performed onsets of several performances on the beats of the score
+    :param score: annotations of the score
+    :param performances: list of BeatAnnotations, one per performance
+    :return: float array (performances x beats of the score), NaN where a performance has no annotation for the beat
+    """
+    matrix = np.full((len(performances), len(score)), np.nan)
+    for row, performance in enumerate(performances):
+        nb_beats = min(len(performance), len(score))
+        matrix[row, :nb_beats] = performance.onsets[:nb_beats]
+    return matrix
+
+
+def load_performance_matrix(folder_path: str, files: list = None) -> tuple:
+    """
+    Load the annotations of the score and of every performance of a piece
+    :param folder_path: the path to the piece folder
+    :param files: names of the performance annotation files, all of them if None
+    :return: the score annotations (BeatAnnotations) and the matrix of get_performance_matrix
+    """
+    if files is None:
+        files = get_piece(folder_path)["performance_annotations"]
+    paths = [folder_path + "/midi_score_annotations.txt"] + [folder_path + "/" + file for file in files]
+    # The files are read at the same time, then parsed one after another
+    with prefetch_files(paths):
+        score = load_beat_annotations(paths[0])
+        performances = [load_beat_annotations(path) for path in paths[1:]]
+    return score, get_performance_matrix(score, performances)
+
+
+def get_onset_statistics(matrix: np.ndarray, trim: float = 0.1) -> dict:
+    """
+    Get statistics of the performed onsets of each beat, ignoring the missing beats (NaN)
+    :param matrix: float array (performances x beats) as returned by get_performance_matrix
+    :param trim: proportion of the performances removed at each end for the trimmed mean
+    :return: dict of float arrays (one value per beat, NaN for the beats no performance has):
+             "mean", "median", "variance", "trimmed_mean" and "count" (number of performances)
+    """
+    count = np.count_nonzero(~np.isnan(matrix), axis=0)
+    # NaN are sorted last, the trimmed mean keeps the ranks [cut, count - cut) of each beat
+    ordered = np.sort(matrix, axis=0)
+    cut = np.floor(trim * count).astype(np.int64)
+    ranks = np.arange(len(matrix))[:, None]
+    kept = (ranks >= cut) & (ranks < count - cut)
+    with warnings.catch_warnings():
+        # Beats without any performance give NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return {
+            "mean": np.nanmean(matrix, axis=0),
+            "median": np.nanmedian(matrix, axis=0),
+            "variance": np.nanvar(matrix, axis=0),
+            "trimmed_mean": np.where(kept, ordered, 0).sum(axis=0) / kept.sum(axis=0),
+            "count": count,
+        }
+
+
+@instrumentation.timed("average_timing")
+def get_average_timing_one_piece(folder_path: str, statistic: str = "mean") -> dict or None:
     """
     Get the attributes for each beat for a piece where the piece can have
     multiple performances
     :param folder_path: the path to the piece folder
+    :param statistic: how the performed onsets of several performances are combined,
+                      "mean", "median" or "trimmed_mean" (see get_onset_statistics)
     :return: dict
     """
-    files = [file for file in os.listdir(folder_path) if file.endswith("annotations.txt")]
-    files.remove("midi_score_annotations.txt")
+    if statistic not in AVERAGE_STATISTICS:
+        raise ValueError(f"Unknown statistic {statistic!r}, expected one of {AVERAGE_STATISTICS}")
+    files = get_piece(folder_path)["performance_annotations"]
     if len(files) == 0:
         print("No annotation files found")
         return
@@ -116,31 +167,20 @@ def get_average_timing_one_piece(folder_path: str) -> dict or None:
                                                      folder_path + "/" + files[0])
 
     # Case multiple files :
-    # Get the symbolic times only once
-    symbolic_times = get_symbolic_attributes(folder_path + "/midi_score_annotations.txt")
-    performed_list = []
-    for file in files:
-        performed_list.append(get_performed_attributes(folder_path + "/" + file))
-
-    # Average the onsets for each beat for performed times
-    avg_performed = {}
-    for i in range(len(symbolic_times)):
-        onset_sum = 0
-        for performed in performed_list:
-            if i not in performed:
-                continue
-            onset_sum += float(performed[i]["onset"])
-        avg_performed[i] = onset_sum / len(performed_list)
-
+    score, matrix = load_performance_matrix(folder_path, files)
+    performed_onsets = get_onset_statistics(matrix)[statistic].tolist()
+    # The labels of the beats come from the score, the performances may miss some beats
+    symbolic_times = score.to_symbolic_dict()
+    labels = score.to_performed_dict()
     result = {}
     for key in symbolic_times:
         result[key] = {
             "symbolic": symbolic_times[key],
             "performed": {
-                "onset": avg_performed[key],
-                "key": performed_list[0][key]["key"],
-                "meter": performed_list[0][key]["meter"],
-                "beat_type": performed_list[0][key]["beat_type"]
+                "onset": performed_onsets[key],
+                "key": labels[key]["key"],
+                "meter": labels[key]["meter"],
+                "beat_type": labels[key]["beat_type"]
             }
         }
     return result
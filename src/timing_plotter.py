@@ -5,22 +5,60 @@ This module contains functions used to plot the results for Task A.
 @Date: 2024-03-26
 """
 
-import matplotlib.pyplot as plt
-import seaborn as sns
+import numpy as np
 
 
-def plot_timing_for_one_piece(tempo_map: dict, boundaries:list[int]):
+def decimate_min_max(x, y, max_points: int) -> tuple:
     """
-    Plot the tempo curve from the dict of tempo ratios (for one piece) with each beat as x-axis
-    :param tempo_map: dict
-    :return: None
+    Reduce a curve to at most max_points points keeping the minimum and the maximum of each bin,
+    so that the peaks are still visible once plotted
+    :param x: x values
+    :param y: y values (NaN are allowed)
+    :param max_points: maximal number of points, None or 0 to keep every point
+    :return: (x, y) as arrays
     """
-    fig, ax = plt.subplots()
-    ax.plot(list(tempo_map.keys()), list(tempo_map.values()), linewidth=0.8)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if not max_points or len(y) <= max_points:
+        return x, y
+    nb_bins = max(max_points // 2, 1)
+    bin_size = -(-len(y) // nb_bins)
+    padded = np.full(nb_bins * bin_size, np.nan)
+    padded[:len(y)] = y
+    bins = padded.reshape(nb_bins, bin_size)
+    starts = np.arange(nb_bins) * bin_size
+    minimums = starts + np.argmin(np.where(np.isnan(bins), np.inf, bins), axis=1)
+    maximums = starts + np.argmax(np.where(np.isnan(bins), -np.inf, bins), axis=1)
+    indexes = np.unique(np.concatenate((minimums, maximums)))
+    indexes = indexes[indexes < len(y)]
+    return x[indexes], y[indexes]
+
+
+def draw_timing(ax, tempo_map: dict, boundaries: list[int], max_points: int = None):
+    """
+    Draw the tempo curve and the boundaries on existing axes
+    :param ax: matplotlib Axes
+    :param tempo_map: dict beat -> tempo ratio
+    :param boundaries: beats of the boundaries
+    :param max_points: decimate the curve to this number of points (see decimate_min_max), None to keep them all
+    """
+    beats, ratios = decimate_min_max(list(tempo_map.keys()), list(tempo_map.values()), max_points)
+    ax.plot(beats, ratios, linewidth=0.8)
     # Plot boundaries as vertical lines
     for boundary in boundaries:
         ax.axvline(x=boundary, color='r', linestyle='--', linewidth=0.5)
     ax.set(xlabel='Beats', ylabel='Tempo Ratio',
            title='Tempo curve')
-    plt.grid(True)
+    ax.grid(True)
+
+
+def plot_timing_for_one_piece(tempo_map: dict, boundaries:list[int]):
+    """
+    Plot the tempo curve from the dict of tempo ratios (for one piece) with each beat as x-axis
+    :param tempo_map: dict
+    :return: None
+    """
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots()
+    draw_timing(ax, tempo_map, boundaries)
     plt.show()
\ No newline at end of file
@@ -0,0 +1,17 @@
+import pytest
+
+from src import feature_cache
+
+
+@pytest.fixture(scope="session")
+def feature_cache_directory(tmp_path_factory) -> str:
+    return str(tmp_path_factory.mktemp("feature_cache"))
+
+
+@pytest.fixture(autouse=True)
+def isolated_feature_cache(feature_cache_directory, monkeypatch):
+    # The tests never read or write the cache of the user, the environment passes it on to the workers
+    monkeypatch.setenv(feature_cache.CACHE_DIR_ENV, feature_cache_directory)
+    monkeypatch.setenv(feature_cache.NO_CACHE_ENV, "")
+    monkeypatch.setattr(feature_cache, "_default_configured", False)
+    monkeypatch.setattr(feature_cache, "_default_cache", None)
@@ -0,0 +1,105 @@
+import random
+
+import pytest
+
+from src.approximate_repeats import chain_windows, find_approximate_repeats, find_matching_windows, fit_window
+
+
+def edit_distance(first: list, second: list) -> int:
+    previous = list(range(len(second) + 1))
+    for row, token in enumerate(first, 1):
+        current = [row]
+        for column, other in enumerate(second, 1):
+            current.append(min(previous[column - 1] + (token != other), previous[column] + 1, current[-1] + 1))
+        previous = current
+    return previous[-1]
+
+
+def fit_window_baseline(window: list, text: list) -> dict:
+    # Distance of the window to every part text[start:end]
+    return {(start, end): edit_distance(window, text[start:end])
+            for start in range(len(text) + 1) for end in range(start, len(text) + 1)}
+
+
+def random_tokens(rng: random.Random, size: int, alphabet: int) -> list:
+    return [rng.randrange(alphabet) for _ in range(size)]
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_fit_window(seed):
+    rng = random.Random(seed)
+    alphabet = rng.choice([2, 3, 5])
+    window = random_tokens(rng, rng.randint(1, 6), alphabet)
+    text = random_tokens(rng, rng.randint(0, 10), alphabet)
+    max_distance = rng.randint(0, 3)
+    distances = fit_window_baseline(window, text)
+    best = min(distances.values())
+    fitted = fit_window(window, text, max_distance)
+    if best > max_distance:
+        assert fitted is None
+    else:
+        distance, start = fitted
+        assert distance == best
+        assert min(distance for (other_start, _), distance in distances.items() if other_start == start) == best
+
+
+@pytest.mark.parametrize("seed", range(60))
+def test_find_matching_windows(seed):
+    rng = random.Random(seed)
+    # A small alphabet and a few copies with edits, so that there are matches of every kind
+    tokens = random_tokens(rng, rng.randint(10, 20), rng.choice([2, 3, 4]))
+    tokens += tokens[:rng.randint(0, len(tokens))]
+    for _ in range(rng.randint(0, 3)):
+        index = rng.randrange(len(tokens))
+        rng.choice([lambda: tokens.insert(index, 9), lambda: tokens.pop(index),
+                    lambda: tokens.__setitem__(index, 9)])()
+    window = rng.randint(2, 6)
+    max_distance = rng.randint(0, min(2, window - 1))
+    size = len(tokens)
+    matches = find_matching_windows(tokens, window, max_distance, max_bucket=size)
+
+    # Every match is a part of the sequence after the first window, at most max_distance edits away
+    for start, other in matches:
+        assert other >= start + window
+        assert min(edit_distance(tokens[start:start + window], tokens[other:end])
+                   for end in range(other, size + 1)) <= max_distance
+    # Scan of every pair of windows: the ones with only substitutions are all found
+    for start in range(size - window + 1):
+        for other in range(start + window, size - window + 1):
+            if sum(a != b for a, b in zip(tokens[start:start + window], tokens[other:other + window])) \
+                    <= max_distance:
+                assert (start, other) in matches
+            # A window with edits is found within max_distance tokens of each end of its best fit
+            elif edit_distance(tokens[start:start + window], tokens[other:other + window]) <= max_distance:
+                assert any(found == start and abs(found_other - other) <= max_distance
+                           for found, found_other in matches)
+
+
+def test_chain_windows():
+    window = 4
+    # Diagonal 20, an added token at 26 moves the end of the repeat to diagonal 21
+    matches = {(start, start + 20) for start in range(0, 4)} | {(start, start + 21) for start in range(3, 9)}
+    # A window of diagonal 20 also matched one token later
+    matches |= {(1, 22)}
+    # Another repeat of the same start, on a diagonal far away
+    matches |= {(start, start + 40) for start in range(0, 3)}
+    assert sorted(chain_windows(matches, window)) == [(0, 20, 12), (0, 40, 6)]
+    # Chains on diagonals further apart than max_shift are kept apart
+    assert sorted(chain_windows({(0, 20), (1, 21), (1, 23)}, 2)) == [(0, 20, 3), (1, 23, 2)]
+    assert sorted(chain_windows({(0, 20), (1, 21), (1, 23)}, 2, max_shift=2)) == [(0, 20, 3)]
+    # The repeat is cut where it starts
+    assert chain_windows({(start, start + 5) for start in range(10)}, 5) == [(0, 5, 5)]
+
+
+def test_a_repeat_with_an_added_onset_is_found_once():
+    rng = random.Random(0)
+    pattern = random_tokens(rng, 24, 50)
+    repeat = pattern[:12] + [99] + pattern[12:]
+    sequence = pattern + random_tokens(rng, 10, 50) + repeat
+    positions = [(index, 0.0) for index in range(len(sequence))]
+    durations = [1.0] * len(sequence)
+    patterns = find_approximate_repeats(sequence, positions, durations, min_duration=6.0)
+    # One repeat, its last window can take one more token with a substitution
+    assert len(patterns) == 1
+    assert patterns[0][0][:len(pattern)] == tuple(pattern) and len(patterns[0][0]) <= len(pattern) + 1
+    assert patterns[0][1] == [(0, 0.0), (34, 0.0)]
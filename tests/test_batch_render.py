@@ -0,0 +1,24 @@
+import pytest
+
+from benchmarks.synthetic_corpus import generate_corpus
+from src import task_c1, timing_for_one_piece
+from src.batch_render import render_timing
+
+pytest.importorskip("matplotlib")
+
+
+def test_render_timing_reads_the_average_timing_once(tmp_path, monkeypatch):
+    pieces = generate_corpus(str(tmp_path / "corpus"), [8], nb_performances=2)
+    calls = []
+    get_average_timing_one_piece = timing_for_one_piece.get_average_timing_one_piece
+
+    def counted(path):
+        calls.append(path)
+        return get_average_timing_one_piece(path)
+
+    monkeypatch.setattr(timing_for_one_piece, "get_average_timing_one_piece", counted)
+    monkeypatch.setattr(task_c1, "get_average_timing_one_piece", counted)
+    output_path = tmp_path / "timing.png"
+    render_timing(pieces[8][0], str(output_path))
+    assert calls == [pieces[8][0]]
+    assert output_path.stat().st_size > 0
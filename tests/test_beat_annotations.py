@@ -0,0 +1,84 @@
+import random
+
+import numpy as np
+import pytest
+
+from src.beat_annotations import BeatAnnotations, load_beat_annotations, parse_beat_annotations
+
+
+def get_performed_attributes_baseline(lines: list) -> dict:
+    # Row parser of timing_for_one_piece.get_performed_attributes in the original model
+    result_performed = {}
+    current_key = None
+    current_meter = None
+    current_beat = 0
+    for line in lines:
+        line_data = line.split()
+        beat_key_meter = line_data[2].split(',')
+        beat_type = beat_key_meter[0]
+        if len(beat_key_meter) == 3:
+            current_meter = beat_key_meter[1]
+            current_key = beat_key_meter[2]
+        elif len(beat_key_meter) == 2:
+            current_meter = beat_key_meter[1]
+
+        result_performed[current_beat] = {
+            "key": current_key,
+            "meter": current_meter,
+            "onset": line_data[0],
+            "beat_type": beat_type
+        }
+        current_beat += 1
+    return result_performed
+
+
+def random_lines(rng: random.Random) -> list:
+    lines = []
+    onset = rng.uniform(0, 2)
+    for _ in range(rng.randint(0, 40)):
+        onset += rng.uniform(0.1, 1.5)
+        label = rng.choice(["db", "b", "b", "bR"])
+        fields = rng.random()
+        if fields < 0.1:
+            label += "," + rng.choice(["3/4", "4/4", "6/8"])
+        elif fields < 0.2:
+            label += "," + rng.choice(["3/4", "4/4", "6/8"]) + "," + rng.choice(["0", "-3", "5"])
+        lines.append(f"{onset:.6f}\t{onset:.6f}\t{label}\n")
+    return lines
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_parse_beat_annotations(seed):
+    lines = random_lines(random.Random(seed))
+    annotations = parse_beat_annotations(lines)
+    expected = get_performed_attributes_baseline(lines)
+    for beat in expected.values():
+        beat["onset"] = float(beat["onset"])
+    assert annotations.to_performed_dict() == expected
+    assert annotations.to_symbolic_dict() == {beat: {"onset": expected[beat]["onset"]} for beat in expected}
+    assert annotations.downbeat_indexes().tolist() == [beat for beat in expected
+                                                       if expected[beat]["beat_type"] == "db"]
+    for beat in expected:
+        assert annotations.meter_at(beat) == expected[beat]["meter"]
+        assert annotations.key_at(beat) == expected[beat]["key"]
+    assert annotations.onsets.dtype == np.float64 and annotations.beat_types.dtype == np.int8
+    assert BeatAnnotations.from_arrays(annotations.to_arrays()).to_performed_dict() == expected
+
+
+def test_blank_lines_are_skipped():
+    lines = ["0.5\t0.5\tdb,4/4,2\n", "\n", "1.0\t1.0\tb\n", "   \n"]
+    assert parse_beat_annotations(lines).to_performed_dict() == \
+        {0: {"key": "2", "meter": "4/4", "onset": 0.5, "beat_type": "db"},
+         1: {"key": "2", "meter": "4/4", "onset": 1.0, "beat_type": "b"}}
+
+
+def test_unknown_beat_type():
+    with pytest.raises(ValueError, match="'x' at beat 1"):
+        parse_beat_annotations(["0.5\t0.5\tdb,4/4,2\n", "1.0\t1.0\tx\n"])
+
+
+def test_load_beat_annotations(tmp_path):
+    lines = random_lines(random.Random(0))
+    path = tmp_path / "midi_score_annotations.txt"
+    path.write_text("".join(lines).replace("\n", "\r\n"))
+    assert load_beat_annotations(str(path)).to_performed_dict() == parse_beat_annotations(lines).to_performed_dict()
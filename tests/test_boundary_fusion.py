@@ -0,0 +1,71 @@
+import random
+
+import pytest
+
+from src.boundary_fusion import fuse_boundaries, space_points
+
+
+def fuse_boundaries_baseline(split_points: list, boundaries_times: list, tolerance: float) -> list:
+    # Loop of get_number_of_phrases_detected before fuse_boundaries
+    result_boundaries = []
+    min_velocity = min(split_points) - tolerance
+    max_velocity = max(split_points) + tolerance
+    for point in split_points:
+        for boundaries_time in boundaries_times:
+            if abs(boundaries_time - point) < tolerance and boundaries_time not in result_boundaries:
+                result_boundaries.append(boundaries_time)
+                break
+            elif boundaries_time < min_velocity and boundaries_time not in result_boundaries:
+                result_boundaries.append(boundaries_time)
+                break
+            elif boundaries_time > max_velocity and boundaries_time not in result_boundaries:
+                result_boundaries.append(boundaries_time)
+                break
+    return result_boundaries
+
+
+def space_points_baseline(points: list, min_spacing: float) -> list:
+    potential_split_point = [points[0]]
+    for point in points:
+        for p in potential_split_point:
+            if abs(p - point) < min_spacing:
+                break
+        else:
+            potential_split_point.append(point)
+    return potential_split_point
+
+
+def random_times(rng: random.Random, size: int) -> list:
+    # Half-second steps give equal times and times exactly at the tolerance
+    return [rng.randrange(0, 400) / 2 for _ in range(size)]
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_fuse_boundaries_sorted(seed):
+    rng = random.Random(seed)
+    split_points = random_times(rng, rng.randint(1, 30))
+    boundaries = sorted(random_times(rng, rng.randint(0, 40)))
+    tolerance = rng.choice([0.5, 2, 5, 5.3])
+    assert fuse_boundaries(split_points, boundaries, tolerance) == \
+        fuse_boundaries_baseline(split_points, boundaries, tolerance)
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_fuse_boundaries_unsorted(seed):
+    rng = random.Random(seed)
+    split_points = random_times(rng, rng.randint(1, 30))
+    boundaries = random_times(rng, rng.randint(2, 40))
+    tolerance = rng.choice([0.5, 2, 5, 5.3])
+    assert fuse_boundaries(split_points, boundaries, tolerance) == \
+        fuse_boundaries_baseline(split_points, boundaries, tolerance)
+
+
+def test_fuse_boundaries_without_split_points():
+    assert fuse_boundaries([], [1.0, 2.0], 5) == []
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_space_points(seed):
+    rng = random.Random(seed)
+    points = random_times(rng, rng.randint(1, 40))
+    assert space_points(points, 5) == space_points_baseline(points, 5)
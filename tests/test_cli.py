@@ -0,0 +1,68 @@
+import contextlib
+import csv
+import json
+
+import pytest
+
+from src.cli import COLUMNS, main, open_writer
+from src.feature_cache import NO_CACHE_ENV
+
+RESULT = {"piece": "A/piece1", "boundaries": [1, 9], "nb_boundaries": 2, "nb_measures": 16, "approx_ratio": 2.0}
+ERROR = {"piece": "A/piece2", "error": "MidiException", "message": "badly formatted midi bytes"}
+
+
+def write_rows(output_format: str, output: str, rows: list):
+    with contextlib.ExitStack() as stack:
+        writer = open_writer(output_format, output, stack, COLUMNS["patterns-c3"])
+        for row in rows:
+            writer.write(row)
+
+
+@pytest.mark.parametrize("rows", [[RESULT, ERROR], [ERROR, RESULT]])
+def test_csv_keeps_the_errors_and_the_results(tmp_path, rows):
+    path = str(tmp_path / "rows.csv")
+    write_rows("csv", path, rows)
+    with open(path, newline="") as f:
+        written = {row["piece"]: row for row in csv.DictReader(f)}
+    assert written["A/piece1"]["nb_boundaries"] == "2" and written["A/piece1"]["error"] == ""
+    assert json.loads(written["A/piece1"]["boundaries"]) == [1, 9]
+    assert written["A/piece2"]["error"] == "MidiException"
+    assert written["A/piece2"]["message"] == "badly formatted midi bytes"
+
+
+@pytest.mark.parametrize("rows", [[RESULT, ERROR], [ERROR, RESULT], [ERROR]])
+def test_parquet_keeps_the_errors_and_the_results(tmp_path, rows):
+    parquet = pytest.importorskip("pyarrow.parquet")
+    path = str(tmp_path / "rows.parquet")
+    write_rows("parquet", path, rows)
+    written = {row["piece"]: row for row in parquet.read_table(path).to_pylist()}
+    assert written["A/piece2"]["error"] == "MidiException"
+    if len(rows) > 1:
+        assert written["A/piece1"]["boundaries"] == [1, 9] and written["A/piece1"]["error"] is None
+
+
+def test_every_subcommand_has_columns():
+    from src.cli import get_parser
+    subparsers = next(action for action in get_parser()._actions if action.dest == "command")
+    assert set(subparsers.choices) - {"bench"} == set(COLUMNS)
+
+
+def test_resume_writes_the_stored_rows(tmp_path, monkeypatch, capsys):
+    calls = []
+
+    def get_rows(item):
+        calls.append(item)
+        return [{"nb_phrases": 1, "nb_measures": 8, "approx_ratio": 1.0}]
+
+    from src import cli
+    # configure sets $DM_NO_CACHE for the workers, it is restored after the test
+    monkeypatch.setenv(NO_CACHE_ENV, "")
+    monkeypatch.setattr(cli, "_piece_folders", lambda args: [str(tmp_path / "A" / "piece1")])
+    monkeypatch.setattr(cli, "get_c1_rows", get_rows)
+    store = str(tmp_path / "store.jsonl")
+    arguments = ["phrases-c1", "--dataset-root", str(tmp_path), "--no-cache", "--store", store, "--resume"]
+    assert main(arguments) == 0
+    assert main(arguments) == 0
+    assert len(calls) == 1
+    rows = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert rows == 2 * [{"piece": "A/piece1", "nb_phrases": 1, "nb_measures": 8, "approx_ratio": 1.0}]
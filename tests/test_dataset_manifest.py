@@ -0,0 +1,95 @@
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from benchmarks.synthetic_corpus import generate_corpus
+from src import dataset_manifest
+from src.dataset_manifest import MANIFEST_FILE, get_piece, load_manifest
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch) -> str:
+    # Each test starts without manifest loaded in the process
+    monkeypatch.setattr(dataset_manifest, "_manifests", {})
+    root = str(tmp_path / "corpus")
+    generate_corpus(root, [4, 8], pieces_per_size=2, nb_performances=1, seed=0)
+    return root
+
+
+def load_and_list(root: str, monkeypatch) -> tuple:
+    # load_manifest, with the folders listed and the score annotations counted by the refresh, except the root:
+    # saving the manifest changes its modification time
+    listed = []
+    scandir = os.scandir
+    count_beats = dataset_manifest.count_beats
+
+    def record_scandir(path):
+        if os.path.abspath(path) != os.path.abspath(root):
+            listed.append(os.path.relpath(path, root))
+        return scandir(path)
+
+    def record_count_beats(path):
+        listed.append(("count", os.path.basename(os.path.dirname(path))))
+        return count_beats(path)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(dataset_manifest.os, "scandir", record_scandir)
+        patch.setattr(dataset_manifest, "count_beats", record_count_beats)
+        manifest = load_manifest(root)
+    return manifest, listed
+
+
+def test_refresh_lists_only_the_changed_folders(corpus, monkeypatch):
+    manifest, listed = load_and_list(corpus, monkeypatch)
+    assert sorted(manifest.pieces) == ["Size4/piece0", "Size4/piece1", "Size8/piece0", "Size8/piece1"]
+    assert len(listed) == 10
+    assert os.path.exists(os.path.join(corpus, MANIFEST_FILE))
+
+    # Nothing changed: nothing is listed or counted
+    unchanged, listed = load_and_list(corpus, monkeypatch)
+    assert unchanged.pieces == manifest.pieces
+    assert listed == []
+
+    # A piece added
+    shutil.copytree(os.path.join(corpus, "Size4", "piece0"), os.path.join(corpus, "Size4", "piece2"))
+    added, listed = load_and_list(corpus, monkeypatch)
+    assert sorted(listed, key=str) == sorted(["Size4", "Size4/piece2", ("count", "piece2")], key=str)
+    assert added.pieces["Size4/piece2"] == dict(manifest.pieces["Size4/piece0"],
+                                                annotations_mtime=added.pieces["Size4/piece2"]["annotations_mtime"])
+
+    # A piece removed
+    shutil.rmtree(os.path.join(corpus, "Size8", "piece1"))
+    removed, listed = load_and_list(corpus, monkeypatch)
+    assert listed == ["Size8"]
+    assert sorted(removed.pieces) == ["Size4/piece0", "Size4/piece1", "Size4/piece2", "Size8/piece0"]
+    assert removed.piece_folders() == [corpus + "/" + folder for folder in sorted(removed.pieces)]
+
+
+def test_read_only_dataset(corpus, monkeypatch):
+    def read_only_open(path, mode="r", *args, **kwargs):
+        if "w" in mode and os.path.abspath(path).startswith(os.path.abspath(corpus)):
+            raise PermissionError(13, "Read-only file system", path)
+        return open(path, mode, *args, **kwargs)
+
+    monkeypatch.setattr(dataset_manifest, "open", read_only_open, raising=False)
+    manifest = load_manifest(corpus)
+    assert len(manifest.pieces) == 4
+    assert not any(name.startswith(MANIFEST_FILE) for name in os.listdir(corpus))
+    # The manifest is built again in memory on the next load
+    assert load_manifest(corpus).pieces == manifest.pieces
+    assert get_piece(corpus + "/Size4/piece0") == manifest.pieces["Size4/piece0"]
+
+
+def test_get_piece_in_a_worker_without_the_manifest(corpus):
+    manifest = load_manifest(corpus)
+    folders = manifest.piece_folders() + [corpus + "/Size4"]
+    # A spawned process does not inherit the manifests loaded in this one
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        pieces = list(executor.map(get_piece, folders))
+    assert pieces[:-1] == list(manifest.pieces.values())
+    assert pieces[-1] == {"score_midi": None, "performance_midis": [], "score_annotations": None,
+                          "performance_annotations": [], "annotations_mtime": None, "nb_beats": 0,
+                          "nb_downbeats": 0}
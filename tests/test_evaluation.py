@@ -0,0 +1,99 @@
+import os
+import random
+
+import pytest
+
+from benchmarks.synthetic_corpus import generate_piece
+from src.evaluation import detect_boundaries, evaluate_boundaries, evaluate_c3_grid_piece, evaluate_many
+from src.parameter_sweep import C3_DEFAULTS
+
+
+def evaluate_boundaries_baseline(detected, reference, tolerances) -> dict:
+    # One tolerance, one boundary at a time
+    detected = sorted(set(float(boundary) for boundary in detected))
+    reference = [float(boundary) for boundary in reference]
+    output = {"tolerances": [float(tolerance) for tolerance in tolerances], "nb_detected": len(detected),
+              "nb_reference": len(reference), "precision": [], "recall": [], "f1": []}
+    for tolerance in tolerances:
+        true_detected = 0
+        for boundary in detected:
+            if any(abs(boundary - other) <= tolerance for other in reference):
+                true_detected += 1
+        found_reference = 0
+        for boundary in reference:
+            if any(abs(boundary - other) <= tolerance for other in detected):
+                found_reference += 1
+        precision = true_detected / len(detected) if detected else 0.0
+        recall = found_reference / len(reference) if reference else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+        output["precision"].append(precision)
+        output["recall"].append(recall)
+        output["f1"].append(f1)
+    return output
+
+
+def random_boundaries(rng: random.Random) -> list:
+    return [rng.randint(0, 40) + rng.choice([0, 0, 0.5]) for _ in range(rng.randint(0, 15))]
+
+
+def assert_same_evaluation(evaluation: dict, expected: dict):
+    assert evaluation["tolerances"] == expected["tolerances"]
+    assert evaluation["nb_detected"] == expected["nb_detected"]
+    assert evaluation["nb_reference"] == expected["nb_reference"]
+    for name in ("precision", "recall", "f1"):
+        assert evaluation[name] == pytest.approx(expected[name]), name
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_evaluate_boundaries(seed):
+    rng = random.Random(seed)
+    detected, reference = random_boundaries(rng), random_boundaries(rng)
+    tolerances = sorted(rng.sample([0, 0.5, 1, 2, 3, 8], rng.randint(0, 4)))
+    assert_same_evaluation(evaluate_boundaries(detected, reference, tolerances),
+                           evaluate_boundaries_baseline(detected, reference, tolerances))
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_evaluate_many(seed):
+    rng = random.Random(seed)
+    detections = [random_boundaries(rng) for _ in range(rng.randint(1, 6))]
+    reference = random_boundaries(rng)
+    tolerances = sorted(rng.sample([0, 1, 2, 4], rng.randint(0, 3)))
+    evaluations = evaluate_many(detections, reference, tolerances)
+    assert len(evaluations) == len(detections)
+    for evaluation, detected in zip(evaluations, detections):
+        assert_same_evaluation(evaluation, evaluate_boundaries(detected, reference, tolerances))
+        assert_same_evaluation(evaluation, evaluate_boundaries_baseline(detected, reference, tolerances))
+
+
+def test_evaluate_many_empty_cases():
+    assert evaluate_many([], [1, 9]) == []
+    assert evaluate_many([[1, 9]], [1, 9], tolerances=[]) == [
+        {"tolerances": [], "nb_detected": 2, "nb_reference": 2, "precision": [], "recall": [], "f1": []}]
+    evaluations = evaluate_many([[], [1, 9], []], [], tolerances=[0, 1])
+    assert [evaluation["nb_detected"] for evaluation in evaluations] == [0, 2, 0]
+    for evaluation in evaluations:
+        assert evaluation["precision"] == evaluation["recall"] == evaluation["f1"] == [0.0, 0.0]
+    assert evaluate_many([[]], [1, 9], tolerances=[0])[0]["recall"] == [0.0]
+
+
+@pytest.fixture(scope="module")
+def midi_piece(tmp_path_factory) -> str:
+    # Size16/piece0 of benchmarks.synthetic_corpus.generate_corpus, with the other extension of the score
+    pytest.importorskip("music21")
+    folder = str(tmp_path_factory.mktemp("midi_piece"))
+    generate_piece(folder, 16, nb_performances=0, seed=16000)
+    os.rename(folder + "/midi_score.mid", folder + "/midi_score.midi")
+    return folder
+
+
+def test_detect_boundaries_reads_the_score_of_the_manifest(midi_piece):
+    assert detect_boundaries(midi_piece, "c3").tolist() == [2, 9, 12, 14]
+    grid = [dict(C3_DEFAULTS)]
+    evaluation = evaluate_c3_grid_piece((midi_piece, grid, "downbeats", (0, 1), 8))[0]
+    assert evaluation["nb_detected"] == 4
+
+
+def test_detect_boundaries_without_score(tmp_path):
+    with pytest.raises(ValueError):
+        detect_boundaries(str(tmp_path), "c3")
@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+
+from src import feature_cache
+from src.feature_cache import FeatureCache, get_default_cache
+
+ARRAYS = {"values": np.arange(1000, dtype=np.float64)}
+
+
+def write_file(path, content: bytes) -> str:
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_round_trip(tmp_path):
+    cache = FeatureCache(str(tmp_path / "cache"))
+    source = write_file(tmp_path / "a.mid", b"a")
+    assert cache.get(source, "midi") is None
+    cache.put(source, "midi", ARRAYS)
+    assert np.array_equal(cache.get(source, "midi")["values"], ARRAYS["values"])
+    assert cache.get(source, "beats") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    directory = tmp_path / "cache"
+    probe = FeatureCache(str(directory))
+    sources = [write_file(tmp_path / f"{name}.mid", name.encode()) for name in "abcd"]
+    probe.put(sources[0], "midi", ARRAYS)
+    entry_size = os.path.getsize(probe.entry_path(sources[0], "midi"))
+    probe.clear()
+
+    cache = FeatureCache(str(directory), max_bytes=3 * entry_size)
+    for time, source in enumerate(sources[:3], 1):
+        cache.put(source, "midi", ARRAYS)
+        os.utime(cache.entry_path(source, "midi"), (time, time))
+    # a is used, b is now the least recently used entry
+    assert cache.get(sources[0], "midi") is not None
+    cache.put(sources[3], "midi", ARRAYS)
+    assert [cache.get(source, "midi") is not None for source in sources] == [True, False, True, True]
+    assert sum(entry.stat().st_size for entry in os.scandir(directory)) <= 3 * entry_size
+
+
+def test_a_modified_file_is_not_served_stale_features(tmp_path):
+    cache = FeatureCache(str(tmp_path / "cache"))
+    source = tmp_path / "a.mid"
+    write_file(source, b"first version")
+    cache.put(str(source), "midi", ARRAYS)
+    write_file(source, b"second version, longer")
+    assert cache.get(str(source), "midi") is None
+    # The same content is found again
+    write_file(source, b"first version")
+    os.utime(source, (1, 1))
+    assert cache.get(str(source), "midi") is not None
+
+
+def test_entries_are_keyed_by_the_extractor_version(tmp_path, monkeypatch):
+    cache = FeatureCache(str(tmp_path / "cache"))
+    source = write_file(tmp_path / "a.mid", b"a")
+    cache.put(source, "midi", ARRAYS)
+    assert f"midi-v{feature_cache.EXTRACTOR_VERSION}-" in os.path.basename(cache.entry_path(source, "midi"))
+    monkeypatch.setattr(feature_cache, "EXTRACTOR_VERSION", feature_cache.EXTRACTOR_VERSION + 1)
+    assert cache.get(source, "midi") is None
+
+
+def test_default_cache_of_the_tests(feature_cache_directory, monkeypatch):
+    assert get_default_cache().directory == feature_cache_directory
+    monkeypatch.setattr(feature_cache, "_default_configured", False)
+    monkeypatch.setenv(feature_cache.NO_CACHE_ENV, "1")
+    assert get_default_cache() is None
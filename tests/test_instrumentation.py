@@ -0,0 +1,140 @@
+import json
+import types
+
+import pytest
+
+from src import instrumentation
+
+
+class Clock:
+    """
+    perf_counter of the instrumentation, moved forward by the tests
+    """
+
+    def __init__(self):
+        self.now = 100.0
+
+    def perf_counter(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(instrumentation, "time", types.SimpleNamespace(perf_counter=clock.perf_counter))
+    monkeypatch.setattr(instrumentation, "_enabled", False)
+    monkeypatch.setattr(instrumentation, "_current", instrumentation.Profile())
+    monkeypatch.setattr(instrumentation, "_profiles", [])
+    return clock
+
+
+def run_piece(clock: Clock, name: str) -> instrumentation.Profile:
+    @instrumentation.timed("parse")
+    def parse():
+        clock.advance(1.0)
+        instrumentation.count("notes", 10)
+        return "parsed"
+
+    with instrumentation.piece(name) as profile:
+        clock.advance(0.5)
+        with instrumentation.stage("boundaries"):
+            for _ in range(2):
+                with instrumentation.stage("tempo"):
+                    clock.advance(2.0)
+                    instrumentation.count("beats", 4)
+            assert parse() == "parsed"
+            clock.advance(0.25)
+    return profile
+
+
+def test_disabled_by_default(clock):
+    assert not instrumentation.is_enabled()
+    assert instrumentation.stage("a") is instrumentation.stage("b")
+    with instrumentation.piece("piece") as profile:
+        assert profile is None
+    assert run_piece(clock, "piece") is None
+    instrumentation.count("notes")
+    assert instrumentation.get_profiles() == []
+    assert instrumentation._current.stages == {} and instrumentation._current.counters == {}
+
+
+def test_nested_stages_and_counters(clock):
+    instrumentation.enable()
+    profile = run_piece(clock, "A/piece1")
+    assert profile.name == "A/piece1"
+    assert profile.stages == {
+        "piece": {"calls": 1, "seconds": 5.75, "self_seconds": 0.5},
+        "piece;boundaries": {"calls": 1, "seconds": 5.25, "self_seconds": 0.25},
+        "piece;boundaries;tempo": {"calls": 2, "seconds": 4.0, "self_seconds": 4.0},
+        "piece;boundaries;parse": {"calls": 1, "seconds": 1.0, "self_seconds": 1.0},
+    }
+    assert profile.counters == {"beats": 8, "notes": 10}
+    # The piece does not count in the profile outside the pieces, which gets the stages run outside
+    assert instrumentation._current.stages == {}
+    with instrumentation.stage("outside"):
+        clock.advance(1.0)
+    instrumentation.count("files")
+    assert instrumentation._current.stages == {"outside": {"calls": 1, "seconds": 1.0, "self_seconds": 1.0}}
+    assert instrumentation.get_profiles() == [instrumentation._current]
+
+
+def test_profiles_sent_back_with_the_results(clock):
+    instrumentation.enable()
+    profile = run_piece(clock, "A/piece1")
+    results = [("a", {"value": 1, "profile": profile.to_dict()}, None), ("b", None, {"error": "ValueError"})]
+    assert list(instrumentation.collect_profiles(results)) == [("a", {"value": 1}, None),
+                                                               ("b", None, {"error": "ValueError"})]
+    [collected] = instrumentation.get_profiles()
+    assert collected.to_dict() == profile.to_dict()
+    instrumentation.reset()
+    assert instrumentation.get_profiles() == []
+
+
+@pytest.fixture
+def two_profiles(clock):
+    instrumentation.enable()
+    for name in ("A/piece1", "A/piece2"):
+        instrumentation.add_profile(run_piece(clock, name))
+    with instrumentation.stage("outside"):
+        clock.advance(1.0)
+    return instrumentation.get_profiles()
+
+
+def test_export_json(two_profiles, tmp_path):
+    path = str(tmp_path / "profile.json")
+    instrumentation.export_json(path)
+    with open(path, "r") as f:
+        data = json.load(f)
+    assert [profile["name"] for profile in data] == ["A/piece1", "A/piece2", ""]
+    assert data[0] == {"name": "A/piece1", "stages": two_profiles[0].stages, "counters": {"beats": 8, "notes": 10}}
+    instrumentation.export_json(path, with_events=True)
+    with open(path, "r") as f:
+        assert len(json.load(f)[1]["events"]) == 5
+
+
+def test_export_chrome_trace(two_profiles, tmp_path):
+    path = str(tmp_path / "trace.json")
+    instrumentation.export_chrome_trace(path)
+    with open(path, "r") as f:
+        trace = json.load(f)
+    events = trace["traceEvents"]
+    assert len(events) == 11
+    assert {event["ph"] for event in events} == {"X"}
+    # Events are written as they close, the piece last, in microseconds
+    first_piece = events[4]
+    assert (first_piece["name"], first_piece["ts"], first_piece["dur"]) == ("piece", 100e6, 5.75e6)
+    assert first_piece["args"] == {"piece": "A/piece1"}
+    assert events[-1]["name"] == "outside" and events[-1]["args"] == {"piece": ""}
+
+
+def test_export_collapsed_stacks(two_profiles, tmp_path):
+    path = str(tmp_path / "stacks.txt")
+    instrumentation.export_collapsed_stacks(path)
+    with open(path, "r") as f:
+        lines = f.read().splitlines()
+    # The self times of the two pieces are added up
+    assert lines == ["outside 1000000", "piece 1000000", "piece;boundaries 500000", "piece;boundaries;parse 2000000",
+                     "piece;boundaries;tempo 8000000"]
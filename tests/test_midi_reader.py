@@ -0,0 +1,37 @@
+import glob
+
+import pytest
+
+from benchmarks.synthetic_corpus import generate_corpus
+from src import feature_cache
+from src.midi_reader import best_match, validate_native_reader
+
+pytest.importorskip("music21")
+
+
+@pytest.fixture(scope="module")
+def synthetic_midi_files(tmp_path_factory) -> list:
+    # Size8/piece1/Performer00 and Size32/piece2/Performer01 have notes tied over a barline starting with
+    # another note, the triplets of the performances exercise the quantization
+    root = tmp_path_factory.mktemp("synthetic_corpus")
+    generate_corpus(str(root), [8, 32], pieces_per_size=3, nb_performances=3, seed=7)
+    return sorted(glob.glob(str(root / "*" / "*" / "*.mid")))
+
+
+@pytest.fixture(autouse=True)
+def no_cache(monkeypatch):
+    # Both readers parse the files
+    monkeypatch.setenv(feature_cache.NO_CACHE_ENV, "1")
+
+
+def test_native_reader_matches_music21(synthetic_midi_files):
+    assert len(synthetic_midi_files) == 24
+    for midi_file in synthetic_midi_files:
+        report = validate_native_reader(midi_file)
+        assert report == dict.fromkeys(report), midi_file
+
+
+def test_best_match_fills_the_gap():
+    # 0.854 quarter lengths before a note one quarter later: music21 keeps 0.75 (the gap is on the 1/4 grid)
+    assert best_match(0.8541666666666666, zero_allowed=False, gap_to_fill=1.0) == 0.75
+    assert best_match(0.05, zero_allowed=False) == 0.25
@@ -0,0 +1,48 @@
+import random
+
+import pytest
+
+from src.motif_index import KEYS, MotifIndex, get_ngrams
+
+
+def make_piece(rng: random.Random, size: int, ngram_length: int) -> tuple:
+    columns = {
+        "interval": [None] + [rng.choice([-2, 0, 2]) for _ in range(size - 1)],
+        "root": [rng.choice([60, 62]) for _ in range(size)],
+        "duration": [rng.choice([0.5, 1.0]) for _ in range(size)],
+    }
+    positions = [(index // 4 + 1, float(index % 4)) for index in range(size)]
+    piece = {"file_hash": str(size), "positions": positions,
+             "ngrams": {key: get_ngrams(columns[key], ngram_length) for key in KEYS}}
+    return columns, piece
+
+
+def find_by_scan(pieces: dict, pattern: list, key: str, composers: list) -> list:
+    occurrences = []
+    for path, (composer, columns, positions) in sorted(pieces.items()):
+        if composers and composer not in composers:
+            continue
+        values = columns[key]
+        occurrences += [(path, positions[start]) for start in range(len(values) - len(pattern) + 1)
+                        if values[start:start + len(pattern)] == pattern]
+    return occurrences
+
+
+@pytest.mark.parametrize("ngram_length", [1, 3, 4])
+def test_find_is_a_scan_of_the_pieces(tmp_path, ngram_length):
+    rng = random.Random(ngram_length)
+    pieces = {}
+    with MotifIndex(str(tmp_path / "motifs.db"), ngram_length) as index:
+        for number in range(6):
+            path = f"composer{number % 3}/piece{number}/midi_score.mid"
+            columns, piece = make_piece(rng, rng.randint(1, 40), ngram_length)
+            index.add(path, piece, f"composer{number % 3}")
+            pieces[path] = (f"composer{number % 3}", columns, piece["positions"])
+        for _ in range(60):
+            key = rng.choice(KEYS)
+            path = rng.choice(sorted(pieces))
+            values = pieces[path][1][key]
+            start = rng.randrange(len(values))
+            pattern = values[start:start + rng.randint(1, 10)]
+            composers = rng.choice([None, ["composer1"], ["composer0", "composer2"]])
+            assert index.find(pattern, key, composers) == find_by_scan(pieces, pattern, key, composers)
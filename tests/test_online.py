@@ -0,0 +1,88 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+from src.boundary_fusion import filter_closest
+from src.online import OnlinePhraseDetector, OnlineVelocitySpikeDetector
+from src.task_c1 import (get_phrase_boundaries_from_tempo, get_scaled_differences_in_volumes, get_tempo_ratios,
+                         get_times_threshold)
+
+
+def random_beats(rng: random.Random) -> tuple:
+    nb_beats = rng.randint(0, 40)
+    symbolic_onsets = np.cumsum([rng.choice([0.5, 1.0, 1.0, 1.5]) for _ in range(nb_beats)])
+    performed_onsets = np.cumsum([rng.uniform(0.3, 1.2) for _ in range(nb_beats)])
+    for index in range(nb_beats):
+        if rng.random() < 0.05:
+            performed_onsets[index] = math.nan
+        elif index and rng.random() < 0.03:
+            # Two beats played together
+            performed_onsets[index] = performed_onsets[index - 1]
+    beats_per_measure = rng.randint(1, 4)
+    offset = rng.randint(0, 3)
+    beat_types = ["db" if (index + offset) % beats_per_measure == 0 else "b" for index in range(nb_beats)]
+    return symbolic_onsets, performed_onsets, beat_types
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_online_phrase_detector(seed):
+    symbolic_onsets, performed_onsets, beat_types = random_beats(random.Random(seed))
+    detector = OnlinePhraseDetector()
+    for beat in zip(symbolic_onsets, performed_onsets, beat_types):
+        detector.add_beat(*beat)
+    detector.finish()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Beats played together or missed give infinite or NaN ratios
+        tempo_ratios, indexes_db = get_tempo_ratios(symbolic_onsets, performed_onsets, beat_types)
+        expected = get_phrase_boundaries_from_tempo(tempo_ratios, indexes_db) if len(symbolic_onsets) else []
+    assert [index for index, _ in detector.boundaries] == expected
+    for index, onset in detector.boundaries:
+        assert onset == performed_onsets[index] or (math.isnan(onset) and math.isnan(performed_onsets[index]))
+
+
+def test_online_phrase_detector_decides_on_the_next_downbeat():
+    detector = OnlinePhraseDetector()
+    # Slowing down in the first measure, speeding up in the second one
+    decided = [detector.add_beat(symbolic, performed, beat_type) for symbolic, performed, beat_type in
+               [(0, 0.0, "db"), (1, 1.0, "b"), (2, 2.2, "b"), (3, 3.6, "db"), (4, 4.8, "b"), (5, 5.8, "b"),
+                (6, 6.6, "db"), (7, 7.4, "b")]]
+    assert decided == [[], [(0, 0.0)], [], [], [], [], [(3, 3.6)], []]
+    assert detector.finish() == [(6, 6.6)]
+    with pytest.raises(ValueError):
+        detector.add_beat(8, 8.2, "b")
+
+
+def random_notes(rng: random.Random) -> tuple:
+    nb_notes = rng.randint(2, 60)
+    times = np.cumsum([rng.choice([0.25, 0.5, 1.0, 2.0, 3.0]) for _ in range(nb_notes)]).tolist()
+    velocities = [rng.choice([40, 60, 64, 80, 100, rng.randint(1, 127)]) for _ in range(nb_notes)]
+    return times, velocities
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_online_velocity_spike_detector(seed):
+    rng = random.Random(seed)
+    times, velocities = random_notes(rng)
+    threshold = rng.choice([0.05, 0.15, 0.3])
+    min_distance = rng.choice([0, 1, 2, 4])
+    differences = [abs(velocity - next_velocity) ** 2 for velocity, next_velocity in zip(velocities, velocities[1:])]
+    if max(differences) == 0:
+        return
+    # With the maximum of the whole stream, the batch functions
+    detector = OnlineVelocitySpikeDetector(threshold, min_distance, max_difference=max(differences))
+    for time, velocity in zip(times, velocities):
+        detector.add_note(time, velocity)
+    expected = filter_closest(get_times_threshold(times, get_scaled_differences_in_volumes(velocities), threshold),
+                              min_distance)
+    assert detector.split_points == expected
+
+    # With any other fixed scale
+    max_difference = rng.choice([100, 1000, 10000])
+    detector = OnlineVelocitySpikeDetector(threshold, min_distance, max_difference)
+    returned = [detector.add_note(time, velocity) for time, velocity in zip(times, velocities)]
+    expected = filter_closest(get_times_threshold(times, [difference / max_difference for difference in differences],
+                                                  threshold), min_distance)
+    assert detector.split_points == expected
+    assert [time for time in returned if time is not None] == expected
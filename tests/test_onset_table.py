@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from benchmarks.synthetic_corpus import generate_piece
+from src.midi_features import extract_midi_features
+from src.midi_reader import load_native_midi_features
+from src.onset_table import NO_INTERVAL, OnsetTable
+
+COLUMNS = ("measures", "offsets", "durations", "roots", "intervals", "pitches", "pitch_starts")
+
+
+def get_onsets(midi_data) -> dict:
+    # The dict of the onsets built by extract_midi_features before the onset table
+    onsets = {}
+    for n in midi_data.recurse().notes:
+        if n.isNote:
+            pitches = {n.pitch.midi}
+        elif n.isChord:
+            pitches = {p.midi for p in n.pitches}
+        else:
+            continue
+        if (n.measureNumber, n.offset) not in onsets:
+            onsets[(n.measureNumber, n.offset)] = {'pitch': pitches, 'duration': n.duration.quarterLength}
+        else:
+            onsets[(n.measureNumber, n.offset)]['pitch'].update(pitches)
+    return onsets
+
+
+def build_from_onsets(onsets: dict) -> OnsetTable:
+    # OnsetTable.from_midi_features before the table was built from the note events
+    pitch_sets = [sorted(value['pitch']) for value in onsets.values()]
+    return OnsetTable.from_arrays(
+        [-1 if measure is None else measure for measure, _ in onsets],
+        [float(offset) for _, offset in onsets],
+        [float(value['duration']) for value in onsets.values()],
+        [pitch for pitches in pitch_sets for pitch in pitches],
+        np.cumsum([0] + [len(pitches) for pitches in pitch_sets]),
+    )
+
+
+def assert_same_table(table: OnsetTable, expected: OnsetTable):
+    for name in COLUMNS:
+        assert np.array_equal(getattr(table, name), getattr(expected, name)), name
+        assert getattr(table, name).dtype == getattr(expected, name).dtype, name
+
+
+@pytest.fixture(scope="module")
+def score_file(tmp_path_factory) -> str:
+    folder = tmp_path_factory.mktemp("corpus") / "piece0"
+    generate_piece(str(folder), 16, nb_performances=0, seed=16000)
+    return str(folder / "midi_score.mid")
+
+
+def test_music21_table_matches_the_onsets(score_file):
+    music21 = pytest.importorskip("music21")
+    midi_data = music21.converter.parse(score_file)
+    table = extract_midi_features(midi_data, score_file).onset_table
+    assert len(table) > 0
+    assert_same_table(table, build_from_onsets(get_onsets(midi_data)))
+
+
+def test_native_table_matches_the_onsets(score_file):
+    music21 = pytest.importorskip("music21")
+    table = load_native_midi_features(score_file).onset_table
+    assert table.to_dict() == build_from_onsets(get_onsets(music21.converter.parse(score_file))).to_dict()
+
+
+def test_events_at_the_same_position_are_one_onset():
+    # A chord, the same pitch in another part, an onset without measure
+    table = OnsetTable.from_events([2, 1, 2, 2, 2, None], [0.0, 0.0, 0.0, 0.0, 1.0, 0.5],
+                                   [1.0, 2.0, 1.0, 0.5, 1.0, 1.0], [64, 60, 67, 64, 62, 70])
+    assert table.to_dict() == {
+        (None, 0.5): {'pitch': {70}, 'root': 70, 'interval': 8, 'duration': 1.0},
+        (1, 0.0): {'pitch': {60}, 'root': 60, 'interval': None, 'duration': 2.0},
+        (2, 0.0): {'pitch': {64, 67}, 'root': 64, 'interval': None, 'duration': 1.0},
+        (2, 1.0): {'pitch': {62}, 'root': 62, 'interval': 2, 'duration': 1.0},
+    }
+    assert table.intervals[1] == NO_INTERVAL
+
+
+def test_no_events():
+    table = OnsetTable.from_events([], [], [], [])
+    assert len(table) == 0 and table.pitch_starts.tolist() == [0]
@@ -0,0 +1,70 @@
+import os
+import time
+
+import pytest
+
+from src.parallel import run_in_parallel
+from src.prefetch import get_prefetched, read_bytes
+
+CRASH = 5
+SLOW = 0
+TIMEOUT = 7
+
+
+def run_item(item: int) -> int:
+    if item == CRASH:
+        os._exit(1)
+    if item == SLOW:
+        time.sleep(1)
+    if item == TIMEOUT:
+        time.sleep(10)
+    return item * 2
+
+
+def test_only_the_crashing_item_fails():
+    results = list(run_in_parallel(run_item, [item for item in range(10) if item != TIMEOUT], workers=3))
+    assert [item for item, _, _ in results] == [item for item in range(10) if item != TIMEOUT]
+    for item, result, error in results:
+        if item == CRASH:
+            assert error["error"] == "BrokenProcessPool"
+        else:
+            assert error is None and result == item * 2
+
+
+def test_timeout_is_reported_when_the_pool_breaks():
+    results = {item: (result, error) for item, result, error in
+               run_in_parallel(run_item, [SLOW, TIMEOUT, CRASH, 1, 2], workers=3, timeout=2)}
+    assert results[CRASH][1]["error"] == "BrokenProcessPool"
+    assert results[TIMEOUT][1]["error"] == "PieceTimeout"
+    assert results[SLOW] == (0, None)
+    assert results[1] == (2, None) and results[2] == (4, None)
+
+
+def test_chunks_are_isolated_after_a_second_break():
+    results = list(run_in_parallel(run_item, [1, 2, CRASH, 3, 4, 6], workers=2, chunk_size=3))
+    assert [(item, error["error"] if error else result) for item, result, error in results] == \
+        [(1, 2), (2, 4), (CRASH, "BrokenProcessPool"), (3, 6), (4, 8), (6, 12)]
+
+
+def get_item_files(path: str) -> list:
+    return [path]
+
+
+def read_item(path: str) -> tuple:
+    # Whether the file was read ahead, and its content
+    return get_prefetched(path) is not None, read_bytes(path)
+
+
+@pytest.mark.parametrize("workers, chunk_size", [(1, 1), (2, 1), (3, 2)])
+def test_files_are_read_ahead(tmp_path, workers, chunk_size):
+    paths = []
+    for index in range(7):
+        (tmp_path / f"{index}.txt").write_bytes(str(index).encode())
+        paths.append(str(tmp_path / f"{index}.txt"))
+    paths.append(str(tmp_path / "missing.txt"))
+    results = list(run_in_parallel(read_item, paths, workers, chunk_size, get_files=get_item_files))
+    assert [item for item, _, _ in results] == paths
+    for index, (_, result, error) in enumerate(results[:-1]):
+        assert error is None and result == (True, str(index).encode())
+    assert results[-1][2]["error"] == "FileNotFoundError"
+    assert get_prefetched(paths[0]) is None
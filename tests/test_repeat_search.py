@@ -0,0 +1,55 @@
+import random
+from fractions import Fraction
+
+import pytest
+
+from src.repeat_search import find_repeated_patterns
+
+
+def find_repeated_patterns_baseline(seq: list, pos: list, dur: list, min_duration: float = 6.0) -> list:
+    # find_repeating_sequences of the original model, without the sorting of the onsets
+    n = len(seq)
+    patterns = []
+    seen = {}
+    for i in range(n):
+        for length in range(1, n - i):
+            pattern = tuple(seq[i:i + length])
+            if pattern in seen:
+                first_occurrence = seen[pattern]
+                if i - first_occurrence[0] >= length:
+                    total_duration = sum(dur[first_occurrence[0]:first_occurrence[0] + length])
+                    if total_duration >= min_duration:
+                        if pattern not in [p[0] for p in patterns]:
+                            patterns.append((pattern, [first_occurrence[1]]))
+                        for pat in patterns:
+                            if pat[0] == pattern:
+                                pat[1].append(pos[i])
+            else:
+                seen[pattern] = (i, pos[i])
+
+    patterns.sort(key=lambda x: len(x[0]), reverse=True)
+    filtered_patterns = []
+    for pattern, positions in patterns:
+        is_sub_pattern = False
+        for longer_pattern, _ in filtered_patterns:
+            if len(pattern) < len(longer_pattern):
+                for j in range(len(longer_pattern) - len(pattern) + 1):
+                    if pattern == longer_pattern[j:j + len(pattern)]:
+                        is_sub_pattern = True
+                        break
+        if not is_sub_pattern:
+            filtered_patterns.append((pattern, positions))
+    return filtered_patterns
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_find_repeated_patterns(seed):
+    rng = random.Random(seed)
+    size = rng.randint(0, 50)
+    alphabet = [None, -3, 0, 2, 7][:rng.randint(1, 5)]
+    sequence = [rng.choice(alphabet) for _ in range(size)]
+    positions = [(index // 4 + 1, float(index % 4)) for index in range(size)]
+    durations = [rng.choice([0.5, 1.0, 2.0, Fraction(1, 3)]) for _ in range(size)]
+    min_duration = rng.choice([1.0, 3.0, 6.0])
+    assert find_repeated_patterns(sequence, positions, durations, min_duration) == \
+        find_repeated_patterns_baseline(sequence, positions, durations, min_duration)
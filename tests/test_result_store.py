@@ -0,0 +1,98 @@
+import json
+
+from src.result_store import ResultStore, get_parameters_hash, run_with_store
+
+PARAMETERS = {"min_duration": 6.0, "measure_spacing": 2}
+ERROR = {"error": "MidiException", "message": "badly formatted midi bytes"}
+
+
+class FakeRun:
+    """
+    Run function of run_with_store, remembering the items it was asked to run
+    """
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.calls = []
+
+    def __call__(self, items: list):
+        self.calls.append(list(items))
+        return self._run(items)
+
+    def _run(self, items: list):
+        for item in items:
+            if item in self.failing:
+                yield item, None, ERROR
+            else:
+                yield item, {"value": item * 2}, None
+
+
+def run(store, parameters, resume=True, failing=()) -> tuple:
+    fake_run = FakeRun(failing)
+    results = list(run_with_store(fake_run, [1, 2, 3], ["a", "b", "c"], parameters, store, resume))
+    return fake_run.calls[0], results
+
+
+def test_a_line_cut_short_is_ignored(tmp_path):
+    path = str(tmp_path / "store.jsonl")
+    with ResultStore(path) as store:
+        store.append("a", PARAMETERS, {"value": 1})
+        store.append("b", PARAMETERS, {"value": 2})
+    with open(path, "a") as f:
+        f.write('{"piece": "c", "parameters": {"min_dur')
+
+    store = ResultStore(path)
+    assert store.records == {("a", get_parameters_hash(PARAMETERS)): {"value": 1},
+                             ("b", get_parameters_hash(PARAMETERS)): {"value": 2}}
+    store.append("c", PARAMETERS, {"value": 3})
+    store.close()
+    with open(path, "r") as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 4 and json.loads(lines[-1])["piece"] == "c"
+    assert ResultStore(path).get("c", PARAMETERS) == {"value": 3}
+
+
+def test_the_last_record_wins(tmp_path):
+    path = str(tmp_path / "store.jsonl")
+    with ResultStore(path) as store:
+        store.append("a", PARAMETERS, ERROR)
+        store.append("a", PARAMETERS, {"value": 1})
+    assert ResultStore(path).get("a", PARAMETERS) == {"value": 1}
+
+
+def test_resume_skips_the_same_parameters_only(tmp_path):
+    path = str(tmp_path / "subfolder" / "store.jsonl")
+    ran, results = run(path, PARAMETERS)
+    assert ran == [1, 2, 3]
+    assert results == [("a", {"value": 2}, None, False), ("b", {"value": 4}, None, False),
+                       ("c", {"value": 6}, None, False)]
+
+    ran, results = run(path, dict(reversed(list(PARAMETERS.items()))))
+    assert ran == []
+    assert results == [("a", {"value": 2}, None, True), ("b", {"value": 4}, None, True),
+                       ("c", {"value": 6}, None, True)]
+
+    assert run(path, dict(PARAMETERS, min_duration=4.0))[0] == [1, 2, 3]
+    # Without resume every piece runs again
+    assert run(path, PARAMETERS, resume=False)[0] == [1, 2, 3]
+
+
+def test_errors_are_stored_and_run_again(tmp_path):
+    path = str(tmp_path / "store.jsonl")
+    ran, results = run(path, PARAMETERS, failing=[2])
+    assert results[1] == ("b", None, ERROR, False)
+    store = ResultStore(path)
+    assert store.get("b", PARAMETERS) == ERROR
+    assert not store.is_done("b", PARAMETERS) and store.is_done("a", PARAMETERS)
+
+    ran, results = run(path, PARAMETERS)
+    assert ran == [2]
+    assert [from_store for _, _, _, from_store in results] == [True, False, True]
+    assert ResultStore(path).get("b", PARAMETERS) == {"value": 4}
+
+
+def test_an_open_store_is_not_closed(tmp_path):
+    with ResultStore(str(tmp_path / "store.jsonl")) as store:
+        run(store, PARAMETERS)
+        assert store._file is not None
+        assert run(store, PARAMETERS)[0] == []
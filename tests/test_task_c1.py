@@ -0,0 +1,86 @@
+import random
+
+import numpy as np
+import pytest
+
+from src.task_c1 import get_phrase_boundaries_from_tempo, get_phrase_boundaries_from_tempo_batch, \
+    get_tempo_map_db
+
+
+def get_tempo_map_db_baseline(symbolic_to_performed_times: dict) -> tuple:
+    result = {}
+    indexes = []
+    for i in range(len(symbolic_to_performed_times) - 1):
+        beat_type = symbolic_to_performed_times[i]["performed"]["beat_type"]
+        if beat_type == "db":
+            indexes.append(i)
+        onset = symbolic_to_performed_times[i]["performed"]["onset"]
+        next_onset = symbolic_to_performed_times[i + 1]["performed"]["onset"]
+        duration_performed = float(next_onset) - float(onset)
+        onset_symbolic = symbolic_to_performed_times[i]["symbolic"]["onset"]
+        next_onset_symbolic = symbolic_to_performed_times[i + 1]["symbolic"]["onset"]
+        duration_symbolic = float(next_onset_symbolic) - float(onset_symbolic)
+        result[i] = duration_symbolic / duration_performed
+    if symbolic_to_performed_times[len(symbolic_to_performed_times) - 1]["performed"]["beat_type"] == "db":
+        indexes.append(len(symbolic_to_performed_times) - 1)
+    return result, indexes
+
+
+def get_phrase_boundaries_baseline(tempo_map: dict, indexes_db: list) -> list:
+    # Loop of get_phrase_boundaries in the original model
+    phrase_boundaries = []
+    for i in range(len(tempo_map)):
+        if i in indexes_db:
+            current_index = indexes_db.index(i)
+            if current_index == 0:
+                phrase_boundaries.append(i)
+                continue
+            last_db = indexes_db[current_index - 1]
+            if current_index == len(indexes_db) - 1:
+                phrase_boundaries.append(i)
+                continue
+            next_db = indexes_db[current_index + 1]
+            last_measure = list(tempo_map.values())[last_db:i]
+            next_measure = list(tempo_map.values())[i:next_db]
+            last_measure_change = 0
+            for j in range(len(last_measure) - 1):
+                last_measure_change += last_measure[j + 1] - last_measure[j]
+            last_measure_change = last_measure_change / len(last_measure)
+            next_measure_change = 0
+            for j in range(len(next_measure) - 1):
+                next_measure_change += next_measure[j + 1] - next_measure[j]
+            next_measure_change = next_measure_change / len(next_measure)
+            if last_measure_change * next_measure_change < 0:
+                if next_measure_change > 0:
+                    phrase_boundaries.append(i)
+    return phrase_boundaries
+
+
+def random_timing(rng: random.Random, nb_beats: int) -> dict:
+    timing = {}
+    performed = 0.0
+    for beat in range(nb_beats):
+        beat_type = "db" if beat == 0 or rng.random() < 0.3 else "b"
+        timing[beat] = {"symbolic": {"onset": str(beat * 0.5)},
+                        "performed": {"onset": str(round(performed, 6)), "beat_type": beat_type}}
+        performed += rng.uniform(0.3, 0.7)
+    return timing
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_phrase_boundaries(seed):
+    rng = random.Random(seed)
+    timing = random_timing(rng, rng.randint(2, 80))
+    expected_map, expected_indexes = get_tempo_map_db_baseline(timing)
+    tempo_map, indexes_db = get_tempo_map_db(timing)
+    assert tempo_map == expected_map and indexes_db == expected_indexes
+    assert get_phrase_boundaries_from_tempo(np.array(list(tempo_map.values())), np.array(indexes_db)) == \
+        get_phrase_boundaries_baseline(expected_map, expected_indexes)
+
+
+def test_phrase_boundaries_batch():
+    rng = random.Random(0)
+    indexes_db = np.array([0, 3, 7, 10, 14, 18])
+    ratios = np.array([[rng.uniform(0.8, 1.2) for _ in range(20)] for _ in range(5)])
+    assert get_phrase_boundaries_from_tempo_batch(ratios, indexes_db) == \
+        [get_phrase_boundaries_from_tempo(row, indexes_db) for row in ratios]
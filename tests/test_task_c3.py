@@ -0,0 +1,55 @@
+import random
+
+import pytest
+
+from benchmarks.synthetic_corpus import generate_piece
+from src.midi_features import extract_midi_features
+from src.repeat_search import find_repeated_patterns, find_repeated_patterns_multi
+from src.task_c3 import get_boundaries, merge_pattern_boundaries
+
+
+def merge_pattern_boundaries_baseline(boundaries: list, measure_spacing: int = 2) -> list:
+    # De-duplication of get_boundaries in the original model
+    boundaries = list(set(boundaries))
+    boundary_results = set()
+    for (measure, offset) in boundaries:
+        for result in boundary_results:
+            if abs(result - measure) < measure_spacing:
+                break
+        else:
+            boundary_results.add(measure)
+    return sorted(boundary_results)
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_merge_pattern_boundaries(seed):
+    rng = random.Random(seed)
+    boundaries = [(rng.randint(1, 40), rng.choice([0.0, 1.0, 2.5])) for _ in range(rng.randint(0, 30))]
+    measure_spacing = rng.choice([1, 2, 3])
+    assert merge_pattern_boundaries(boundaries, measure_spacing) == \
+        merge_pattern_boundaries_baseline(boundaries, measure_spacing)
+
+
+def test_boundaries_of_a_synthetic_piece(tmp_path):
+    # Size16/piece0 of benchmarks.synthetic_corpus.generate_corpus, the boundaries of the original model
+    music21 = pytest.importorskip("music21")
+    generate_piece(str(tmp_path), 16, nb_performances=0, seed=16000)
+    midi_file = str(tmp_path / "midi_score.mid")
+    features = extract_midi_features(music21.converter.parse(midi_file), midi_file)
+    assert get_boundaries(features) == [2, 9, 12, 14]
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_multi_search_is_the_search_of_each_sequence(seed):
+    rng = random.Random(seed)
+    size = rng.randint(0, 60)
+    sequences = {
+        "interval": [rng.choice([None, -2, 2, 5]) for _ in range(size)],
+        "root": [rng.choice([60, 62, 64]) for _ in range(size)],
+        "duration": [rng.choice([0.5, 1.0]) for _ in range(size)],
+    }
+    positions = [(index // 4 + 1, float(index % 4)) for index in range(size)]
+    durations = sequences["duration"]
+    patterns = find_repeated_patterns_multi(sequences, positions, durations, 3.0)
+    assert patterns == {name: find_repeated_patterns(sequence, positions, durations, 3.0)
+                        for name, sequence in sequences.items()}
@@ -0,0 +1,95 @@
+import math
+import random
+import statistics
+
+import numpy as np
+import pytest
+
+from src.timing_for_one_piece import get_average_timing_one_piece, get_onset_statistics
+
+
+def get_onset_statistics_baseline(matrix: np.ndarray, trim: float = 0.1) -> dict:
+    # One beat at a time, the performances that have the beat
+    output = {"mean": [], "median": [], "variance": [], "trimmed_mean": [], "count": []}
+    for column in matrix.T:
+        values = sorted(float(value) for value in column if not math.isnan(value))
+        output["count"].append(len(values))
+        if not values:
+            for name in ("mean", "median", "variance", "trimmed_mean"):
+                output[name].append(math.nan)
+            continue
+        cut = math.floor(trim * len(values))
+        output["mean"].append(statistics.fmean(values))
+        output["median"].append(statistics.median(values))
+        output["variance"].append(statistics.pvariance(values))
+        output["trimmed_mean"].append(statistics.fmean(values[cut:len(values) - cut]))
+    return output
+
+
+def assert_same_statistics(result: dict, expected: dict):
+    assert result["count"].tolist() == expected["count"]
+    for name in ("mean", "median", "variance", "trimmed_mean"):
+        np.testing.assert_allclose(result[name], expected[name], rtol=1e-12, atol=1e-12, err_msg=name)
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_onset_statistics(seed):
+    rng = random.Random(seed)
+    nb_performances, nb_beats = rng.randint(1, 25), rng.randint(1, 12)
+    matrix = np.array([[rng.uniform(0, 100) for _ in range(nb_beats)] for _ in range(nb_performances)])
+    for row in range(nb_performances):
+        # A missed beat, or a performance stopping before the end of the score
+        if rng.random() < 0.3:
+            matrix[row, rng.randrange(nb_beats)] = np.nan
+        if rng.random() < 0.2:
+            matrix[row, rng.randrange(nb_beats):] = np.nan
+    trim = rng.choice([0.0, 0.1, 0.25])
+    assert_same_statistics(get_onset_statistics(matrix, trim), get_onset_statistics_baseline(matrix, trim))
+
+
+def test_onset_statistics_of_a_beat_no_performance_has():
+    matrix = np.array([[1.0, 2.0, np.nan], [1.5, np.nan, np.nan], [0.5, 3.0, np.nan]])
+    result = get_onset_statistics(matrix)
+    assert result["count"].tolist() == [3, 2, 0]
+    for name in ("mean", "median", "variance", "trimmed_mean"):
+        assert np.isnan(result[name][2]) and not np.isnan(result[name][:2]).any(), name
+    assert_same_statistics(result, get_onset_statistics_baseline(matrix))
+
+
+def write_annotations(path, onsets: list):
+    labels = ["db,3/4,0"] + ["b"] * 2 + ["db"] + ["b"] * 2
+    with open(path, "w") as f:
+        for onset, label in zip(onsets, labels):
+            f.write(f"{onset}\t{onset}\t{label}\n")
+
+
+@pytest.fixture
+def piece_with_a_missing_beat(tmp_path) -> tuple:
+    performances = [[0.0, 1.0, 2.1, 3.0, 4.2, 5.0], [0.1, 0.9, 2.0, 3.3, 4.0], [0.2, 1.2, 2.2, 3.1, 4.1]]
+    write_annotations(tmp_path / "midi_score_annotations.txt", [0, 1, 2, 3, 4, 5])
+    for index, onsets in enumerate(performances):
+        write_annotations(tmp_path / f"Performer{index}_annotations.txt", onsets)
+    return str(tmp_path), performances
+
+
+@pytest.mark.parametrize("statistic", ["mean", "median", "trimmed_mean"])
+def test_average_timing_with_a_missing_beat(piece_with_a_missing_beat, statistic):
+    folder, performances = piece_with_a_missing_beat
+    result = get_average_timing_one_piece(folder, statistic)
+    assert sorted(result) == list(range(6))
+    for beat in range(6):
+        onsets = [onsets[beat] for onsets in performances if beat < len(onsets)]
+        expected = statistics.median(onsets) if statistic == "median" else statistics.fmean(onsets)
+        assert result[beat]["performed"]["onset"] == pytest.approx(expected)
+        assert result[beat]["symbolic"]["onset"] == beat
+        assert result[beat]["performed"]["beat_type"] == ("db" if beat % 3 == 0 else "b")
+        assert result[beat]["performed"]["meter"] == "3/4"
+
+
+def test_average_timing_of_a_beat_no_performance_has(tmp_path):
+    write_annotations(tmp_path / "midi_score_annotations.txt", [0, 1, 2, 3, 4, 5])
+    write_annotations(tmp_path / "Performer0_annotations.txt", [0.0, 1.0, 2.0, 3.0, 4.0])
+    write_annotations(tmp_path / "Performer1_annotations.txt", [0.0, 1.2, 2.2, 3.2, 4.2])
+    result = get_average_timing_one_piece(str(tmp_path))
+    assert result[4]["performed"]["onset"] == pytest.approx(4.1)
+    assert math.isnan(result[5]["performed"]["onset"])